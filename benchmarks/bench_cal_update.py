@@ -0,0 +1,116 @@
+#!/usr/bin/python
+"""Compares per row updates of the run calibrations against the interpolated
+bulk updates of dbops.write_run_calibrations on a synthetic batch"""
+import os
+import sys
+import shutil
+import tempfile
+import time
+import sqlite3 as sql
+import numpy as np
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from odacblib import databaseops as dbops
+from odacblib import calfit as cf
+import synthetic
+
+NUM_DETS = 50
+NUM_RUNS = 10000
+NUM_BLOCKS = 4
+
+
+def make_fits(det_nums, num_blocks, seed=0):
+    """Generates block calibrations that drift slowly from block to block
+
+    Parameters
+    ----------
+    det_nums : list of int
+        The detector numbers
+    num_blocks : int
+        The number of calibration blocks
+    seed : int
+        The seed for the random number generator
+
+    Returns
+    -------
+    fits : dict
+        The calibration of each detector and block, as from
+        cf.fit_calibrations
+    """
+    rng = np.random.RandomState(seed)
+    fits = {}
+    for det_num in det_nums:
+        base = np.array([0.01, 0.0009, 1e-9, 4e-4, 1.2e-3, 0.0])
+        for block in range(num_blocks):
+            vals = base * (1.0 + rng.normal(0.0, 0.01, len(base)))
+            fits[(det_num, block)] = dict(zip(cf.CAL_PARAM_NAMES, vals))
+            fits[(det_num, block)]["Success"] = True
+    return fits
+
+
+def per_row_update(run_db_path, det_nums, run_nums, run_params):
+    """Writes the run calibrations one execute per row and one commit per
+    detector table
+
+    Parameters
+    ----------
+    run_db_path : str
+        Path to the run database file
+    det_nums : list of int
+        The detector numbers
+    run_nums : numpy.ndarray
+        The run numbers
+    run_params : numpy.ndarray
+        Array of shape (runs, detectors, CAL_NAMES)
+    """
+    dbcon = sql.connect(run_db_path)
+    cursor = dbcon.cursor()
+    for ind, det_num in enumerate(det_nums):
+        cmd = dbops.RUN_CAL_UPDATE.format("det_{0:02d}_run_table".format(
+            det_num))
+        for run, run_num in enumerate(run_nums.tolist()):
+            cursor.execute(cmd, run_params[run, ind].tolist() + [run_num])
+        dbcon.commit()
+    dbcon.close()
+
+
+def main():
+    """Runs both update paths and prints the timings"""
+    num_dets = NUM_DETS if len(sys.argv) < 2 else int(sys.argv[1])
+    num_runs = NUM_RUNS if len(sys.argv) < 3 else int(sys.argv[2])
+    det_data = synthetic.make_det_data(num_dets)
+    det_nums = [x["DetNum"] for x in det_data]
+    run_cols = synthetic.make_run_columns(num_dets, num_runs)
+    block_len = num_runs // NUM_BLOCKS
+    runs = [(i * block_len, (i + 1) * block_len - 1, [], 0)
+            for i in range(NUM_BLOCKS)]
+    fits = make_fits(det_nums, NUM_BLOCKS)
+    work_dir = tempfile.mkdtemp()
+    try:
+        row_path = os.path.join(work_dir, "per_row.db")
+        dbops.make_batch_database(row_path, det_data, run_cols)
+        bulk_path = os.path.join(work_dir, "bulk.db")
+        shutil.copy(row_path, bulk_path)
+        start = time.time()
+        run_nums, center_times = dbops.read_run_times(bulk_path)
+        run_params = cf.interpolate_run_calibrations(
+            cf.block_center_times(run_nums, center_times, runs),
+            cf.results_to_array(fits, det_nums, len(runs)), center_times)
+        interp_time = time.time() - start
+        start = time.time()
+        per_row_update(row_path, det_nums, run_nums, run_params)
+        row_time = time.time() - start
+        start = time.time()
+        dbops.write_run_calibrations(bulk_path, det_nums, run_nums,
+                                     run_params)
+        bulk_time = time.time() - start
+    finally:
+        shutil.rmtree(work_dir)
+    print "{0:d} detectors x {1:d} runs".format(num_dets, num_runs)
+    print "    interpolation:   {0:8.3f} s".format(interp_time)
+    print "    per row updates: {0:8.3f} s".format(row_time)
+    print "    bulk updates:    {0:8.3f} s".format(bulk_time)
+    print "    speed up:        {0:8.2f}x".format(row_time / bulk_time)
+
+
+if __name__ == "__main__":
+    main()
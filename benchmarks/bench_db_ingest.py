@@ -0,0 +1,82 @@
+#!/usr/bin/python
+"""Compares the old per row inserts against the bulk executemany path of
+dbops.make_batch_database on a synthetic batch"""
+import os
+import sys
+import shutil
+import tempfile
+import time
+import sqlite3 as sql
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from odacblib import databaseops as dbops
+from odacblib import readrawdata as rrd
+import synthetic
+
+NUM_DETS = 50
+NUM_RUNS = 10000
+
+
+def per_row_build(run_db_path, det_data, run_cols):
+    """Builds the run database the way it used to be built, one execute per
+    row and one commit per table
+
+    Parameters
+    ----------
+    run_db_path : str
+        Path to the run database file to be created
+    det_data : list of dict
+        list of dictionary of the detector data
+    run_cols : dict
+        dictionary of numpy arrays of run data
+    """
+    det_run_data = rrd.det_run_view(run_cols)
+    dbcon = sql.connect(run_db_path)
+    cursor = dbcon.cursor()
+    cursor.execute(dbops.MAKE_DET_DATA_TABLE)
+    for data in det_data:
+        cursor.execute(dbops.DET_INSERT,
+                       dbops.generate_insert_list(data, dbops.DET_DATA_NAMES))
+    dbcon.commit()
+    cursor.execute(dbops.MAKE_RUN_TABLE)
+    for row in dbops.run_table_rows(run_cols):
+        cursor.execute(dbops.RUN_INSERT, row)
+    dbcon.commit()
+    for data in det_run_data:
+        table_name = "det_{0:02d}_run_table".format(data[0]["DetNum"])
+        cursor.execute(dbops.MAKE_DET_RUN_TABLE.format(table_name))
+        insert_cmd = dbops.DET_RUN_INSERT.format(table_name)
+        for run in data:
+            cursor.execute(insert_cmd, dbops.generate_insert_list(
+                run, dbops.DET_RUN_NAMES))
+        dbcon.commit()
+    cursor.execute("VACUUM")
+    dbcon.commit()
+    dbcon.close()
+
+
+def main():
+    """Runs both build paths and prints the timings"""
+    num_dets = NUM_DETS if len(sys.argv) < 2 else int(sys.argv[1])
+    num_runs = NUM_RUNS if len(sys.argv) < 3 else int(sys.argv[2])
+    det_data = synthetic.make_det_data(num_dets)
+    run_cols = synthetic.make_run_columns(num_dets, num_runs)
+    work_dir = tempfile.mkdtemp()
+    try:
+        row_path = os.path.join(work_dir, "per_row.db")
+        start = time.time()
+        per_row_build(row_path, det_data, run_cols)
+        row_time = time.time() - start
+        bulk_path = os.path.join(work_dir, "bulk.db")
+        start = time.time()
+        dbops.make_batch_database(bulk_path, det_data, run_cols)
+        bulk_time = time.time() - start
+    finally:
+        shutil.rmtree(work_dir)
+    print "{0:d} detectors x {1:d} runs".format(num_dets, num_runs)
+    print "    per row inserts: {0:8.3f} s".format(row_time)
+    print "    bulk inserts:    {0:8.3f} s".format(bulk_time)
+    print "    speed up:        {0:8.2f}x".format(row_time / bulk_time)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/python
+"""Times the import of each entry point of odacblib in a fresh interpreter,
+and shows which of the heavy modules (ROOT, scipy) each of them loads
+
+Only the calibration stages should load the heavy modules, importing the
+database or schedule modules, or the builder itself, should not"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the modules imported by the jobs that use the library, the last one is the
+# full cost of the calibration stages for comparison
+ENTRY_POINTS = ["odacblib", "odacblib.schedule", "odacblib.databaseops",
+                "odacblib.batchquery", "odacblib.runindex",
+                "odacblib.fuzzy_logic", "orchid_db_and_cal_builder",
+                "odacblib.rootops"]
+
+HEAVY_MODULES = ["ROOT", "scipy"]
+
+# run in the fresh interpreter, prints the import time and the heavy modules
+# that were loaded as json
+TIMER_SCRIPT = """import sys
+import json
+import time
+start = time.time()
+import {0:s}
+seconds = time.time() - start
+print json.dumps([seconds, [x for x in {1:s} if x in sys.modules]])
+"""
+
+
+def time_import(module, repeat):
+    """Times the import of a module, each in a fresh interpreter
+
+    Parameters
+    ----------
+    module : str
+        The full name of the module
+    repeat : int
+        The number of interpreters started, the fastest import is kept
+
+    Returns
+    -------
+    seconds : float
+        The fastest import, None if the import failed
+    heavy : list of str
+        The heavy modules the import loaded
+    """
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [REPO_DIR] + [x for x in [env.get("PYTHONPATH")] if x])
+    script = TIMER_SCRIPT.format(module, repr(HEAVY_MODULES))
+    times = []
+    heavy = []
+    for _ in range(repeat):
+        proc = subprocess.Popen([sys.executable, "-c", script], env=env,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+        out, err = proc.communicate()
+        if proc.returncode != 0:
+            print "    import {0:s} failed:\n{1:s}".format(module, err)
+            return None, []
+        seconds, heavy = json.loads(out.strip().splitlines()[-1])
+        times.append(seconds)
+    return min(times), heavy
+
+
+def parse_args(argv):
+    """Parses the command line arguments
+
+    Parameters
+    ----------
+    argv : list of str
+        the command line arguments, without the program name
+
+    Returns
+    -------
+    args : argparse.Namespace
+        the parsed arguments
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="interpreters started per entry point, the "
+                        "fastest import is kept (default: %(default)s)")
+    parser.add_argument("--output", default=None,
+                        help="json file the timings are written to")
+    return parser.parse_args(argv)
+
+
+def main():
+    """Times every entry point and prints the table"""
+    args = parse_args(sys.argv[1:])
+    results = {}
+    print "{0:30s} {1:>10s}  {2:s}".format("Entry point", "Import", "Loads")
+    for module in ENTRY_POINTS:
+        seconds, heavy = time_import(module, args.repeat)
+        results[module] = {"Seconds": seconds, "Loads": heavy}
+        if seconds is not None:
+            print "{0:30s} {1:8.3f} s  {2:s}".format(module, seconds,
+                                                     ", ".join(heavy))
+    if args.output is not None:
+        outfile = open(args.output, "w")
+        json.dump({"Python": sys.version.split()[0], "Results": results},
+                  outfile, indent=1, sort_keys=True)
+        outfile.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+#!/usr/bin/python
+"""Times the main steps of the builder on a synthetic batch written to disk,
+writes the timings as json, and flags the steps that are slower than in a
+saved baseline
+
+The batch spans the startup of HFIR cycle 474, so the sum ranges are found
+from the rates alone and no root file is needed"""
+import os
+import sys
+import json
+import shutil
+import tempfile
+import time
+import argparse
+import numpy as np
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from odacblib import databaseops as dbops
+from odacblib import readrawdata as rrd
+from odacblib import fuzzy_logic as fl
+from odacblib import schedule as sch
+import synthetic
+
+NUM_DETS = 50
+NUM_RUNS = 10000
+
+# the length of the synthetic batch, the run length is this over the number
+# of runs so the batch always spans the startup
+BATCH_SPAN_US = 14 * 24 * 3600 * 1000000
+
+# a step is a regression if it is this fraction slower than the baseline
+REGRESSION_TOLERANCE = 0.2
+
+# and at least this many seconds slower, so timer noise on the quick steps is
+# not flagged
+MIN_REGRESSION_SECONDS = 0.01
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "bench_baseline.json")
+
+
+def best_time(func, repeat):
+    """Times a function, keeping the fastest of several calls
+
+    Parameters
+    ----------
+    func : function
+        The function to time, called without arguments
+    repeat : int
+        The number of calls
+
+    Returns
+    -------
+    seconds : float
+        The fastest call
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        times.append(time.time() - start)
+    return min(times)
+
+
+def make_database(work_dir, det_data, run_cols, layout):
+    """Builds a run database from scratch
+
+    Parameters
+    ----------
+    work_dir : str
+        The directory to build it in
+    det_data : list of dict
+        list of dictionary of the detector data
+    run_cols : dict or iterable of dict
+        the run data, see dbops.make_batch_database
+    layout : str
+        one of dbops.DET_RUN_LAYOUTS
+    """
+    run_db_path = os.path.join(work_dir, "bench_{0:s}.db".format(layout))
+    if os.path.exists(run_db_path):
+        os.remove(run_db_path)
+    dbops.make_batch_database(run_db_path, det_data, run_cols, layout)
+
+
+def classify_loop(run_info):
+    """Classifies the runs one at a time, the way the scalar schedule
+    functions are used
+
+    Parameters
+    ----------
+    run_info : list of dict
+        One dictionary per run, see rrd.run_info_view, only runs the schedule
+        can place should be given as the others print an error each
+    """
+    for run in run_info:
+        sch.get_reactor_state(run["StartDateTime"], run["StopDateTime"])
+
+
+def run_suite(work_dir, num_dets, num_runs, repeat):
+    """Writes the synthetic batch and times each step on it
+
+    Parameters
+    ----------
+    work_dir : str
+        The directory the batch and databases are written to
+    num_dets : int
+        The number of detectors
+    num_runs : int
+        The number of runs
+    repeat : int
+        The number of times each step is run, the fastest is kept
+
+    Returns
+    -------
+    results : dict
+        The seconds taken by each step
+    """
+    batch_dir = os.path.join(work_dir, "Synthetic_Batch")
+    os.mkdir(batch_dir)
+    batch_file = synthetic.write_batch(batch_dir, num_dets, num_runs,
+                                       run_len_us=BATCH_SPAN_US // num_runs)
+    batch_data = rrd.read_batch_data(batch_file)
+    run_csv = batch_data["RunDataLocation"]
+    det_data = rrd.read_det_data(batch_data["DetDataLocation"])
+    run_cols = rrd.read_run_columns(run_csv, det_data)
+    run_info = rrd.run_info_view(run_cols)
+    det_run_data = rrd.det_run_view(run_cols)
+    summary = rrd.read_run_summary(run_csv, det_data, [fl.RATE_DET_NUM])
+    sum_info = rrd.run_info_view(summary)
+    sum_det_data = rrd.det_run_view(summary)
+    known = (run_cols["StatusNum"] != sch.UNKNOWN_VALUE).tolist()
+    known_info = [x for x, y in zip(run_info, known) if y]
+    steps = [
+        ("read_batch_data", lambda: rrd.read_batch_data(batch_file)),
+        ("read_det_data",
+         lambda: rrd.read_det_data(batch_data["DetDataLocation"])),
+        ("read_run_data", lambda: rrd.read_run_data(run_csv, det_data)),
+        ("read_run_columns",
+         lambda: rrd.read_run_columns(run_csv, det_data)),
+        ("read_run_columns_from_epoch",
+         lambda: rrd.read_run_columns(run_csv, det_data, True)),
+        ("read_run_summary",
+         lambda: rrd.read_run_summary(run_csv, det_data,
+                                      [fl.RATE_DET_NUM])),
+        ("make_batch_database",
+         lambda: make_database(work_dir, det_data, run_cols,
+                               "per_detector")),
+        ("make_batch_database_long",
+         lambda: make_database(work_dir, det_data, run_cols, "long")),
+        ("make_batch_database_streamed",
+         lambda: make_database(work_dir, det_data, (
+             x[0] for x in rrd.iter_run_chunks(run_csv, det_data)),
+                               "per_detector")),
+        ("find_sum_ranges",
+         lambda: fl.find_sum_ranges(run_info, det_run_data, None)),
+        ("find_sum_ranges_summary",
+         lambda: fl.find_sum_ranges(sum_info, sum_det_data, None)),
+        ("get_reactor_state", lambda: classify_loop(known_info)),
+        ("classify_runs",
+         lambda: sch.classify_runs(run_cols["StartDateTime"],
+                                   run_cols["StopDateTime"])),
+        ("load_schedule", lambda: sch.load_schedule())]
+    results = {}
+    for name, func in steps:
+        results[name] = best_time(func, repeat)
+        print "    {0:30s} {1:10.4f} s".format(name, results[name])
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Compares the timings against a baseline
+
+    Parameters
+    ----------
+    results : dict
+        The seconds taken by each step
+    baseline : dict
+        The seconds taken by each step in the baseline
+    tolerance : float
+        The fraction a step may be slower than the baseline
+
+    Returns
+    -------
+    regressions : list of str
+        The steps that are slower than allowed
+    """
+    regressions = []
+    print "\n{0:30s} {1:>10s} {2:>10s} {3:>8s}".format("Step", "Baseline",
+                                                      "Now", "Ratio")
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        ratio = results[name] / max(baseline[name], 1.0e-9)
+        flag = ""
+        if ratio > 1.0 + tolerance and \
+                results[name] - baseline[name] > MIN_REGRESSION_SECONDS:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print "{0:30s} {1:10.4f} {2:10.4f} {3:8.2f}{4:s}".format(
+            name, baseline[name], results[name], ratio, flag)
+    return regressions
+
+
+def parse_args(argv):
+    """Parses the command line arguments
+
+    Parameters
+    ----------
+    argv : list of str
+        the command line arguments, without the program name
+
+    Returns
+    -------
+    args : argparse.Namespace
+        the parsed arguments
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--dets", type=int, default=NUM_DETS,
+                        help="number of detectors (default: %(default)s)")
+    parser.add_argument("--runs", type=int, default=NUM_RUNS,
+                        help="number of runs (default: %(default)s)")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="times each step is run, the fastest is kept "
+                        "(default: %(default)s)")
+    parser.add_argument("--output", default=None,
+                        help="json file the timings are written to")
+    parser.add_argument("--baseline", default=BASELINE_PATH,
+                        help="json file of the timings to compare against "
+                        "(default: %(default)s)")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="write the timings to the baseline file "
+                        "instead of comparing against it")
+    parser.add_argument("--tolerance", type=float,
+                        default=REGRESSION_TOLERANCE,
+                        help="fraction a step may be slower than the "
+                        "baseline (default: %(default)s)")
+    return parser.parse_args(argv)
+
+
+def main():
+    """Runs the suite, saves the timings, and compares them to the baseline,
+    the exit status is 1 if any step regressed"""
+    args = parse_args(sys.argv[1:])
+    if args.dets <= fl.RATE_DET_NUM:
+        sys.exit("The rate logic needs detector {0:d}, use more than {0:d} "
+                 "detectors".format(fl.RATE_DET_NUM))
+    print "{0:d} detectors x {1:d} runs".format(args.dets, args.runs)
+    work_dir = tempfile.mkdtemp()
+    try:
+        results = run_suite(work_dir, args.dets, args.runs, args.repeat)
+    finally:
+        shutil.rmtree(work_dir)
+    report = {"Config": {"NumDets": args.dets, "NumRuns": args.runs,
+                         "Repeat": args.repeat,
+                         "Python": sys.version.split()[0],
+                         "NumPy": np.__version__},
+              "Results": results}
+    if args.output is not None:
+        outfile = open(args.output, "w")
+        json.dump(report, outfile, indent=1, sort_keys=True)
+        outfile.close()
+    if args.save_baseline:
+        outfile = open(args.baseline, "w")
+        json.dump(report, outfile, indent=1, sort_keys=True)
+        outfile.close()
+        print "Saved baseline to {0:s}".format(args.baseline)
+        return
+    if not os.path.exists(args.baseline):
+        print "No baseline at {0:s}, run with --save-baseline to make "\
+            "one".format(args.baseline)
+        return
+    infile = open(args.baseline)
+    baseline = json.load(infile)
+    infile.close()
+    if baseline["Config"]["NumDets"] != args.dets or \
+            baseline["Config"]["NumRuns"] != args.runs:
+        print "Warning: the baseline was made with {0:d} detectors x {1:d} "\
+            "runs".format(baseline["Config"]["NumDets"],
+                          baseline["Config"]["NumRuns"])
+    regressions = compare(results, baseline["Results"], args.tolerance)
+    if regressions:
+        print "{0:d} steps regressed".format(len(regressions))
+        sys.exit(1)
+    print "No regressions"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+"""Generates synthetic ORCHID reader output for the benchmarks, either as
+columnar run data or as the batch information, detector, and run csv files of
+a batch"""
+import os
+import sys
+import numpy as np
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from odacblib import readrawdata as rrd
+from odacblib import schedule as sch
+from odacblib import timestamps as ts
+
+# the start of the synthetic data, midway through HFIR cycle 473
+SYNTH_START_US = 1497398400000000
+SYNTH_RUN_LEN_US = 3600000000
+
+# five days before the startup of HFIR cycle 474, a batch starting here that
+# is a few weeks long spans the startup
+STARTUP_START_US = 1500508800000000
+
+# rates of detector 8 with the reactor on and off, and how quickly the rate
+# follows a startup or a shutdown
+ON_RATE = 20000.0
+OFF_RATE = 1000.0
+STARTUP_TAU_HOURS = 2.0
+SHUTDOWN_TAU_HOURS = 24.0
+
+BATCH_INFO_HEADER = "DetCount,ArrayX,ArrayY,IntTime,RootFile,RunFile,"\
+    "DetFile,FirstBufferSkipped,TreeGenerated,TreeFile,StartEpochMicroSec,"\
+    "StartDateTime,StopEpochMicroSec,StopDateTime,RunCount"
+DET_HEADER = "DetNum,DigitizerModule,DigitizerChannel,MpodModule,"\
+    "MpodChannel,DetType,DetOffsetX,DetPosX,DetOffsetY,DetPosY,DetOffsetZ,"\
+    "DetPosZ"
+
+
+def make_det_data(num_dets):
+    """Generates a list of detector data dictionaries
+
+    Parameters
+    ----------
+    num_dets : int
+        The number of detectors in the synthetic array
+
+    Returns
+    -------
+    det_data : list of dict
+        The detector data dictionaries, as from rrd.read_det_data
+    """
+    det_data = []
+    for i in range(num_dets):
+        det_data.append({"DetNum": i, "DigitizerModule": i // 8,
+                         "DigitizerChannel": i % 8, "MpodModule": i // 8,
+                         "MpodChannel": i % 8, "DetType": "NaI",
+                         "DetOffsetX": 0.0, "DetPosX": float(i % 5),
+                         "DetOffsetY": 0.0, "DetPosY": float(i // 5),
+                         "DetOffsetZ": 0.0, "DetPosZ": 0.0})
+    return det_data
+
+
+def make_run_columns(num_dets, num_runs, seed=0, start_us=SYNTH_START_US,
+                     run_len_us=SYNTH_RUN_LEN_US):
+    """Generates columnar run data, the rates follow the HFIR schedule
+
+    Parameters
+    ----------
+    num_dets : int
+        The number of detectors in the synthetic array
+    num_runs : int
+        The number of runs in the synthetic batch
+    seed : int
+        The seed for the random number generator
+    start_us : int
+        The start of the first run in microseconds since the epoch
+    run_len_us : int
+        The length of each run in microseconds
+
+    Returns
+    -------
+    run_cols : dict
+        dictionary of numpy arrays of run data, as from rrd.read_run_columns
+    """
+    rng = np.random.RandomState(seed)
+    shape = (num_runs, num_dets)
+    start = start_us + run_len_us * np.arange(num_runs, dtype=np.int64)
+    run_cols = {}
+    run_cols["DetNum"] = np.arange(num_dets, dtype=np.int64)
+    run_cols["RunNum"] = np.arange(num_runs, dtype=np.int64)
+    run_cols["StartEpochMicroSec"] = start
+    run_cols["StopEpochMicroSec"] = start + run_len_us
+    run_cols["CenterEpochMicroSec"] = start + run_len_us // 2
+    run_cols["RunTimeMicroSec"] = np.full(num_runs, run_len_us,
+                                          dtype=np.int64)
+    for key in ["Start", "Stop", "Center"]:
+        run_cols[key + "DateTime"] = \
+            run_cols[key + "EpochMicroSec"].astype("datetime64[us]")
+    run_cols["AvgVoltage"] = rng.normal(1500.0, 1.0, shape)
+    run_cols["AvgCurrentMicroAmps"] = rng.normal(3.0, 0.1, shape)
+    run_cols["AvgHvTempCel"] = rng.normal(25.0, 0.5, shape)
+    # each detector sees the reactor a little differently
+    gains = rng.uniform(0.8, 1.2, num_dets)
+    gains[min(8, num_dets - 1)] = 1.0
+    rates = rate_profile(run_cols["CenterDateTime"])
+    run_cols["AvgRate"] = rng.normal(rates[:, np.newaxis] * gains,
+                                     0.01 * rates[:, np.newaxis])
+    run_cols["TotalCounts"] = (run_cols["AvgRate"] * run_len_us /
+                               1.0e6).astype(np.int64)
+    rrd.add_reactor_status(run_cols)
+    return run_cols
+
+
+def rate_profile(times, schedule=None):
+    """Gives the rate of detector 8 over the HFIR schedule, rising after
+    each startup and decaying after each shutdown
+
+    Parameters
+    ----------
+    times : numpy.ndarray
+        datetime64[us] array of the times
+    schedule : dict
+        The schedule index, sch.SCHEDULE if None
+
+    Returns
+    -------
+    rates : numpy.ndarray
+        The rate at each time
+    """
+    schedule = sch.SCHEDULE if schedule is None else schedule
+    inds = sch.find_indices(times, schedule)
+    known = (inds >= 0) & (inds < schedule["UpperError"])
+    last = schedule["MixedTimes"][np.where(known, inds, 0)]
+    hours = (times - last).astype(np.int64) / sch.MICRO_SEC_PER_HOUR
+    after_startup = known & (inds % 2 == 0)
+    after_shutdown = known & (inds % 2 == 1)
+    rates = np.full(len(times), OFF_RATE)
+    rates[after_startup] += (ON_RATE - OFF_RATE) * (1.0 - np.exp(
+        -hours[after_startup] / STARTUP_TAU_HOURS))
+    rates[after_shutdown] += (ON_RATE - OFF_RATE) * np.exp(
+        -hours[after_shutdown] / SHUTDOWN_TAU_HOURS)
+    return rates
+
+
+def orchid_time(epoch_us):
+    """Formats an epoch time the way ORCHID reader writes it
+
+    Parameters
+    ----------
+    epoch_us : int
+        microseconds since the unix epoch
+
+    Returns
+    -------
+    text : str
+        The time stamp, see ts.ORCHID_TIME_FORMAT
+    """
+    return ts.epoch_us_to_datetime(epoch_us).strftime(ts.ORCHID_TIME_FORMAT)
+
+
+def write_det_csv(fname, det_data):
+    """Writes the detector data csv of a batch
+
+    Parameters
+    ----------
+    fname : str
+        The path of the csv file
+    det_data : list of dict
+        The detector data dictionaries, see make_det_data
+    """
+    keys = DET_HEADER.split(",")
+    outfile = open(fname, "w")
+    outfile.write(DET_HEADER + "\n")
+    for det in det_data:
+        outfile.write(",".join(str(det[x]) for x in keys) + "\n")
+    outfile.close()
+
+
+def write_run_csv(fname, run_cols):
+    """Writes the run csv of a batch
+
+    Parameters
+    ----------
+    fname : str
+        The path of the csv file
+    run_cols : dict
+        dictionary of numpy arrays of run data, see make_run_columns
+    """
+    det_keys = [x[0] for x in sorted(rrd.DET_RUN_FIELDS,
+                                     key=lambda x: x[1])]
+    outfile = open(fname, "w")
+    outfile.write("RunNum,StartEpochMicroSec,StartDateTime,"
+                  "StopEpochMicroSec,StopDateTime,CenterEpochMicroSec,"
+                  "CenterDateTime,RunTimeMicroSec," + ",".join(
+                      "Det{0:d}{1:s}".format(x, y) for x in
+                      run_cols["DetNum"].tolist() for y in det_keys) + "\n")
+    for ind, run_num in enumerate(run_cols["RunNum"].tolist()):
+        fields = [str(run_num)]
+        for key in ["Start", "Stop", "Center"]:
+            epoch_us = int(run_cols[key + "EpochMicroSec"][ind])
+            fields.extend([str(epoch_us), orchid_time(epoch_us)])
+        fields.append(str(run_cols["RunTimeMicroSec"][ind]))
+        det_vals = [run_cols[x][ind].tolist() for x in det_keys]
+        for vals in zip(*det_vals):
+            fields.extend(str(x) for x in vals)
+        outfile.write(",".join(fields) + "\n")
+    outfile.close()
+
+
+def write_batch(batch_dir, num_dets, num_runs, seed=0,
+                start_us=STARTUP_START_US, run_len_us=SYNTH_RUN_LEN_US):
+    """Writes the batch information, detector, and run csv files of a
+    synthetic batch
+
+    Parameters
+    ----------
+    batch_dir : str
+        The directory of the batch, it must exist, its name is the batch name
+    num_dets : int
+        The number of detectors in the synthetic array
+    num_runs : int
+        The number of runs in the synthetic batch
+    seed : int
+        The seed for the random number generator
+    start_us : int
+        The start of the first run in microseconds since the epoch
+    run_len_us : int
+        The length of each run in microseconds
+
+    Returns
+    -------
+    batch_info_file : str
+        The path of the batch information csv
+    """
+    det_data = make_det_data(num_dets)
+    run_cols = make_run_columns(num_dets, num_runs, seed, start_us,
+                                run_len_us)
+    run_csv = os.path.join(batch_dir, "run_data.csv")
+    det_csv = os.path.join(batch_dir, "det_data.csv")
+    write_det_csv(det_csv, det_data)
+    write_run_csv(run_csv, run_cols)
+    start = int(run_cols["StartEpochMicroSec"][0])
+    stop = int(run_cols["StopEpochMicroSec"][-1])
+    fields = [str(num_dets), "5.0", str(float(num_dets // 5)),
+              str(run_len_us / 1.0e6),
+              os.path.join(batch_dir, "batch_hists.root"), run_csv, det_csv,
+              "No", "No", "", str(start), orchid_time(start), str(stop),
+              orchid_time(stop), str(num_runs)]
+    batch_info_file = os.path.join(batch_dir, "batch_info.csv")
+    outfile = open(batch_info_file, "w")
+    outfile.write(BATCH_INFO_HEADER + "\n" + ",".join(fields) + "\n")
+    outfile.close()
+    return batch_info_file
@@ -1,7 +1,12 @@
-"""Simple library for functions and data needed by the orchid_db_builder"""
+"""Simple library for functions and data needed by the orchid_db_builder
+
+rootops (and with it ROOT) is imported the first time it is used, so the jobs
+that only need the databases or the schedule do not pay for starting PyROOT,
+see lazyimport"""
+import odacblib.lazyimport as lazyimport
 import odacblib.schedule as schedule
 import odacblib.readrawdata as readrawdata
 import odacblib.databaseops as databaseops
 import odacblib.input_sanitizer as input_sanitizer
 import odacblib.fuzzy_logic as fuzzy_logic
-import odacblib.rootops as rootops
+rootops = lazyimport.lazy_module("odacblib.rootops")
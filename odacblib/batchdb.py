@@ -0,0 +1,175 @@
+"""Access layer for the global batch database, which several builders may be
+writing at once
+
+Each process keeps one connection per database file and reuses it. The
+connections use write ahead logging so readers never block the writer, wait
+on a busy timeout for the write lock, and transactions that still find the
+database locked are retried with exponential backoff
+
+Write ahead logging needs the database on a local (not network) file system,
+set ODACB_BATCH_JOURNAL_MODE to DELETE for databases on NFS"""
+import os
+import time
+import random
+import sqlite3 as sql
+
+# journal mode of the batch database, can be overridden from the environment
+JOURNAL_MODE = os.environ.get("ODACB_BATCH_JOURNAL_MODE", "WAL")
+
+# seconds sqlite itself waits for a lock before reporting the database busy
+BUSY_TIMEOUT = 30.0
+
+# retries of a transaction that found the database locked, and the delays
+# between them in seconds, the delay doubles (plus jitter) after each retry
+MAX_RETRIES = 8
+RETRY_BASE_DELAY = 0.05
+RETRY_MAX_DELAY = 2.0
+
+# the open connections of this process, keyed by process id and path so a
+# forked worker never uses its parent's connection
+CONNECTIONS = {}
+
+
+def get_connection(db_loc):
+    """Gets this process's connection to a database, opening it if needed
+
+    Parameters
+    ----------
+    db_loc : str
+        path to the database file
+
+    Returns
+    -------
+    dbcon : sqlite database connection
+        The connection, in autocommit mode so transactions are explicit, see
+        run_transaction
+    """
+    key = (os.getpid(), os.path.abspath(db_loc))
+    if key not in CONNECTIONS:
+        # if the database did not already exist it will be created here
+        dbcon = sql.connect(db_loc, timeout=BUSY_TIMEOUT,
+                            isolation_level=None)
+        cursor = dbcon.cursor()
+        # auto_vacuum only takes effect before the first table is made
+        cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        with_retry(lambda: cursor.execute(
+            "PRAGMA journal_mode = {0:s}".format(JOURNAL_MODE)).fetchall())
+        if JOURNAL_MODE.upper() == "WAL":
+            # commits are durable at the next checkpoint, which is safe
+            # against corruption in WAL mode
+            cursor.execute("PRAGMA synchronous = NORMAL")
+        CONNECTIONS[key] = dbcon
+    return CONNECTIONS[key]
+
+
+def close_connection(db_loc):
+    """Closes this process's connection to a database, if it has one
+
+    Parameters
+    ----------
+    db_loc : str
+        path to the database file
+    """
+    dbcon = CONNECTIONS.pop((os.getpid(), os.path.abspath(db_loc)), None)
+    if dbcon is not None:
+        dbcon.close()
+
+
+def close_all():
+    """Closes all the connections this process opened"""
+    for key in [x for x in CONNECTIONS if x[0] == os.getpid()]:
+        CONNECTIONS.pop(key).close()
+
+
+def is_busy_error(err):
+    """Checks if an error means another connection holds the database
+
+    Parameters
+    ----------
+    err : Exception
+        The error raised by sqlite
+
+    Returns
+    -------
+    busy : bool
+        True if retrying later may succeed
+    """
+    message = str(err).lower()
+    return isinstance(err, sql.OperationalError) and (
+        "locked" in message or "busy" in message)
+
+
+def with_retry(func, *args):
+    """Calls a function, retrying with backoff while the database is busy
+
+    Parameters
+    ----------
+    func : function
+        The function to call
+    args : tuple
+        The arguments of the function
+
+    Returns
+    -------
+    result : object
+        What the function returned
+    """
+    delay = RETRY_BASE_DELAY
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            return func(*args)
+        except sql.OperationalError as err:
+            if not is_busy_error(err) or attempt == MAX_RETRIES:
+                raise
+        print "Batch database is busy, retrying in {0:.2f} s".format(delay)
+        time.sleep(delay * (1.0 + random.random()))
+        delay = min(2.0 * delay, RETRY_MAX_DELAY)
+
+
+def rollback(cursor):
+    """Rolls back the open transaction, if there still is one
+
+    Parameters
+    ----------
+    cursor : sqlite cursor
+        The cursor into the sqlite database
+    """
+    try:
+        cursor.execute("ROLLBACK")
+    except sql.OperationalError:
+        # sqlite already rolled it back
+        pass
+
+
+def run_transaction(dbcon, func, *args):
+    """Runs a function in a write transaction, retrying the whole transaction
+    with backoff while the database is locked by another writer
+
+    Parameters
+    ----------
+    dbcon : sqlite database connection
+        The connection, see get_connection
+    func : function
+        Called with a cursor followed by args, it must not prompt the user as
+        the write lock is held while it runs
+    args : tuple
+        The other arguments of the function
+
+    Returns
+    -------
+    result : object
+        What the function returned
+    """
+    def attempt():
+        cursor = dbcon.cursor()
+        # take the write lock up front so the transaction cannot deadlock
+        # upgrading from a read lock
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            result = func(cursor, *args)
+            cursor.execute("COMMIT")
+        except BaseException:
+            rollback(cursor)
+            raise
+        return result
+    return with_retry(attempt)
@@ -0,0 +1,190 @@
+"""Functions to look batches up in the global batch database, for analysis
+jobs that would otherwise scan the batch table with their own sql
+
+Every lookup is answered from one of the indexes in dbops.BATCH_INDEX_CMDS,
+the batches are returned in time order, either as BatchRow named tuples or as
+a numpy record array
+
+The lookups only read the database, they never create it or its indexes (the
+builder does), so they work for jobs with read only access to it"""
+import os
+import collections
+import datetime as dt
+import sqlite3 as sql
+import numpy as np
+import odacblib.batchdb as bdb
+import odacblib.databaseops as dbops
+import odacblib.timestamps as ts
+
+# one row of the batch table, the fields are dbops.BATCH_DICT_NAMES
+BatchRow = collections.namedtuple("BatchRow", dbops.BATCH_DICT_NAMES)
+
+# the numeric columns of the batch table, the rest are held as objects in the
+# record arrays
+BATCH_INT_NAMES = ["StartEpochMicroSec", "StopEpochMicroSec", "TreeGenerated",
+                   "RunCount", "DetCount", "FirstBufferSkipped",
+                   "StartCycleNum", "StopCycleNum", "StatusNum",
+                   "IsCalibrated", "IsDecomposed"]
+BATCH_REAL_NAMES = ["ArrayX", "ArrayY", "IntTime"]
+
+BATCH_DTYPE = [(x, np.int64 if x in BATCH_INT_NAMES else
+                np.float64 if x in BATCH_REAL_NAMES else object)
+               for x in dbops.BATCH_DICT_NAMES]
+
+SELECT_BATCHES = "SELECT * FROM batch_table WHERE {0:s} "\
+    "ORDER BY start_us_epoch"
+
+# batches overlap [t0, t1] if they start before t1 and stop after t0, so they
+# start at most the longest batch length before t0, that range is searched in
+# batch_by_time_index (which also holds the stop) and the longest length is
+# read from batch_by_length_index
+OVERLAP_WHERE = "start_us_epoch BETWEEN ? - (SELECT MAX(stop_us_epoch - "\
+    "start_us_epoch) FROM batch_table) AND ? AND stop_us_epoch >= ?"
+
+CYCLE_WHERE = "start_cycle_number = ?"
+
+CYCLE_STATUS_WHERE = "start_cycle_number = ? AND reactor_status_number = ?"
+
+UNCALIBRATED_WHERE = "has_been_calibrated = 0"
+
+
+def open_read_only(db_loc):
+    """Opens a plain connection to an existing batch database, without
+    changing its settings or schema
+
+    Parameters
+    ----------
+    db_loc : str
+        path to the batch database file
+
+    Returns
+    -------
+    dbcon : sqlite database connection
+        A new connection, to be closed by the caller
+    """
+    if not os.path.exists(db_loc):
+        raise IOError("No batch database at {0:s}".format(db_loc))
+    return sql.connect(db_loc, timeout=bdb.BUSY_TIMEOUT)
+
+
+def select_batches(db_loc, where, params=(), as_array=False):
+    """Selects batches from the batch table
+
+    Parameters
+    ----------
+    db_loc : str
+        path to the batch database file
+    where : str
+        The WHERE clause, with ? placeholders
+    params : tuple
+        The values of the placeholders
+    as_array : bool
+        True to return a numpy record array instead of a list
+
+    Returns
+    -------
+    batches : list of BatchRow or numpy.recarray
+        The selected batches in order of their start
+    """
+    dbcon = open_read_only(db_loc)
+    try:
+        rows = dbcon.execute(SELECT_BATCHES.format(where), params).fetchall()
+    finally:
+        dbcon.close()
+    if as_array:
+        return np.rec.array(np.array([tuple(x) for x in rows],
+                                     dtype=BATCH_DTYPE))
+    return [BatchRow(*x) for x in rows]
+
+
+def to_epoch_us(time):
+    """Converts a time to microseconds since the epoch
+
+    Parameters
+    ----------
+    time : datetime.datetime or int
+        A (naive) datetime, or a time already in microseconds since the
+        epoch
+
+    Returns
+    -------
+    epoch_us : int
+        The time in microseconds since the epoch
+    """
+    if isinstance(time, dt.datetime):
+        return ts.datetime_to_epoch_us(time)
+    return int(time)
+
+
+def batches_overlapping(db_loc, start, stop, as_array=False):
+    """Finds the batches with data in a time window
+
+    Parameters
+    ----------
+    db_loc : str
+        path to the batch database file
+    start : datetime.datetime or int
+        The start of the window, see to_epoch_us
+    stop : datetime.datetime or int
+        The end of the window, see to_epoch_us
+    as_array : bool
+        True to return a numpy record array instead of a list
+
+    Returns
+    -------
+    batches : list of BatchRow or numpy.recarray
+        The batches that overlap the window
+    """
+    start = to_epoch_us(start)
+    return select_batches(db_loc, OVERLAP_WHERE,
+                          (start, to_epoch_us(stop), start), as_array)
+
+
+def batches_in_cycle(db_loc, cycle_num, status_num=None, as_array=False):
+    """Finds the batches that start in a reactor cycle
+
+    Parameters
+    ----------
+    db_loc : str
+        path to the batch database file
+    cycle_num : int
+        The HFIR cycle number
+    status_num : int
+        Only batches with this reactor status (an index into
+        sch.CYCLE_STATUS_NAMES), None for all of them
+    as_array : bool
+        True to return a numpy record array instead of a list
+
+    Returns
+    -------
+    batches : list of BatchRow or numpy.recarray
+        The batches of the cycle
+
+    Notes
+    -----
+    The reactor off batches that follow a cycle's shutdown carry the cycle
+    number of that cycle, so batches_in_cycle(db_loc, 472, 0) are the
+    reactor off batches after cycle 472
+    """
+    if status_num is None:
+        return select_batches(db_loc, CYCLE_WHERE, (cycle_num,), as_array)
+    return select_batches(db_loc, CYCLE_STATUS_WHERE,
+                          (cycle_num, status_num), as_array)
+
+
+def uncalibrated_batches(db_loc, as_array=False):
+    """Finds the batches that have not been calibrated yet
+
+    Parameters
+    ----------
+    db_loc : str
+        path to the batch database file
+    as_array : bool
+        True to return a numpy record array instead of a list
+
+    Returns
+    -------
+    batches : list of BatchRow or numpy.recarray
+        The uncalibrated batches
+    """
+    return select_batches(db_loc, UNCALIBRATED_WHERE, (), as_array)
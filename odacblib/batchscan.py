@@ -0,0 +1,140 @@
+"""Functions to find the batches under a directory (or matching a glob) and to
+process many batches at once in a pool of worker processes"""
+import os
+import glob
+import fnmatch
+import multiprocessing as mp
+import traceback
+
+# file name pattern (case insensitive) of the batch information csv files
+BATCH_INFO_PATTERN = "*batch*info*.csv"
+
+
+def is_multi_batch(location):
+    """Determines if a batch location refers to many batches
+
+    Parameters
+    ----------
+    location : str
+        The batch information file, a directory, or a glob
+
+    Returns
+    -------
+    multi : bool
+        True if location is a directory or a glob
+    """
+    return os.path.isdir(location) or glob.has_magic(location)
+
+
+def find_batch_files(location, pattern=BATCH_INFO_PATTERN):
+    """Finds the batch information files below a directory or matching a glob
+
+    Parameters
+    ----------
+    location : str
+        A directory to search recursively, or a glob of batch info files
+    pattern : str
+        The file name pattern of the batch info files when searching a
+        directory
+
+    Returns
+    -------
+    batch_files : list of str
+        Sorted list of the paths of the batch information files
+    """
+    if not os.path.isdir(location):
+        return sorted(x for x in glob.glob(location) if os.path.isfile(x))
+    batch_files = []
+    for dir_path, _, file_names in os.walk(location):
+        for fname in file_names:
+            if fnmatch.fnmatch(fname.lower(), pattern.lower()):
+                batch_files.append(os.path.join(dir_path, fname))
+    return sorted(batch_files)
+
+
+def run_tasks(func, items, processes=None):
+    """Calls func on each item in a pool of worker processes, yielding the
+    results as they finish
+
+    Parameters
+    ----------
+    func : function
+        A module level function taking a single item, its return value must
+        be picklable
+    items : list
+        The items to process
+    processes : int
+        The number of worker processes, None for one per cpu, with 1 the items
+        are processed in this process (so prompts can still be answered)
+
+    Yields
+    ------
+    item : object
+        The item that was processed
+    result : object
+        The return value of func, None if it failed
+    error : str
+        None if func succeeded, otherwise the traceback of the failure
+    """
+    tasks = [(func, item) for item in items]
+    if processes == 1:
+        for task in tasks:
+            yield run_task(task)
+        return
+    pool = mp.Pool(processes)
+    try:
+        for output in pool.imap_unordered(run_task, tasks):
+            yield output
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def run_task(task):
+    """Runs a single task, catching every failure (including sys.exit from an
+    aborted prompt) so that one bad batch does not take down the pool
+
+    Parameters
+    ----------
+    task : tuple
+        The function and the item to call it on
+
+    Returns
+    -------
+    output : tuple
+        The item, the result (None on failure), and the error (None on
+        success)
+    """
+    func, item = task
+    try:
+        return (item, func(item), None)
+    except (Exception, SystemExit):
+        return (item, None, traceback.format_exc())
+
+
+def print_summary(summary, stage_names):
+    """Prints the per batch timings of a multi batch run
+
+    Parameters
+    ----------
+    summary : list of tuples
+        For each batch, the batch name, a dictionary of stage timings in
+        seconds, and the error (None if the batch succeeded)
+    stage_names : list of str
+        The keys of the timing dictionaries to print, in order
+    """
+    print "\nBatch summary (times in seconds)"
+    print "{0:30s}".format("Batch") + "".join(
+        "{0:>12s}".format(x) for x in stage_names + ["Total"])
+    total_fails = 0
+    for name, timings, error in sorted(summary):
+        line = "{0:30s}".format(name)
+        line += "".join("{0:12.2f}".format(timings.get(x, 0.0))
+                        for x in stage_names)
+        line += "{0:12.2f}".format(sum(timings.values()))
+        if error is not None:
+            line += "  FAILED"
+            total_fails += 1
+        print line
+    print "{0:d} batches, {1:d} failed".format(len(summary), total_fails)
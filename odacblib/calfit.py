@@ -0,0 +1,391 @@
+"""Functions to find the energy and width calibration of a detector from the
+sum spectrum of a calibration block, without ROOT
+
+The continuum of the uncalibrated spectrum is estimated with the SNIP
+clipping algorithm, the peaks standing above it are found, matched to the
+calibration gamma-ray list assuming a roughly proportional energy scale, and
+fit with a gaussian on a linear background. The peak centroids then give the
+energy calibration, E = offset + slope * ch + curve * ch^2, and the peak
+widths give the width calibration, sigma_E^2 = offset + slope * E + curve * E^2
+
+The calibration of each run is then interpolated in time between the centers
+of the calibration blocks, for every detector at once"""
+import warnings
+import numpy as np
+import scipy.optimize as opt
+import scipy.signal as sig
+import odacblib.peakfind as pkf
+import odacblib.batchscan as bscan
+
+# significance a peak must stand above its surroundings to be a candidate, and
+# that the fitted amplitude of a peak must have to be used
+MIN_PEAK_SIG = 5.0
+
+# the widest clipping window of the SNIP continuum, as a fraction of the
+# number of bins in the spectrum
+SNIP_WINDOW_FRAC = 1.0 / 40.0
+
+# the number of most prominent candidate peaks considered for matching
+MAX_CANDIDATES = 20
+
+# fractional tolerance between a candidate and the predicted position of a
+# gamma-ray for them to match
+MATCH_TOL = 0.03
+
+# half width, in peak sigmas, of the window each peak is fit in
+FIT_HALF_WIDTH = 2.5
+
+# minimum half width, in bins, of the fit window
+MIN_FIT_BINS = 3
+
+FWHM_PER_SIGMA = 2.0 * np.sqrt(2.0 * np.log(2.0))
+
+# the calibration parameters, named as in the detector run tables
+CAL_PARAM_NAMES = ["EnCalOffset", "EnCalSlope", "EnCalCurve", "WidthSqOffset",
+                   "WidthSqSlope", "WidthSqCurve"]
+
+
+def snip_background(counts, max_window=None):
+    """Estimates the continuum under the peaks of a spectrum with the SNIP
+    algorithm, clipping on the log log square root scale
+
+    Parameters
+    ----------
+    counts : numpy.ndarray
+        The bin contents of the spectrum
+    max_window : int
+        The widest clipping window in bins, it should be wider than the peaks,
+        defaults to SNIP_WINDOW_FRAC of the number of bins
+
+    Returns
+    -------
+    background : numpy.ndarray
+        The continuum, the same shape as counts
+    """
+    if max_window is None:
+        max_window = max(int(len(counts) * SNIP_WINDOW_FRAC), 1)
+    lls = np.log(np.log(np.sqrt(np.maximum(counts, 0.0) + 1.0) + 1.0) + 1.0)
+    for width in range(1, max_window + 1):
+        clipped = 0.5 * (lls[:-2 * width] + lls[2 * width:])
+        lls[width:-width] = np.minimum(lls[width:-width], clipped)
+    return (np.exp(np.exp(lls) - 1.0) - 1.0)**2 - 1.0
+
+
+def find_peak_candidates(channels, counts):
+    """Finds the peaks in a spectrum
+
+    Parameters
+    ----------
+    channels : numpy.ndarray
+        The bin centers of the spectrum
+    counts : numpy.ndarray
+        The bin contents of the spectrum
+
+    Returns
+    -------
+    positions : numpy.ndarray
+        The channel of each candidate peak, most prominent first
+    fwhms : numpy.ndarray
+        The rough full width at half maximum of each candidate, in channels
+    prominences : numpy.ndarray
+        How far each candidate stands above its surroundings, in counts
+    """
+    smoothed = pkf.smooth(np.asarray(counts, dtype=np.float64))
+    noise = np.sqrt(np.maximum(smoothed, 1.0) / pkf.SMOOTH_BINS)
+    inds, props = sig.find_peaks(smoothed - snip_background(smoothed),
+                                 prominence=MIN_PEAK_SIG * noise, width=1.0)
+    order = np.argsort(props["prominences"])[::-1][:MAX_CANDIDATES]
+    bin_width = (channels[-1] - channels[0]) / max(len(channels) - 1, 1)
+    return (channels[inds[order]], props["widths"][order] * bin_width,
+            props["prominences"][order])
+
+
+def match_gammas(positions, prominences, gammas):
+    """Matches candidate peaks to gamma-ray energies by finding the
+    proportional energy scale that places the most gamma-rays on candidates
+
+    Parameters
+    ----------
+    positions : numpy.ndarray
+        The channel of each candidate peak
+    prominences : numpy.ndarray
+        The prominence of each candidate, used to break ties
+    gammas : list of float
+        The gamma-ray energies
+
+    Returns
+    -------
+    matches : list of tuples
+        The energy and the candidate index of each matched gamma-ray, sorted
+        by energy
+    """
+    best = (0, 0.0, [])
+    for pos in positions:
+        for gamma in gammas:
+            gain = gamma / pos
+            matches = []
+            for energy in gammas:
+                pred = energy / gain
+                dist = np.abs(positions - pred)
+                ind = int(np.argmin(dist))
+                if dist[ind] < MATCH_TOL * pred:
+                    matches.append((energy, ind))
+            # a candidate can only be one gamma-ray
+            if len(set(x[1] for x in matches)) != len(matches):
+                continue
+            score = (len(matches), sum(prominences[x[1]] for x in matches))
+            if score > best[:2]:
+                best = score + (matches,)
+    return sorted(best[2])
+
+
+def gauss_line(chan, amp, mean, sigma, bkg0, bkg1):
+    """A gaussian on a linear background"""
+    return (amp * np.exp(-0.5 * ((chan - mean) / sigma)**2) +
+            bkg0 + bkg1 * (chan - mean))
+
+
+def fit_peak(channels, counts, center, fwhm):
+    """Fits a single peak with a gaussian on a linear background
+
+    Parameters
+    ----------
+    channels : numpy.ndarray
+        The bin centers of the spectrum
+    counts : numpy.ndarray
+        The bin contents of the spectrum
+    center : float
+        The rough position of the peak
+    fwhm : float
+        The rough full width at half maximum of the peak
+
+    Returns
+    -------
+    mean : float
+        The centroid of the peak, None if the fit failed or the fitted peak is
+        not MIN_PEAK_SIG standard errors high
+    sigma : float
+        The width of the peak, None if the fit failed
+    """
+    sigma = max(fwhm / FWHM_PER_SIGMA, 1e-9)
+    bin_width = (channels[-1] - channels[0]) / max(len(channels) - 1, 1)
+    half = max(FIT_HALF_WIDTH * sigma, MIN_FIT_BINS * bin_width)
+    window = (channels >= center - half) & (channels <= center + half)
+    chan = channels[window]
+    cnts = counts[window]
+    if len(chan) < 6:
+        return None, None
+    bkg = 0.5 * (cnts[0] + cnts[-1])
+    guess = [max(cnts.max() - bkg, 1.0), center, sigma, bkg, 0.0]
+    try:
+        # a fit whose covariance cannot be estimated is rejected below
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", opt.OptimizeWarning)
+            params, covar = opt.curve_fit(gauss_line, chan, cnts, p0=guess,
+                                          sigma=np.sqrt(np.maximum(cnts,
+                                                                   1.0)),
+                                          absolute_sigma=True, maxfev=2000)
+    except (RuntimeError, ValueError):
+        return None, None
+    if params[0] <= 0.0 or not chan[0] <= params[1] <= chan[-1]:
+        return None, None
+    # noise the candidate search let through fits to a low amplitude
+    if not params[0] >= MIN_PEAK_SIG * np.sqrt(covar[0, 0]):
+        return None, None
+    return params[1], abs(params[2])
+
+
+def calibrate_spectrum(channels, counts, gammas):
+    """Finds the energy and width calibration of a sum spectrum
+
+    Parameters
+    ----------
+    channels : numpy.ndarray
+        The bin centers of the spectrum
+    counts : numpy.ndarray
+        The bin contents of the spectrum
+    gammas : list of float
+        The gamma-ray energies expected in the spectrum
+
+    Returns
+    -------
+    result : dict
+        The CAL_PARAM_NAMES values, NumPeaks (the number of peaks used), and
+        Success (False, with zeroed parameters, if fewer than two peaks could
+        be fit)
+    """
+    channels = np.asarray(channels, dtype=np.float64)
+    counts = np.asarray(counts, dtype=np.float64)
+    result = dict((key, 0.0) for key in CAL_PARAM_NAMES)
+    result["NumPeaks"] = 0
+    result["Success"] = False
+    positions, fwhms, proms = find_peak_candidates(channels, counts)
+    energies, means, sigmas = [], [], []
+    for energy, ind in match_gammas(positions, proms, gammas):
+        mean, sigma = fit_peak(channels, counts, positions[ind], fwhms[ind])
+        if mean is not None:
+            energies.append(energy)
+            means.append(mean)
+            sigmas.append(sigma)
+    if len(energies) < 2:
+        return result
+    energies = np.array(energies)
+    means = np.array(means)
+    en_cal = np.polyfit(means, energies, min(2, len(means) - 1))[::-1]
+    en_cal = np.append(en_cal, np.zeros(3 - len(en_cal)))
+    # convert the widths to energy with the local slope of the calibration
+    sigma_en = np.array(sigmas) * (en_cal[1] + 2.0 * en_cal[2] * means)
+    width_cal = np.polyfit(energies, sigma_en**2,
+                           min(2, len(energies) - 1))[::-1]
+    width_cal = np.append(width_cal, np.zeros(3 - len(width_cal)))
+    for key, val in zip(CAL_PARAM_NAMES, np.concatenate((en_cal, width_cal))):
+        result[key] = float(val)
+    result["NumPeaks"] = len(energies)
+    result["Success"] = True
+    return result
+
+
+def fit_task(task):
+    """Calibrates one detector for one calibration block, for the pool
+
+    Parameters
+    ----------
+    task : tuple
+        The detector number, the calibration number, the bin centers, the bin
+        contents, and the gamma-ray energies
+
+    Returns
+    -------
+    result : dict
+        see calibrate_spectrum
+    """
+    return calibrate_spectrum(task[2], task[3], task[4])
+
+
+def fit_calibrations(tasks, processes=None):
+    """Calibrates many detectors and calibration blocks in a process pool
+
+    Parameters
+    ----------
+    tasks : list of tuples
+        see fit_task
+    processes : int
+        The number of worker processes, None for one per cpu, with 1 the fits
+        are done in this process
+
+    Returns
+    -------
+    results : dict
+        The result of calibrate_spectrum keyed by (detector number,
+        calibration number)
+    """
+    results = {}
+    for task, result, error in bscan.run_tasks(fit_task, tasks, processes):
+        key = (task[0], task[1])
+        if error is not None:
+            print "Calibration fit of Det #{0:d} Cal #{1:d} failed:\n"\
+                "{2:s}".format(key[0], key[1], error)
+            continue
+        if not result["Success"]:
+            print "Warning: too few peaks to calibrate Det #{0:d} Cal "\
+                "#{1:d}".format(key[0], key[1])
+        results[key] = result
+    return results
+
+
+def results_to_array(results, det_nums, num_blocks):
+    """Collects the block calibrations into one array
+
+    Parameters
+    ----------
+    results : dict
+        see fit_calibrations
+    det_nums : list of int
+        The detector numbers, in the order of the detector axis
+    num_blocks : int
+        The number of calibration blocks
+
+    Returns
+    -------
+    block_params : numpy.ndarray
+        Array of shape (blocks, detectors, CAL_PARAM_NAMES) with nan for the
+        blocks of a detector that were not calibrated
+    """
+    block_params = np.full((num_blocks, len(det_nums), len(CAL_PARAM_NAMES)),
+                           np.nan)
+    for ind, det_num in enumerate(det_nums):
+        for block in range(num_blocks):
+            result = results.get((det_num, block))
+            if result is not None and result["Success"]:
+                block_params[block, ind] = [result[x] for x in CAL_PARAM_NAMES]
+    return block_params
+
+
+def block_center_times(run_nums, center_times, runs):
+    """Finds the time at the center of each calibration block
+
+    Parameters
+    ----------
+    run_nums : numpy.ndarray
+        The run numbers, in increasing order
+    center_times : numpy.ndarray
+        The center time (in epoch microseconds) of each run
+    runs : list of tuples
+        list of tuples where each tuple has the start run, the stop run,
+        the gamma-ray list for calibration, and the "kind" of calibration
+
+    Returns
+    -------
+    block_times : numpy.ndarray
+        The mean center time of the runs in each block
+    """
+    center_times = np.asarray(center_times, dtype=np.float64)
+    lo_inds = np.searchsorted(run_nums, [x[0] for x in runs], side="left")
+    hi_inds = np.searchsorted(run_nums, [x[1] for x in runs], side="right")
+    return np.array([center_times[lo:hi].mean() if hi > lo else np.nan
+                     for lo, hi in zip(lo_inds, hi_inds)])
+
+
+def interpolate_run_calibrations(block_times, block_params, run_times):
+    """Interpolates the block calibrations linearly in time to every run,
+    runs before the first or after the last calibrated block of a detector
+    take the calibration of that block
+
+    Parameters
+    ----------
+    block_times : numpy.ndarray
+        The center time of each calibration block
+    block_params : numpy.ndarray
+        Array of shape (blocks, detectors, CAL_PARAM_NAMES), nan where a
+        block of a detector was not calibrated
+    run_times : numpy.ndarray
+        The center time of each run
+
+    Returns
+    -------
+    run_params : numpy.ndarray
+        Array of shape (runs, detectors, CAL_PARAM_NAMES), nan for the
+        detectors without any calibrated block
+    """
+    run_times = np.asarray(run_times, dtype=np.float64)
+    order = np.argsort(block_times)
+    block_times = np.asarray(block_times, dtype=np.float64)[order]
+    block_params = block_params[order]
+    run_params = np.full((len(run_times),) + block_params.shape[1:], np.nan)
+    for ind in range(block_params.shape[1]):
+        valid = ~np.isnan(block_params[:, ind, 0]) & ~np.isnan(block_times)
+        times = block_times[valid]
+        params = block_params[valid, ind]
+        if len(times) == 0:
+            continue
+        elif len(times) == 1:
+            run_params[:, ind] = params[0]
+            continue
+        # all the parameters of the detector are interpolated together
+        hi_inds = np.clip(np.searchsorted(times, run_times), 1, len(times) - 1)
+        lo_inds = hi_inds - 1
+        span = np.maximum(times[hi_inds] - times[lo_inds], 1.0)
+        frac = np.clip((run_times - times[lo_inds]) / span, 0.0, 1.0)
+        run_params[:, ind] = (params[lo_inds] + frac[:, np.newaxis] *
+                              (params[hi_inds] - params[lo_inds]))
+    return run_params
@@ -0,0 +1,252 @@
+"""Functions to sum the per run histograms of every detector into the
+calibration sums of a calibration block, with the detectors summed in parallel
+
+Two interchangeable backends provide performCalSum:
+native - performCalSum from libCalibrate.so, reading and writing root files
+numpy - a NumPy stand-in reading and writing .npz files, for local testing
+"""
+import os
+import shutil
+import tempfile
+import ctypes as ct
+import multiprocessing as mp
+import numpy as np
+
+CALIBRATE_LIB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                  "libCalibrate.so")
+
+CAL_SUM_BACKENDS = ["native", "numpy"]
+
+# the backend used if none is given, can be overridden from the environment
+DEFAULT_BACKEND = os.environ.get("ODACB_CALSUM_BACKEND", "native")
+
+# the histograms kept per detector per run and summed per calibration
+HIST_SUFFIXES = ["px", "px_thresh", "py", "py_thresh", "2D"]
+
+# root compression setting (algorithm * 100 + level) of the calibration files,
+# LZ4 at level 4 favours throughput over size
+CAL_FILE_COMPRESSION = 404
+
+RUN_HIST_FMT = "Det_{0:d}_Run_{1:d}_{2:s}"
+SUM_HIST_FMT = "Det_{0:d}_Sum_{1:s}_Cal_{2:d}"
+
+# loaded libraries, keyed by path, so each process loads the library once
+LIB_CACHE = {}
+
+
+def load_calibrate_lib(path=CALIBRATE_LIB_PATH):
+    """Loads libCalibrate.so, or returns it if this process already did
+
+    Parameters
+    ----------
+    path : str
+        The path of the shared library
+
+    Returns
+    -------
+    lib : ctypes.CDLL
+        The library with the performCalSum argument types set
+    """
+    if path not in LIB_CACHE:
+        lib = ct.cdll.LoadLibrary(path)
+        lib.performCalSum.argtypes = [ct.c_int, ct.c_int, ct.c_int, ct.c_int,
+                                      ct.c_char_p, ct.c_char_p, ct.c_int]
+        LIB_CACHE[path] = lib
+    return LIB_CACHE[path]
+
+
+def numpy_cal_sum(start_run, stop_run, det_num, cal_num, in_name, out_name,
+                  new_file):
+    """Stand-in for performCalSum that works on .npz files of bin contents
+
+    Parameters
+    ----------
+    start_run : int
+        The first run of the calibration block
+    stop_run : int
+        The last run of the calibration block
+    det_num : int
+        The detector number
+    cal_num : int
+        The calibration block number
+    in_name : str
+        The .npz file holding one array per run histogram, named like the
+        histograms in the raw root file (Det_8_Run_10_px)
+    out_name : str
+        The .npz file the sums are written to
+    new_file : int
+        0 to replace out_name, otherwise the sums are added to it
+    """
+    infile = np.load(in_name)
+    sums = {}
+    if new_file != 0 and os.path.exists(out_name):
+        outfile = np.load(out_name)
+        sums.update((key, outfile[key]) for key in outfile.files)
+        outfile.close()
+    for suffix in HIST_SUFFIXES:
+        total = np.array(infile[RUN_HIST_FMT.format(det_num, start_run,
+                                                    suffix)], copy=True)
+        for run in range(start_run + 1, stop_run + 1):
+            total += infile[RUN_HIST_FMT.format(det_num, run, suffix)]
+        sums[SUM_HIST_FMT.format(det_num, suffix, cal_num)] = total
+    infile.close()
+    write_npz(out_name, sums)
+
+
+def write_npz(fname, arrays):
+    """Writes a dictionary of arrays to fname, without numpy appending .npz
+
+    Parameters
+    ----------
+    fname : str
+        The path of the file
+    arrays : dict
+        The arrays to write, keyed by name
+    """
+    outfile = open(fname, "wb")
+    np.savez(outfile, **arrays)
+    outfile.close()
+
+
+def get_cal_sum_func(backend=None):
+    """Gets the performCalSum implementation of a backend
+
+    Parameters
+    ----------
+    backend : str
+        One of CAL_SUM_BACKENDS, DEFAULT_BACKEND if None
+
+    Returns
+    -------
+    func : function
+        Function with the performCalSum signature
+    """
+    backend = DEFAULT_BACKEND if backend is None else backend
+    if backend == "native":
+        return load_calibrate_lib().performCalSum
+    elif backend == "numpy":
+        return numpy_cal_sum
+    raise ValueError("Unknown calibration sum backend: {0:s}".format(backend))
+
+
+def init_worker(backend):
+    """Pool initializer, loads the backend once per worker process
+
+    Parameters
+    ----------
+    backend : str
+        One of CAL_SUM_BACKENDS
+    """
+    get_cal_sum_func(backend)
+
+
+def sum_detector(task):
+    """Sums the histograms of one detector into this process's part file
+
+    Parameters
+    ----------
+    task : tuple
+        start run, stop run, detector number, calibration number, input file,
+        directory for the part files, and backend
+
+    Returns
+    -------
+    part_name : str
+        The part file the sums were written to
+    """
+    start_run, stop_run, det_num, cal_num, in_name, part_dir, backend = task
+    ext = ".root" if backend == "native" else ".npz"
+    part_name = os.path.join(part_dir, "part_{0:d}{1:s}".format(os.getpid(),
+                                                                ext))
+    new_file = 1 if os.path.exists(part_name) else 0
+    func = get_cal_sum_func(backend)
+    func(start_run, stop_run, det_num, cal_num, in_name, part_name, new_file)
+    return part_name
+
+
+def sum_calibration_block(run, root_input, root_output, det_nums, ind,
+                          processes=None, backend=None):
+    """Sums the histograms of every detector for a calibration block across a
+    pool of processes, each writing its own part file, then merges the parts
+    into the output file
+
+    Parameters
+    ----------
+    run : tuple
+        tuple with the start run, the stop run, the gamma-ray list for
+        calibration, and the "kind" of calibration
+    root_input : str
+        The path of the input file
+    root_output : str
+        The path of the output file
+    det_nums : list of int
+        The detector numbers to sum
+    ind : int
+        which calibration we are preparing, the output file is recreated for
+        the first one
+    processes : int
+        The number of worker processes, None for one per cpu, with 1 the sums
+        are done in this process
+    backend : str
+        One of CAL_SUM_BACKENDS, DEFAULT_BACKEND if None
+    """
+    backend = DEFAULT_BACKEND if backend is None else backend
+    out_dir = os.path.dirname(os.path.abspath(root_output))
+    part_dir = tempfile.mkdtemp(prefix="cal_sum_", dir=out_dir)
+    tasks = [(run[0], run[1], det_num, ind, root_input, part_dir, backend)
+             for det_num in det_nums]
+    try:
+        if processes == 1:
+            parts = [sum_detector(task) for task in tasks]
+        else:
+            pool = mp.Pool(processes, initializer=init_worker,
+                           initargs=(backend,))
+            try:
+                parts = pool.map(sum_detector, tasks)
+                pool.close()
+            finally:
+                pool.terminate()
+                pool.join()
+        merge_parts(sorted(set(parts)), root_output, ind == 0, backend)
+    finally:
+        shutil.rmtree(part_dir)
+
+
+def merge_parts(parts, output, recreate, backend):
+    """Merges the part files into the output file
+
+    Parameters
+    ----------
+    parts : list of str
+        The paths of the part files
+    output : str
+        The path of the output file
+    recreate : bool
+        True to replace the output file, False to add to it
+    backend : str
+        One of CAL_SUM_BACKENDS
+    """
+    if backend == "numpy":
+        arrays = {}
+        if not recreate and os.path.exists(output):
+            outfile = np.load(output)
+            arrays.update((key, outfile[key]) for key in outfile.files)
+            outfile.close()
+        for part in parts:
+            infile = np.load(part)
+            arrays.update((key, infile[key]) for key in infile.files)
+            infile.close()
+        write_npz(output, arrays)
+        return
+    # only the native backend needs root
+    import ROOT as rt
+    outfile = rt.TFile(output, "RECREATE" if recreate else "UPDATE", "",
+                       CAL_FILE_COMPRESSION)
+    for part in parts:
+        infile = rt.TFile(part)
+        for key in infile.GetListOfKeys():
+            hist = key.ReadObj()
+            outfile.cd()
+            hist.Write()
+        infile.Close()
+    outfile.Close()
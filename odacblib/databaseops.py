@@ -1,10 +1,19 @@
 """Functions to create, update, and add to the various databases"""
+import os
 import sqlite3 as sql
 import sys
 import datetime as dt
+import itertools as itt
+import numpy as np
 import odacblib.input_sanitizer as ins
-
-BATCH_TABLE_CMD = """CREATE TABLE batch_table (
+import odacblib.batchdb as bdb
+import odacblib.dbmaint as dbm
+import odacblib.instrument as inst
+import odacblib.readrawdata as rrd
+import odacblib.schedule as sch
+import odacblib.timestamps as ts
+
+BATCH_TABLE_CMD = """CREATE TABLE IF NOT EXISTS batch_table (
     batch_name text PRIMARY KEY,
     start_us_epoch int NOT NULL,
     stop_us_epoch int NOT NULL,
@@ -33,40 +42,49 @@ BATCH_TABLE_CMD = """CREATE TABLE batch_table (
 );
 """
 
-BATCH_UPDATE = """UPDATE batch_table
-SET start_us_epoch = ?,
-    stop_us_epoch = ?,
-    start_time = ?,
-    stop_time = ?,
-    array_x = ?,
-    array_y = ?,
-    raw_root_location = ?,
-    run_data_location = ?,
-    det_data_location = ?,
-    tree_gen = ?,
-    tree_root_location = ?,
-    hist_integration_time = ?,
-    run_count = ?,
-    det_count = ?,
-    first_buffer_skip = ?,
-    start_cycle_number = ?,
-    stop_cycle_number = ?,
-    reactor_status_number = ?,
-    reactor_status_desc = ?,
-    has_been_calibrated = ?,
-    has_been_decomposed = ?,
-    cal_root_location = ?,
-    decomp_root_location = ?,
-    run_db_location text = ?
-WHERE
-    batch_name = ?
-;
-"""
+# the indexes of the batch table, for looking batches up by cycle and status,
+# by time (bounded by the longest batch), and for finding the batches still to
+# be calibrated
+BATCH_INDEX_CMDS = [
+    "CREATE INDEX IF NOT EXISTS batch_by_cycle_index ON batch_table "
+    "(start_cycle_number, reactor_status_number)",
+    "CREATE INDEX IF NOT EXISTS batch_by_time_index ON batch_table "
+    "(start_us_epoch, stop_us_epoch)",
+    "CREATE INDEX IF NOT EXISTS batch_by_length_index ON batch_table "
+    "((stop_us_epoch - start_us_epoch))",
+    "CREATE INDEX IF NOT EXISTS uncalibrated_batch_index ON batch_table "
+    "(start_us_epoch) WHERE has_been_calibrated = 0"]
 
 BATCH_INSERT = "INSERT INTO batch_table VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, "\
     "?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
 
-BATCH_SELECT = "SELECT * FROM batch_table WHERE batch_name='{0:s}';"
+# inserts a batch only if it is not in the table yet, and inserts or replaces
+# it in a single statement
+BATCH_INSERT_NEW = BATCH_INSERT + " ON CONFLICT(batch_name) DO NOTHING"
+
+BATCH_COLUMN_NAMES = ["batch_name", "start_us_epoch", "stop_us_epoch",
+                      "start_time", "stop_time", "array_x", "array_y",
+                      "raw_root_location", "run_data_location",
+                      "det_data_location", "tree_gen", "tree_root_location",
+                      "hist_integration_time", "run_count", "det_count",
+                      "first_buffer_skip", "start_cycle_number",
+                      "stop_cycle_number", "reactor_status_number",
+                      "reactor_status_desc", "has_been_calibrated",
+                      "has_been_decomposed", "cal_root_location",
+                      "decomp_root_location", "run_db_location"]
+
+# the columns set by the later processing of a batch, an existing batch keeps
+# them when its entry is overwritten
+BATCH_PROGRESS_NAMES = ["has_been_calibrated", "has_been_decomposed"]
+
+BATCH_UPSERT = BATCH_INSERT + " ON CONFLICT(batch_name) DO UPDATE SET " + \
+    ", ".join("{0:s} = excluded.{0:s}".format(x) for x in
+              BATCH_COLUMN_NAMES[1:] if x not in BATCH_PROGRESS_NAMES)
+
+BATCH_CALIBRATED_UPDATE = "UPDATE batch_table SET has_been_calibrated = 1 "\
+    "WHERE batch_name = ?"
+
+BATCH_SELECT = "SELECT * FROM batch_table WHERE batch_name = ?"
 
 BATCH_DICT_NAMES = ["BatchName", "StartEpochMicroSec", "StopEpochMicroSec",
                     "StartDateTime", "StopDateTime", "ArrayX", "ArrayY",
@@ -109,15 +127,26 @@ MAKE_RUN_TABLE = """CREATE TABLE run_data_table (
     run_time_us int NOT NULL,
     start_time text NOT NULL,
     stop_time text NOT NULL,
-    center_time text NOT NULL
+    center_time text NOT NULL,
+    reactor_status int,
+    cycle_number int,
+    hours_since_shutdown real
 ) WITHOUT ROWID;
 """
 
-RUN_INSERT = "INSERT INTO run_data_table VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+# lets reactor off (or on) selections, optionally by cycle and time since the
+# shutdown, be answered from the index alone
+MAKE_RUN_STATUS_INDEX = """CREATE INDEX run_by_status_index
+    ON run_data_table (reactor_status, cycle_number, hours_since_shutdown);
+"""
+
+RUN_INSERT = "INSERT INTO run_data_table VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, "\
+    "?, ?)"
 
 RUN_DATA_NAMES = ["RunNum", "StartEpochMicroSec", "StopEpochMicroSec",
                   "CenterEpochMicroSec", "RunTimeMicroSec", "StartDateTime",
-                  "StopDateTime", "CenterDateTime"]
+                  "StopDateTime", "CenterDateTime", "StatusNum", "CycleNum",
+                  "HoursSinceShutdown"]
 
 MAKE_DET_RUN_TABLE = """CREATE TABLE {0:s} (
     run_number int PRIMARY KEY,
@@ -140,12 +169,134 @@ MAKE_DET_RUN_TABLE = """CREATE TABLE {0:s} (
 DET_RUN_INSERT = "INSERT INTO {0:s} VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, "\
                  "?, ?, ?, ?)"
 
+# the per detector run data can either be stored in one table per detector
+# ("per_detector") or in a single table keyed by detector and run number with
+# views that provide the per detector tables ("long")
+DET_RUN_LAYOUTS = ["per_detector", "long"]
+
+# how far into the run csv the run database has been filled, so a batch that
+# is still being written can be topped up with only its new runs
+MAKE_INGEST_STATE_TABLE = """CREATE TABLE IF NOT EXISTS ingest_state_table (
+    run_data_location text PRIMARY KEY,
+    last_run_number int,
+    file_offset int NOT NULL,
+    file_size int NOT NULL
+);
+"""
+
+INGEST_STATE_UPSERT = "INSERT OR REPLACE INTO ingest_state_table VALUES "\
+    "(?, ?, ?, ?)"
+
+INGEST_STATE_SELECT = "SELECT * FROM ingest_state_table WHERE "\
+    "run_data_location = ?"
+
+INGEST_STATE_NAMES = ["RunDataLocation", "LastRunNum", "FileOffset",
+                      "FileSize"]
+
+MAKE_LONG_DET_RUN_TABLE = """CREATE TABLE det_run_table (
+    detector_number int NOT NULL,
+    run_number int NOT NULL,
+    avg_voltage real NOT NULL,
+    avg_current_ua real NOT NULL,
+    avg_hv_temp real NOT NULL,
+    integral_counts int NOT NULL,
+    avg_rate real NOT NULL,
+    en_cal_offset real NOT NULL,
+    en_cal_slope real NOT NULL,
+    en_cal_curve real NOT NULL,
+    widthsq_offset real NOT NULL,
+    widthsq_slope real NOT NULL,
+    widthsq_curve real NOT NULL,
+    is_calibrated int NOT NULL,
+    is_decomposed int NOT NULL,
+    PRIMARY KEY (detector_number, run_number)
+) WITHOUT ROWID;
+"""
+
+# covers the cross detector queries on the measured values for a given run
+MAKE_LONG_DET_RUN_INDEX = """CREATE INDEX det_run_by_run_index
+ON det_run_table (run_number, avg_rate, integral_counts, avg_voltage,
+                  avg_current_ua, avg_hv_temp);
+"""
+
+LONG_DET_RUN_INSERT = "INSERT INTO det_run_table VALUES (?, ?, ?, ?, ?, ?, "\
+                      "?, ?, ?, ?, ?, ?, ?, ?, ?)"
+
+MAKE_DET_RUN_VIEW = """CREATE VIEW {0:s} AS
+SELECT run_number, avg_voltage, avg_current_ua, avg_hv_temp, integral_counts,
+    avg_rate, en_cal_offset, en_cal_slope, en_cal_curve, widthsq_offset,
+    widthsq_slope, widthsq_curve, is_calibrated, is_decomposed
+FROM det_run_table
+WHERE detector_number = {1:d};
+"""
+
 DET_RUN_NAMES = ["RunNum", "AvgVoltage", "AvgCurrentMicroAmps", "AvgHvTempCel",
                  "TotalCounts", "AvgRate", "EnCalOffset", "EnCalSlope",
                  "EnCalCurve", "WidthSqOffset", "WidthSqSlope", "WidthSqCurve",
                  "IsCalibrated", "IsDecomposed"]
 
-def make_batch_database(run_db_path, det_data, run_data, det_run_data):
+# sets the calibration of a range of runs of one detector, the columns are in
+# CAL_NAMES order followed by the first and last run
+CAL_UPDATE = """UPDATE {0:s} SET en_cal_offset = ?, en_cal_slope = ?,
+    en_cal_curve = ?, widthsq_offset = ?, widthsq_slope = ?,
+    widthsq_curve = ?, is_calibrated = 1
+    WHERE run_number BETWEEN ? AND ?"""
+
+LONG_CAL_UPDATE = """UPDATE det_run_table SET en_cal_offset = ?,
+    en_cal_slope = ?, en_cal_curve = ?, widthsq_offset = ?,
+    widthsq_slope = ?, widthsq_curve = ?, is_calibrated = 1
+    WHERE detector_number = ? AND run_number BETWEEN ? AND ?"""
+
+# sets the calibration of a single run of one detector, the columns are in
+# CAL_NAMES order followed by the run
+RUN_CAL_UPDATE = """UPDATE {0:s} SET en_cal_offset = ?, en_cal_slope = ?,
+    en_cal_curve = ?, widthsq_offset = ?, widthsq_slope = ?,
+    widthsq_curve = ?, is_calibrated = 1
+    WHERE run_number = ?"""
+
+LONG_RUN_CAL_UPDATE = """UPDATE det_run_table SET en_cal_offset = ?,
+    en_cal_slope = ?, en_cal_curve = ?, widthsq_offset = ?,
+    widthsq_slope = ?, widthsq_curve = ?, is_calibrated = 1
+    WHERE detector_number = ? AND run_number = ?"""
+
+RUN_TIME_SELECT = "SELECT run_number, center_us_epoch FROM run_data_table "\
+    "ORDER BY run_number"
+
+CAL_NAMES = ["EnCalOffset", "EnCalSlope", "EnCalCurve", "WidthSqOffset",
+             "WidthSqSlope", "WidthSqCurve"]
+
+# decision names of the "table already exists" prompts, see ins.set_policy
+# the per detector run tables can also be given a policy by table name
+TABLE_DECISIONS = ["batch_table", "det_data_table", "run_data_table",
+                   "det_run_table"]
+
+# the answers of the "table already exists" prompts
+EXISTS_CHOICES = {"abort": 1, "overwrite": 2, "skip": 3}
+
+for _decision in TABLE_DECISIONS:
+    ins.register_decision(_decision, "int", choices=EXISTS_CHOICES,
+                          inclusive_lower_bound=1, inclusive_upper_bound=3)
+
+# pragmas used while a new run database is being built, the database is
+# rebuilt from the csv files if a build is interrupted so durability can be
+# relaxed, they are never used on an existing database as a crash could then
+# corrupt the data it already held
+BUILD_PRAGMAS = ["PRAGMA journal_mode = MEMORY",
+                 "PRAGMA synchronous = OFF",
+                 "PRAGMA cache_size = -65536"]
+
+# pragmas used while an existing run database is rebuilt, and restored once
+# the build of a new one is committed
+SAFE_PRAGMAS = ["PRAGMA journal_mode = DELETE",
+                "PRAGMA synchronous = FULL",
+                "PRAGMA cache_size = -2000"]
+
+
+@inst.timed
+def make_batch_database(run_db_path, det_data, run_cols,
+                        layout=DET_RUN_LAYOUTS[0], vacuum_mode="auto",
+                        vacuum_threshold=dbm.FREELIST_THRESHOLD,
+                        ingest_state=None):
     """Creates the run information database from the base data
 
     Parameters
@@ -154,157 +305,562 @@ def make_batch_database(run_db_path, det_data, run_data, det_run_data):
         Path to the run database file to be created
     det_data : list of dict
         list of dictionary of the detector data
-    run_data : dict
-        dictionary of non detector specific run data
-    det_run_data : list of dicts
-        list of dictionaries of detector specific run data
+    run_cols : dict or iterable of dict
+        dictionary of numpy arrays of run data, see rrd.read_run_columns, or
+        chunks of it, see rrd.iter_run_chunks, the chunks are always consumed
+        even if the user chooses to skip every table
+    layout : str
+        how the per detector run data is stored, one of DET_RUN_LAYOUTS
+    vacuum_mode : str
+        how free pages are reclaimed afterwards, one of dbm.VACUUM_MODES
+    vacuum_threshold : float
+        free page fraction that triggers a full vacuum in auto mode
+    ingest_state : dict
+        how much of the run csv run_cols holds, see set_ingest_state, it is
+        recorded if the run table is written so later appends can pick up
+        where this left off, when streaming chunks it is read once they have
+        all been consumed
+
+    Notes
+    -----
+    All the tables are written inside a single transaction, with
+    BUILD_PRAGMAS in effect if the database is new and SAFE_PRAGMAS if it
+    already existed, SAFE_PRAGMAS are in effect when the database is vacuumed
     """
+    if isinstance(run_cols, dict):
+        run_cols = [run_cols]
+    det_nums = [x["DetNum"] for x in det_data]
     # if the database did not already exist it will be created in the connect
-    dbcon = sql.connect(run_db_path)
+    # autocommit mode so that we control the transaction explicitly
+    is_new = not os.path.exists(run_db_path)
+    dbcon = sql.connect(run_db_path, isolation_level=None)
     cursor = dbcon.cursor()
-    # make the detector info table
-    make_det_table(dbcon, cursor, det_data)
-    # make the run table
-    make_run_table(dbcon, cursor, run_data)
-    # make the detector run tables
-    make_det_run_tables(dbcon, cursor, det_run_data)
-    # now optimize the database
-    cursor.execute("VACUUM")
-    dbcon.commit()
+    dbm.enable_incremental_vacuum(cursor)
+    set_pragmas(cursor, BUILD_PRAGMAS if is_new else SAFE_PRAGMAS)
+    cursor.execute("BEGIN")
+    try:
+        # make the detector info table
+        make_det_table(cursor, det_table_rows(det_data))
+        # make the run table and the detector run tables, then fill them
+        write_run = create_table(cursor, MAKE_RUN_TABLE, "run_data_table")
+        if layout == "long":
+            write_long = make_long_det_run_table(cursor, det_nums)
+            det_inds = range(len(det_nums)) if write_long else []
+        else:
+            det_inds = make_det_run_tables(cursor, det_nums)
+        for chunk in run_cols:
+            insert_run_chunk(cursor, chunk, layout, write_run, det_inds)
+        if write_run:
+            cursor.execute(MAKE_RUN_STATUS_INDEX)
+            if ingest_state is not None:
+                set_ingest_state(cursor, ingest_state)
+        if layout == "long" and write_long:
+            # the index is built in one go once the table is filled
+            cursor.execute(MAKE_LONG_DET_RUN_INDEX)
+    except BaseException:
+        # this includes the sys.exit from an abort at one of the prompts
+        cursor.execute("ROLLBACK")
+        dbcon.close()
+        raise
+    cursor.execute("COMMIT")
+    set_pragmas(cursor, SAFE_PRAGMAS)
+    # now reclaim any pages freed by recreated tables
+    dbm.maintain_database(cursor, vacuum_mode, vacuum_threshold)
     dbcon.close()
     print "Added run information to local batch database"
 
 
-def make_det_run_tables(dbcon, cursor, det_run_data):
-    """Creates a table for each run that contains the relavent information for
-    that detector in that run
+def set_pragmas(cursor, pragma_list):
+    """Applies a list of pragma statements
+
+    Parameters
+    ----------
+    cursor : sqlite cursor
+        The cursor into the sqlite database
+    pragma_list : list of str
+        The pragma statements to execute
+    """
+    for pragma in pragma_list:
+        cursor.execute(pragma)
+
+
+def make_det_run_tables(cursor, det_nums):
+    """Creates a table for each detector that will contain the relavent
+    information for that detector in each run
 
     Parameters
     ----------
-    dbcon : sqlite database connection
-        The connection to the sqlite run database
     cursor : splite cursor
         The cursor into the sqlite database
-    det_run_data : list of lists of dicts
-        The list of lists of per run detector information
+    det_nums : list of int
+        The detector numbers
+
+    Returns
+    -------
+    det_inds : list of int
+        The indices in det_nums of the detectors whose tables should be
+        filled, the user may choose to skip some
     """
-    for data in det_run_data:
+    det_inds = []
+    for ind, det_num in enumerate(det_nums):
         # create the name of the database
-        table_name = "det_{0:02d}_run_table".format(data[0]["DetNum"])
+        table_name = "det_{0:02d}_run_table".format(det_num)
         make_tbl_cmd = MAKE_DET_RUN_TABLE.format(table_name)
-        try:
-            cursor.execute(make_tbl_cmd)
-        except sql.OperationalError:
-            # if there was an error creating the table then it already exists
-            print "\n{0:s} already exists for this batch".format(table_name)
-            print "    1 - Abort execution"
-            print "    2 - Recreate {0:s}".format(table_name)
-            print "    3 - Skip Writing {0:s}".format(table_name)
-            ans = ins.get_int("Enter Option Number:", inclusive_lower_bound=1,
-                              inclusive_upper_bound=3, default_value=3)
-            if ans == 1:
-                print "Aborting Execution"
-                sys.exit()
-            elif ans == 2:
-                print "Recreating {0:s}".format(table_name)
-                cursor.execute("DROP TABLE {0:s}".format(table_name))
-                cursor.execute(make_tbl_cmd)
-            elif ans == 3:
-                print "Skipping writing of {0:s}".format(table_name)
-                continue
-        # now insert the data into the table
-        insert_cmd = DET_RUN_INSERT.format(table_name)
-        for run in data:
-            insert_list = generate_insert_list(run, DET_RUN_NAMES)
-            cursor.execute(insert_cmd, insert_list)
-        dbcon.commit()
+        if create_table(cursor, make_tbl_cmd, table_name,
+                        [table_name, "det_run_table"]):
+            det_inds.append(ind)
+    return det_inds
 
 
-def make_run_table(dbcon, cursor, run_data):
-    """Takes the list of run data dictionaries and dumps them to the run data
-    table
+def make_long_det_run_table(cursor, det_nums):
+    """Creates the single table that will hold the per run information of
+    every detector, along with views that mimic the per detector tables
 
     Parameters
     ----------
-    dbcon : sqlite database connection
-        The connection to the sqlite run database
     cursor : splite cursor
         The cursor into the sqlite database
-    run_data : list of dicts
-        The list of run data dictionaries
+    det_nums : list of int
+        The detector numbers
+
+    Returns
+    -------
+    write_table : bool
+        False if the user chose to skip writing the table
     """
-    # check if the table exists (in case the db is newly created)
+    write_table = create_table(cursor, MAKE_LONG_DET_RUN_TABLE,
+                               "det_run_table")
+    # now make the views that keep the old table names working
+    for det_num in det_nums:
+        view_name = "det_{0:02d}_run_table".format(det_num)
+        cursor.execute("SELECT type FROM sqlite_master WHERE name = ?",
+                       (view_name,))
+        temp = cursor.fetchone()
+        if temp is not None and temp[0] == "table":
+            print "{0:s} exists as a table, not replacing it with a "\
+                "view".format(view_name)
+            continue
+        cursor.execute("DROP VIEW IF EXISTS {0:s}".format(view_name))
+        cursor.execute(MAKE_DET_RUN_VIEW.format(view_name, det_num))
+    return write_table
+
+
+def insert_run_chunk(cursor, run_cols, layout, write_run=True, det_inds=None):
+    """Inserts a set of runs into the run table and detector run tables
+
+    Parameters
+    ----------
+    cursor : splite cursor
+        The cursor into the sqlite database
+    run_cols : dict
+        dictionary of numpy arrays of run data, see rrd.read_run_columns
+    layout : str
+        how the per detector run data is stored, one of DET_RUN_LAYOUTS
+    write_run : bool
+        False to leave the run table alone
+    det_inds : list of int
+        the indices in run_cols["DetNum"] of the detectors to insert, None
+        for all of them
+    """
+    det_nums = run_cols["DetNum"].tolist()
+    if det_inds is None:
+        det_inds = range(len(det_nums))
+    num_runs = len(run_cols["RunNum"])
+    if write_run:
+        cursor.executemany(RUN_INSERT, run_table_rows(run_cols))
+        inst.count("RunRows", num_runs)
+    inst.count("DetRunRows", num_runs * len(det_inds))
+    for ind in det_inds:
+        if layout == "long":
+            # detector by detector, in primary key order within the chunk
+            cursor.executemany(LONG_DET_RUN_INSERT, (
+                (det_nums[ind],) + row for row in
+                det_run_table_rows(run_cols, ind)))
+        else:
+            cursor.executemany(DET_RUN_INSERT.format(
+                "det_{0:02d}_run_table".format(det_nums[ind])),
+                               det_run_table_rows(run_cols, ind))
+
+
+def get_det_run_layout(cursor):
+    """Determines which layout the per detector run data of a run database
+    uses
+
+    Parameters
+    ----------
+    cursor : splite cursor
+        The cursor into the sqlite database
+
+    Returns
+    -------
+    layout : str
+        one of DET_RUN_LAYOUTS
+    """
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND "
+                   "name = 'det_run_table'")
+    if cursor.fetchone() is None:
+        return "per_detector"
+    return "long"
+
+
+@inst.timed
+def append_batch_database(run_db_path, run_cols, ingest_state):
+    """Appends newly written runs to the run and detector run tables of an
+    existing run database, in the layout the database already uses
+
+    Parameters
+    ----------
+    run_db_path : str
+        Path to the run database file
+    run_cols : dict
+        dictionary of numpy arrays of the new runs, see rrd.read_run_tail
+    ingest_state : dict
+        how much of the run csv has now been ingested, see set_ingest_state
+    """
+    dbcon = sql.connect(run_db_path, isolation_level=None)
+    cursor = dbcon.cursor()
+    layout = get_det_run_layout(cursor)
+    cursor.execute("BEGIN")
     try:
-        cursor.execute(MAKE_RUN_TABLE)
-    except sql.OperationalError:
-        # if there was an error creating the table then it already exists
-        print "\nRun info table already exists for this batch"
-        print "    1 - Abort execution"
-        print "    2 - Recreate run_data_table"
-        print "    3 - Skip Writing run_data_table"
-        ans = ins.get_int("Enter Option Number:", inclusive_lower_bound=1,
-                          inclusive_upper_bound=3, default_value=3)
-        if ans == 1:
-            print "Aborting Execution"
-            sys.exit()
-        elif ans == 2:
-            print "Recreating run_data_table"
-            cursor.execute("DROP TABLE run_data_table")
-            cursor.execute(MAKE_RUN_TABLE)
-        elif ans == 3:
-            print "Skipping writing of run_data_table"
-            return
-    # now insert the data into the table
-    for data in run_data:
-        insert_list = generate_insert_list(data, RUN_DATA_NAMES)
-        cursor.execute(RUN_INSERT, insert_list)
-    dbcon.commit()
+        insert_run_chunk(cursor, run_cols, layout)
+        set_ingest_state(cursor, ingest_state)
+    except BaseException:
+        cursor.execute("ROLLBACK")
+        dbcon.close()
+        raise
+    cursor.execute("COMMIT")
+    dbcon.close()
+    print "Appended {0:d} runs to local batch database".format(
+        len(run_cols["RunNum"]))
 
 
-def make_det_table(dbcon, cursor, det_data):
-    """Takes the list of detector data dictionaries and puts them in the
-    appropriate table
+@inst.timed
+def write_block_calibrations(run_db_path, runs, results):
+    """Writes the calibration of each calibration block to all of its runs,
+    with one bulk update per detector table
+
+    Parameters
+    ----------
+    run_db_path : str
+        Path to the run database file
+    runs : list of tuples
+        list of tuples where each tuple has the start run, the stop run,
+        the gamma-ray list for calibration, and the "kind" of calibration
+    results : dict
+        The calibration of each detector and block keyed by (detector number,
+        calibration number), the CAL_NAMES values and Success, blocks that
+        were not successfully calibrated are left alone
+    """
+    updates = {}
+    for (det_num, ind), result in sorted(results.items()):
+        if not result["Success"]:
+            continue
+        updates.setdefault(det_num, []).append(
+            generate_insert_list(result, CAL_NAMES) + [runs[ind][0],
+                                                       runs[ind][1]])
+    dbcon = sql.connect(run_db_path, isolation_level=None)
+    cursor = dbcon.cursor()
+    layout = get_det_run_layout(cursor)
+    cursor.execute("BEGIN")
+    try:
+        for det_num, rows in sorted(updates.items()):
+            if layout == "long":
+                cursor.executemany(LONG_CAL_UPDATE,
+                                   [x[:-2] + [det_num] + x[-2:] for x in rows])
+            else:
+                cursor.executemany(CAL_UPDATE.format(
+                    "det_{0:02d}_run_table".format(det_num)), rows)
+            inst.count("CalRows", cursor.rowcount)
+    except BaseException:
+        cursor.execute("ROLLBACK")
+        dbcon.close()
+        raise
+    cursor.execute("COMMIT")
+    dbcon.close()
+    print "Wrote calibrations of {0:d} detectors to local batch "\
+        "database".format(len(updates))
+
+
+def read_run_times(run_db_path):
+    """Reads the run numbers and center times from the run database
+
+    Parameters
+    ----------
+    run_db_path : str
+        Path to the run database file
+
+    Returns
+    -------
+    run_nums : numpy.ndarray
+        The run numbers in increasing order
+    center_times : numpy.ndarray
+        The center of each run in epoch microseconds
+    """
+    dbcon = sql.connect(run_db_path)
+    rows = dbcon.execute(RUN_TIME_SELECT).fetchall()
+    dbcon.close()
+    values = np.array(rows, dtype=np.int64).reshape((len(rows), 2))
+    return values[:, 0], values[:, 1]
+
+
+@inst.timed
+def write_run_calibrations(run_db_path, det_nums, run_nums, run_params):
+    """Writes the calibration of every run of every detector, with one bulk
+    update per detector table
+
+    Parameters
+    ----------
+    run_db_path : str
+        Path to the run database file
+    det_nums : list of int
+        The detector numbers, in the order of the detector axis of run_params
+    run_nums : numpy.ndarray
+        The run numbers, in the order of the run axis of run_params
+    run_params : numpy.ndarray
+        Array of shape (runs, detectors, CAL_NAMES), detectors with nan are
+        left alone
+    """
+    run_list = run_nums.tolist()
+    dbcon = sql.connect(run_db_path, isolation_level=None)
+    cursor = dbcon.cursor()
+    layout = get_det_run_layout(cursor)
+    num_written = 0
+    cursor.execute("BEGIN")
+    try:
+        for ind, det_num in enumerate(det_nums):
+            if np.isnan(run_params[:, ind]).any():
+                continue
+            cols = [run_params[:, ind, i].tolist()
+                    for i in range(len(CAL_NAMES))]
+            if layout == "long":
+                cursor.executemany(LONG_RUN_CAL_UPDATE, itt.izip(
+                    *(cols + [itt.repeat(det_num), run_list])))
+            else:
+                cursor.executemany(RUN_CAL_UPDATE.format(
+                    "det_{0:02d}_run_table".format(det_num)),
+                                   itt.izip(*(cols + [run_list])))
+            num_written += 1
+            inst.count("CalRows", len(run_list))
+    except BaseException:
+        cursor.execute("ROLLBACK")
+        dbcon.close()
+        raise
+    cursor.execute("COMMIT")
+    dbcon.close()
+    print "Wrote per run calibrations of {0:d} detectors to local batch "\
+        "database".format(num_written)
+
+
+def set_ingest_state(cursor, ingest_state):
+    """Records how much of a run csv has been put in the run database
 
     Parameters
     ----------
-    dbcon : sqlite database connection
-        The connection to the sqlite run database
     cursor : splite cursor
         The cursor into the sqlite database
-    det_data : list of dicts
-        The list of detector data dictionaries
+    ingest_state : dict
+        RunDataLocation (the run csv), LastRunNum (None if no runs have been
+        read), FileOffset (the offset just past the last complete line read),
+        and FileSize (the size of the file when it was read)
+    """
+    cursor.execute(MAKE_INGEST_STATE_TABLE)
+    cursor.execute(INGEST_STATE_UPSERT,
+                   generate_insert_list(ingest_state, INGEST_STATE_NAMES))
+
+
+def get_ingest_state(run_db_path, run_csv):
+    """Reads back how much of a run csv has been put in the run database
+
+    Parameters
+    ----------
+    run_db_path : str
+        Path to the run database file
+    run_csv : str
+        Path to the run csv
+
+    Returns
+    -------
+    ingest_state : dict
+        see set_ingest_state, None if nothing from run_csv has been recorded
+    """
+    dbcon = sql.connect(run_db_path)
+    cursor = dbcon.cursor()
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND "
+                   "name = 'ingest_state_table'")
+    temp = None
+    if cursor.fetchone() is not None:
+        cursor.execute(INGEST_STATE_SELECT, (run_csv,))
+        temp = cursor.fetchone()
+    dbcon.close()
+    if temp is None:
+        return None
+    return dict(zip(INGEST_STATE_NAMES, temp))
+
+
+def make_det_table(cursor, rows):
+    """Takes the detector data rows and puts them in the appropriate table
+
+    Parameters
+    ----------
+    cursor : splite cursor
+        The cursor into the sqlite database
+    rows : iterable of tuples
+        The detector data rows, see det_table_rows
+    """
+    if create_table(cursor, MAKE_DET_DATA_TABLE, "det_data_table"):
+        cursor.executemany(DET_INSERT, rows)
+
+
+def create_table(cursor, make_tbl_cmd, table_name, decision=None):
+    """Creates a table, asking the user what to do if it already exists
+
+    Parameters
+    ----------
+    cursor : splite cursor
+        The cursor into the sqlite database
+    make_tbl_cmd : str
+        The CREATE TABLE statement
+    table_name : str
+        The name of the table being created
+    decision : str or list of str
+        The decision name(s) of the prompt, defaults to table_name
+
+    Returns
+    -------
+    write_table : bool
+        True if the (empty) table exists and should be filled
+        False if the user chose to skip writing the table
     """
-    # check if the table exists (in case the db is newly created)
     try:
-        cursor.execute(MAKE_DET_DATA_TABLE)
+        cursor.execute(make_tbl_cmd)
     except sql.OperationalError:
         # if there was an error creating the table then it already exists
-        print "\nDet info table already exists for this batch"
+        print "\n{0:s} already exists for this batch".format(table_name)
         print "    1 - Abort execution"
-        print "    2 - Recreate det_data_table"
-        print "    3 - Skip Writing det_data_table"
+        print "    2 - Recreate {0:s}".format(table_name)
+        print "    3 - Skip Writing {0:s}".format(table_name)
         ans = ins.get_int("Enter Option Number:", inclusive_lower_bound=1,
-                          inclusive_upper_bound=3, default_value=3)
+                          inclusive_upper_bound=3, default_value=3,
+                          decision=(table_name if decision is None
+                                    else decision),
+                          choices=EXISTS_CHOICES)
         if ans == 1:
             print "Aborting Execution"
             sys.exit()
         elif ans == 2:
-            print "Recreating det_data_table"
-            cursor.execute("DROP TABLE det_data_table")
-            cursor.execute(MAKE_DET_DATA_TABLE)
+            print "Recreating {0:s}".format(table_name)
+            # the name may be one of the views of the long layout
+            cursor.execute("SELECT type FROM sqlite_master WHERE name = ?",
+                           (table_name,))
+            cursor.execute("DROP {0:s} {1:s}".format(
+                cursor.fetchone()[0].upper(), table_name))
+            cursor.execute(make_tbl_cmd)
         elif ans == 3:
-            print "Skipping writing of det_data_table"
-            return
-    # now insert the data into the table
-    for data in det_data:
-        insert_list = generate_insert_list(data, DET_DATA_NAMES)
-        cursor.execute(DET_INSERT, insert_list)
-    dbcon.commit()
+            print "Skipping writing of {0:s}".format(table_name)
+            return False
+    return True
+
+
+def det_table_rows(det_data):
+    """Generates the rows of the detector data table
+
+    Parameters
+    ----------
+    det_data : list of dicts
+        The list of detector data dictionaries
+
+    Returns
+    -------
+    rows : list of lists
+        The insert list for each detector
+    """
+    return [generate_insert_list(data, DET_DATA_NAMES) for data in det_data]
+
+
+def run_table_rows(run_cols):
+    """Generates the rows of the run data table straight from the columnar
+    run data
+
+    Parameters
+    ----------
+    run_cols : dict
+        dictionary of numpy arrays of run data, see rrd.read_run_columns
+
+    Returns
+    -------
+    rows : iterator of tuples
+        The insert tuple for each run, in RUN_DATA_NAMES order
+    """
+    cols = []
+    for key in RUN_DATA_NAMES:
+        if "DateTime" in key:
+            cols.append(ts.datetime64_to_str(run_cols[key]))
+        elif key == "HoursSinceShutdown":
+            cols.append([None if np.isnan(x) else x
+                         for x in run_cols[key].tolist()])
+        elif key in ["StatusNum", "CycleNum"]:
+            # runs the schedule could not place are stored as NULL
+            cols.append([None if x == sch.UNKNOWN_VALUE else x
+                         for x in run_cols[key].tolist()])
+        else:
+            cols.append(run_cols[key].tolist())
+    return itt.izip(*cols)
+
+
+def det_run_table_rows(run_cols, ind):
+    """Generates the rows of a single detector run table straight from the
+    columnar run data
+
+    Parameters
+    ----------
+    run_cols : dict
+        dictionary of numpy arrays of run data, see rrd.read_run_columns
+    ind : int
+        the index of the detector in run_cols["DetNum"]
+
+    Returns
+    -------
+    rows : iterator of tuples
+        The insert tuple for each run, in DET_RUN_NAMES order
+    """
+    cols = [run_cols["RunNum"].tolist()]
+    for key in DET_RUN_NAMES[1:]:
+        if key in rrd.DET_RUN_DEFAULTS:
+            cols.append(itt.repeat(generate_insert_list(rrd.DET_RUN_DEFAULTS,
+                                                        [key])[0]))
+        else:
+            cols.append(run_cols[key][:, ind].tolist())
+    return itt.izip(*cols)
+
+
+def open_batch_database(db_loc):
+    """Opens the global batch database, creating the batch table and its
+    indexes if needed
 
+    Parameters
+    ----------
+    db_loc : str
+        path to the batch database file
 
-def overwrite_batch_data(batch_data, db_loc):
+    Returns
+    -------
+    dbcon : sqlite database connection
+        This process's connection to the batch database, see
+        bdb.get_connection, it is shared so it is closed with
+        bdb.close_connection rather than directly
+    """
+    dbcon = bdb.get_connection(db_loc)
+    bdb.with_retry(dbcon.execute, BATCH_TABLE_CMD)
+    for cmd in BATCH_INDEX_CMDS:
+        bdb.with_retry(dbcon.execute, cmd)
+    return dbcon
+
+
+def overwrite_batch_data(batch_data, db_loc, vacuum_mode="auto",
+                         vacuum_threshold=dbm.FREELIST_THRESHOLD, dbcon=None):
     """Adds a row to the global batch database using the batch data
-    dictionary that was read in earlier
+    dictionary that was read in earlier, replacing the row of the batch if
+    there is one
 
     Parameters
     ----------
@@ -312,28 +868,62 @@ def overwrite_batch_data(batch_data, db_loc):
         dictionary of information to be dumped into the batch database
     db_loc : str
         path to the batch database file
+    vacuum_mode : str
+        how free pages are reclaimed afterwards, one of dbm.VACUUM_MODES
+    vacuum_threshold : float
+        free page fraction that triggers a full vacuum in auto mode
+    dbcon : sqlite database connection
+        An already open connection to the batch database, if None this
+        process's connection to the database at db_loc is used
     """
-    # if the database did not already exist it will be created in the connect
-    dbcon = sql.connect(db_loc)
-    cursor = dbcon.cursor()
-    # check if the table exists (in case the db is newly created)
-    try:
-        cursor.execute(BATCH_TABLE_CMD)
-    except sql.OperationalError:
-        # if there was an error creating the table then it already exists
-        pass
-    out_list = generate_insert_list(batch_data, BATCH_DICT_NAMES)
-    # move the batch name to the end
-    out_list = out_list[1:]
-    out_list.append(batch_data["BatchName"])
-    # update the entry
-    cursor.execute(BATCH_UPDATE, out_list)
-    dbcon.commit()
-    cursor.execute("VACUUM")
-    dbcon.commit()
+    upsert_batch_data([batch_data], db_loc, dbcon)
+    if dbcon is None:
+        dbcon = open_batch_database(db_loc)
+    bdb.with_retry(dbm.maintain_database, dbcon.cursor(), vacuum_mode,
+                   vacuum_threshold)
+
+
+def upsert_batch_data(batch_list, db_loc, dbcon=None):
+    """Inserts or replaces the rows of many batches in the global batch
+    database, in one statement per batch and one transaction
+
+    Parameters
+    ----------
+    batch_list : list of dict
+        the dictionaries of batch information
+    db_loc : str
+        path to the batch database file
+    dbcon : sqlite database connection
+        An already open connection to the batch database, if None this
+        process's connection to the database at db_loc is used
+    """
+    if dbcon is None:
+        dbcon = open_batch_database(db_loc)
+    rows = [generate_insert_list(x, BATCH_DICT_NAMES) for x in batch_list]
+    bdb.run_transaction(dbcon, lambda cursor: cursor.executemany(
+        BATCH_UPSERT, rows))
+
+
+def mark_batch_calibrated(batch_name, db_loc, dbcon=None):
+    """Marks a batch as calibrated in the global batch database
+
+    Parameters
+    ----------
+    batch_name : str
+        The name of the batch
+    db_loc : str
+        path to the batch database file
+    dbcon : sqlite database connection
+        An already open connection to the batch database, if None this
+        process's connection to the database at db_loc is used
+    """
+    if dbcon is None:
+        dbcon = open_batch_database(db_loc)
+    bdb.run_transaction(dbcon, lambda cursor: cursor.execute(
+        BATCH_CALIBRATED_UPDATE, (batch_name,)))
 
 
-def add_batch_data(batch_data, db_loc):
+def add_batch_data(batch_data, db_loc, dbcon=None):
     """Adds a row to the global batch database using the batch data
     dictionary that was read in earlier
 
@@ -341,8 +931,11 @@ def add_batch_data(batch_data, db_loc):
     ----------
     batch_data : dict
         dictionary of information to be dumped into the batch database
-    batch_db_path : str
+    db_loc : str
         path to the batch database file
+    dbcon : sqlite database connection
+        An already open connection to the batch database, if None this
+        process's connection to the database at db_loc is used
 
     Returns
     -------
@@ -350,27 +943,39 @@ def add_batch_data(batch_data, db_loc):
         True if successful
         False if there was an unrecoverable error
     """
-    # if the database did not already exist it will be created in the connect
-    dbcon = sql.connect(db_loc)
-    cursor = dbcon.cursor()
-    # check if the table exists (in case the db is newly created)
-    try:
-        cursor.execute(BATCH_TABLE_CMD)
-    except sql.OperationalError:
-        # if there was an error creating the table then it already exists
-        pass
+    if dbcon is None:
+        dbcon = open_batch_database(db_loc)
     out_list = generate_insert_list(batch_data, BATCH_DICT_NAMES)
-    cursor.execute(BATCH_SELECT.format(batch_data["BatchName"]))
-    temp = cursor.fetchone()
-    if temp is None:
-        cursor.execute(BATCH_INSERT, out_list)
-        dbcon.commit()
-        return True
-    else:
+    temp = bdb.run_transaction(dbcon, insert_new_batch, out_list)
+    if temp is not None:
         print "Error, batch already in batch database"
         for key, val in zip(BATCH_DICT_NAMES, temp):
             print "%20s:"%key, val
-        return False
+    return temp is None
+
+
+def insert_new_batch(cursor, out_list):
+    """Inserts a batch into the batch table unless it is already there
+
+    Parameters
+    ----------
+    cursor : sqlite cursor
+        The cursor into the batch database, inside a transaction
+    out_list : list
+        The values of the new row, in BATCH_DICT_NAMES order
+
+    Returns
+    -------
+    existing : tuple
+        The row already in the table, None if the batch was inserted
+    """
+    cursor.execute(BATCH_INSERT_NEW, out_list)
+    if cursor.rowcount == 1:
+        return None
+    # only read back the existing row when there is a conflict
+    cursor.execute(BATCH_SELECT, (out_list[0],))
+    return cursor.fetchone()
+
 
 def generate_insert_list(data, name_list):
     """Generates a list of the contents of the dictionary in the order
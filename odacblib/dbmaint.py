@@ -0,0 +1,109 @@
+"""Functions for the upkeep of the sqlite databases, chiefly deciding when and
+how free pages get reclaimed"""
+import time
+import odacblib.instrument as inst
+
+# auto - incremental vacuum if the database supports it, otherwise a full
+#        vacuum once the free page fraction passes the threshold
+# none - never vacuum
+# incremental - run PRAGMA incremental_vacuum, converting the database to
+#               auto_vacuum = INCREMENTAL first if needed
+# full - always run a full VACUUM
+VACUUM_MODES = ["auto", "none", "incremental", "full"]
+
+# fraction of free pages above which the auto mode runs a full vacuum
+FREELIST_THRESHOLD = 0.25
+
+# value of PRAGMA auto_vacuum for incremental mode
+AUTO_VACUUM_INCREMENTAL = 2
+
+
+def get_page_stats(cursor):
+    """Reads the page statistics of the database
+
+    Parameters
+    ----------
+    cursor : sqlite cursor
+        The cursor into the sqlite database
+
+    Returns
+    -------
+    page_size : int
+        The size of a page in bytes
+    page_count : int
+        The total number of pages in the database file
+    freelist_count : int
+        The number of unused pages in the database file
+    """
+    page_size = cursor.execute("PRAGMA page_size").fetchone()[0]
+    page_count = cursor.execute("PRAGMA page_count").fetchone()[0]
+    freelist_count = cursor.execute("PRAGMA freelist_count").fetchone()[0]
+    return page_size, page_count, freelist_count
+
+
+def enable_incremental_vacuum(cursor):
+    """Requests auto_vacuum = INCREMENTAL, this only takes effect immediately
+    if no tables have been created in the database yet, otherwise it takes
+    effect at the next full VACUUM
+
+    Parameters
+    ----------
+    cursor : sqlite cursor
+        The cursor into the sqlite database
+    """
+    cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+
+
+@inst.timed
+def maintain_database(cursor, mode="auto", threshold=FREELIST_THRESHOLD):
+    """Reclaims the free pages of a database according to the vacuum mode,
+    this must not be called while a transaction is open
+
+    Parameters
+    ----------
+    cursor : sqlite cursor
+        The cursor into the sqlite database
+    mode : str
+        One of VACUUM_MODES
+    threshold : float
+        The free page fraction above which the auto mode runs a full vacuum
+
+    Returns
+    -------
+    report : dict
+        Mode, Action ("none", "incremental", or "full"), Seconds spent, and
+        BytesReclaimed
+    """
+    if mode not in VACUUM_MODES:
+        raise ValueError("Unknown vacuum mode: {0:s}".format(mode))
+    start = time.time()
+    page_size, page_count, freelist_count = get_page_stats(cursor)
+    auto_vacuum = cursor.execute("PRAGMA auto_vacuum").fetchone()[0]
+    action = "none"
+    if mode == "full":
+        action = "full"
+    elif mode == "incremental":
+        if auto_vacuum == AUTO_VACUUM_INCREMENTAL:
+            action = "incremental"
+        else:
+            # one time conversion, this needs a full vacuum to take effect
+            enable_incremental_vacuum(cursor)
+            action = "full"
+    elif mode == "auto" and freelist_count > 0:
+        if auto_vacuum == AUTO_VACUUM_INCREMENTAL:
+            action = "incremental"
+        elif float(freelist_count) / page_count > threshold:
+            action = "full"
+    if action == "full":
+        cursor.execute("VACUUM")
+    elif action == "incremental":
+        cursor.execute("PRAGMA incremental_vacuum").fetchall()
+    _, new_page_count, _ = get_page_stats(cursor)
+    report = {"Mode": mode, "Action": action,
+              "Seconds": time.time() - start,
+              "BytesReclaimed": (page_count - new_page_count) * page_size}
+    inst.count("VacuumBytes", report["BytesReclaimed"])
+    if action != "none":
+        print "Vacuum ({0:s}) took {1:.3f} s and reclaimed {2:d} bytes".format(
+            action, report["Seconds"], report["BytesReclaimed"])
+    return report
@@ -3,23 +3,49 @@ determining which blocks should be summed into overall spectra for figuring out
 starting calibrations for the automatic calibration system"""
 
 import datetime as dt
-import itertools as itt
+import numpy as np
 import odacblib.schedule as sch
-import odacblib.rootops as ro
+import odacblib.input_sanitizer as ins
+import odacblib.lazyimport as lazy
+
+# rootops is only needed to look for the 24Na peak, see find_sodium_peak_runs
+ro = lazy.lazy_module("odacblib.rootops")
+
+# the 24Na peak prompts of ro.find_sodium_peak_runs, registered here so the
+# policies of the decision are checked without importing rootops
+ins.register_decision("sodium_peak", "bool")
 
 #TODO: handle the possibility of the MIF being present
 #TODO: Figure out how to handle reactor startup intermediate points for cal
 
 # Thresholds for reactor on and off for reactor startup, these are set for
 # detector 8, other thresholds would be needed for other detectors
+RATE_DET_NUM = 8
 NO_MIF_STARTUP_THRESH = [2000.0, 10000.0]
 NO_MIF_SHUTDOWN_THRESH = [4000.0, 14000.0]
 
-RX_ON_GAMMAS = [0.5110, 1.173228, 1.322492, 1.460820, 7.63758]
-RX_EARLY_OFF_GAMMAS = [1.173228, 1.322492, 1.460820, 2.614511, 2754.007]
-RX_OFF_GAMMAS = [1.173228, 1.322492, 1.460820, 2.614511]
+# the off and on thresholds of each detector whose rate can be used to find
+# the startup and shutdown, more can be added with set_rate_thresholds
+STARTUP_THRESHOLDS = {RATE_DET_NUM: NO_MIF_STARTUP_THRESH}
+SHUTDOWN_THRESHOLDS = {RATE_DET_NUM: NO_MIF_SHUTDOWN_THRESH}
+
+# the states of the runs in the rate segmentation
+RATE_OFF = 0
+RATE_TRANSITION = 1
+RATE_ON = 2
+
+# fraction of a threshold a rate has to cross it by to change state, and the
+# fewest runs a segment can have before it is merged into its neighbours,
+# the defaults reproduce plain thresholding
+RATE_HYSTERESIS = 0.0
+MIN_SEGMENT_RUNS = 1
+
+RX_ON_GAMMAS = [0.5110, 1.173228, 1.332492, 1.460820, 7.63758]
+RX_EARLY_OFF_GAMMAS = [1.173228, 1.332492, 1.460820, 2.614511, 2.754007]
+RX_OFF_GAMMAS = [1.173228, 1.332492, 1.460820, 2.614511]
 
-def find_sum_ranges(run_info, det_run_data, root_input):
+def find_sum_ranges(run_info, det_run_data, root_input, det_num=RATE_DET_NUM,
+                    hysteresis=RATE_HYSTERESIS, min_length=MIN_SEGMENT_RUNS):
     """This function takes the run information and detector run data and uses
     the shedule functions coupled with rates and user input to figure out what
     groupings need to be made to all summing of the data for calibration
@@ -31,6 +57,15 @@ def find_sum_ranges(run_info, det_run_data, root_input):
         list of dictionaries of non detector specific run data
     det_run_data : list of dicts
         list of dictionaries of detector specific run data
+    root_input : str
+        The path of the root input file
+    det_num : int
+        The detector whose rate is segmented, it needs thresholds in
+        STARTUP_THRESHOLDS and SHUTDOWN_THRESHOLDS
+    hysteresis : float
+        see segment_rates
+    min_length : int
+        see segment_rates
 
     Returns
     -------
@@ -48,15 +83,202 @@ def find_sum_ranges(run_info, det_run_data, root_input):
     if rx_stat == 0:
         return check_for_early_shutdown(run_info, root_input)
     elif rx_stat == 1:
-        return find_startup(run_info, det_run_data)
+        return find_startup(run_info, det_run_data, det_num, hysteresis,
+                            min_length)
     elif rx_stat == 2:
         return [(run_info[0]["RunNum"], run_info[-1]["RunNum"], RX_ON_GAMMAS,
                  0)]
     elif rx_stat == 3:
-        return find_shutdown(run_info, det_run_data, root_input)
+        return find_shutdown(run_info, det_run_data, root_input, det_num,
+                             hysteresis, min_length)
+
+
+def get_rates(det_run_data, det_num):
+    """Gets the rate of one detector in every run as an array
+
+    Parameters
+    ----------
+    det_run_data : list of dicts
+        list of dictionaries of detector specific run data
+    det_num : int
+        The detector number
+
+    Returns
+    -------
+    rates : numpy.ndarray
+        The average rate of the detector in each run
+    """
+    det_nums = [x[0]["DetNum"] for x in det_run_data]
+    if det_num not in det_nums:
+        raise ValueError("No run data for rate detector {0:d}".format(
+            det_num))
+    ind = det_nums.index(det_num)
+    return np.array([x["AvgRate"] for x in det_run_data[ind]],
+                    dtype=np.float64)
+
+
+def set_rate_thresholds(det_num, startup=None, shutdown=None):
+    """Sets the off and on thresholds of a detector, so its rate can be used
+    to find the startup and shutdown
 
+    Parameters
+    ----------
+    det_num : int
+        The detector number
+    startup : list of float
+        The off and on thresholds used around the startup, None to keep the
+        current ones
+    shutdown : list of float
+        The off and on thresholds used around the shutdown, None to keep the
+        current ones
+    """
+    if startup is not None:
+        STARTUP_THRESHOLDS[det_num] = list(startup)
+    if shutdown is not None:
+        SHUTDOWN_THRESHOLDS[det_num] = list(shutdown)
+
+
+def get_thresholds(thresholds, det_num):
+    """Gets the off and on thresholds of a detector
+
+    Parameters
+    ----------
+    thresholds : dict
+        STARTUP_THRESHOLDS or SHUTDOWN_THRESHOLDS
+    det_num : int
+        The detector number
+
+    Returns
+    -------
+    thresh : list of float
+        The off and on thresholds
+    """
+    if det_num not in thresholds:
+        raise ValueError("No rate thresholds for detector {0:d}".format(
+            det_num))
+    return thresholds[det_num]
+
+
+def classify_rates(rates, thresh, hysteresis=RATE_HYSTERESIS):
+    """Classifies each run as off, transition or on from its rate
+
+    Parameters
+    ----------
+    rates : numpy.ndarray
+        The rate of each run
+    thresh : list of float
+        The off and on thresholds, below the first is off, above the second
+        is on, anything else (including a rate that is not a number) is
+        transition
+    hysteresis : float
+        A run whose rate is within this fraction of a threshold keeps the
+        state of the run before it (the first run is classified plainly)
 
-def find_shutdown(run_info, det_run_data, root_input):
+    Returns
+    -------
+    states : numpy.ndarray
+        RATE_OFF, RATE_TRANSITION, or RATE_ON for each run
+    """
+    lo_thresh, hi_thresh = thresh
+    # the comparisons are all False for the rates that are not a number
+    with np.errstate(invalid="ignore"):
+        states = (rates >= lo_thresh).astype(np.int64) + (rates > hi_thresh)
+        near = ((np.abs(rates - lo_thresh) < hysteresis * lo_thresh) |
+                (np.abs(rates - hi_thresh) < hysteresis * hi_thresh))
+    states[np.isnan(rates)] = RATE_TRANSITION
+    if hysteresis <= 0.0 or len(states) == 0:
+        return states
+    near[0] = False
+    return fill_forward(states, ~near)
+
+
+def fill_forward(values, keep):
+    """Replaces the values not kept with the last kept value before them
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        The values
+    keep : numpy.ndarray
+        Boolean array, True for the values to keep, the first must be kept
+
+    Returns
+    -------
+    filled : numpy.ndarray
+        The values with the gaps filled
+    """
+    inds = np.where(keep, np.arange(len(values)), 0)
+    return values[np.maximum.accumulate(inds)]
+
+
+def run_length_encode(states):
+    """Finds the segments of consecutive runs with the same state
+
+    Parameters
+    ----------
+    states : numpy.ndarray
+        The state of each run
+
+    Returns
+    -------
+    seg_states : numpy.ndarray
+        The state of each segment
+    starts : numpy.ndarray
+        The index of the first run of each segment
+    stops : numpy.ndarray
+        The index one past the last run of each segment
+    """
+    changes = np.flatnonzero(states[1:] != states[:-1]) + 1
+    starts = np.concatenate(([0], changes)).astype(np.int64)
+    stops = np.concatenate((changes, [len(states)])).astype(np.int64)
+    if len(states) == 0:
+        starts = stops = np.zeros(0, dtype=np.int64)
+    return states[starts], starts, stops
+
+
+def segment_rates(rates, thresh, hysteresis=RATE_HYSTERESIS,
+                  min_length=MIN_SEGMENT_RUNS):
+    """Splits the runs into segments of off, transition and on runs
+
+    Parameters
+    ----------
+    rates : numpy.ndarray
+        The rate of each run
+    thresh : list of float
+        The off and on thresholds, see classify_rates
+    hysteresis : float
+        see classify_rates
+    min_length : int
+        Segments with fewer runs than this are merged into the segment
+        before them (the first segment into the one after it), unless no
+        segment is long enough
+
+    Returns
+    -------
+    seg_states : numpy.ndarray
+        The state of each segment, RATE_OFF, RATE_TRANSITION, or RATE_ON
+    starts : numpy.ndarray
+        The index of the first run of each segment
+    stops : numpy.ndarray
+        The index one past the last run of each segment
+    """
+    states = classify_rates(rates, thresh, hysteresis)
+    seg_states, starts, stops = run_length_encode(states)
+    long_segs = (stops - starts) >= min_length
+    if min_length > 1 and long_segs.any() and not long_segs.all():
+        keep = np.repeat(long_segs, stops - starts)
+        # the runs before the first long segment take its state
+        first = np.argmax(keep)
+        keep[:first] = False
+        states[:first] = states[first]
+        keep[0] = True
+        seg_states, starts, stops = run_length_encode(
+            fill_forward(states, keep))
+    return seg_states, starts, stops
+
+
+def find_shutdown(run_info, det_run_data, root_input, det_num=RATE_DET_NUM,
+                  hysteresis=RATE_HYSTERESIS, min_length=MIN_SEGMENT_RUNS):
     """This function takes data that may or may not span the reactor shutdown
     It then finds out if it does, and determines calibration sums for that data
 
@@ -66,6 +288,14 @@ def find_shutdown(run_info, det_run_data, root_input):
         list of dictionaries of non detector specific run data
     det_run_data : list of dicts
         list of dictionaries of detector specific run data
+    root_input : str
+        The path of the root input file
+    det_num : int
+        The detector whose rate is segmented
+    hysteresis : float
+        see segment_rates
+    min_length : int
+        see segment_rates
 
     Returns
     -------
@@ -76,27 +306,21 @@ def find_shutdown(run_info, det_run_data, root_input):
         1 - reactor off, early (so 24Na peak is visible)
         2 - reactor off, late (no 24Na peak)
     """
-    # first determine which index contains detector 8
-    ind = [x[0]["DetNum"] for x in det_run_data].index(8)
-    # use the thresholds for detector 8 to figure out what runs are running
+    # use the thresholds of the detector to figure out what runs are running
     # and what runs are not running and what runs are in between
-    status = []
-    for run in det_run_data[ind]:
-        if run["AvgRate"] < NO_MIF_SHUTDOWN_THRESH[0]:
-            status.append(0)
-        elif run["AvgRate"] > NO_MIF_SHUTDOWN_THRESH[1]:
-            status.append(2)
-        else:
-            status.append(1)
-    off_range = [i for i in range(len(status)) if status[i] == 0]
-    on_range = [run_info[i]["RunNum"] for i in range(len(status))
-                if status[i] == 2]
+    seg_states, starts, stops = segment_rates(
+        get_rates(det_run_data, det_num),
+        get_thresholds(SHUTDOWN_THRESHOLDS, det_num), hysteresis, min_length)
+    on_segs = np.flatnonzero(seg_states == RATE_ON)
+    off_segs = np.flatnonzero(seg_states == RATE_OFF)
     sum_list = []
-    if len(on_range) != 0:
-        sum_list.append((on_range[0], on_range[-1], RX_ON_GAMMAS, 0))
-    if len(off_range) != 0:
-        sum_list.extend(check_for_early_shutdown(run_info[off_range[0]:],
-                                                 root_input))
+    if len(on_segs) != 0:
+        sum_list.append((run_info[starts[on_segs[0]]]["RunNum"],
+                         run_info[stops[on_segs[-1]] - 1]["RunNum"],
+                         RX_ON_GAMMAS, 0))
+    if len(off_segs) != 0:
+        sum_list.extend(check_for_early_shutdown(
+            run_info[starts[off_segs[0]]:], root_input))
     return sum_list
 
 
@@ -142,8 +366,9 @@ def check_for_early_shutdown(run_info, root_input):
     return out_list
 
 
-def find_startup(run_info, det_run_data):
-    """This function takes data that may or may not span the reactor shutdown
+def find_startup(run_info, det_run_data, det_num=RATE_DET_NUM,
+                 hysteresis=RATE_HYSTERESIS, min_length=MIN_SEGMENT_RUNS):
+    """This function takes data that may or may not span the reactor startup
     It then finds out if it does, and determines calibration sums for that data
 
     Parameters
@@ -152,6 +377,12 @@ def find_startup(run_info, det_run_data):
         list of dictionaries of non detector specific run data
     det_run_data : list of dicts
         list of dictionaries of detector specific run data
+    det_num : int
+        The detector whose rate is segmented
+    hysteresis : float
+        see segment_rates
+    min_length : int
+        see segment_rates
 
     Returns
     -------
@@ -162,34 +393,21 @@ def find_startup(run_info, det_run_data):
         1 - reactor off, early (so 24Na peak is visible)
         2 - reactor off, late (no 24Na peak)
     """
-    # first determine which index contains detector 8
-    ind = [x[0]["DetNum"] for x in det_run_data].index(8)
-    # use the thresholds for detector 8 to figure out what runs are running
+    # use the thresholds of the detector to figure out what runs are running
     # and what runs are not running and what runs are in between
-    status = []
-    for run in det_run_data[ind]:
-        if run["AvgRate"] < NO_MIF_STARTUP_THRESH[0]:
-            status.append(0)
-        elif run["AvgRate"] > NO_MIF_STARTUP_THRESH[1]:
-            status.append(2)
-        else:
-            status.append(1)
-    not_on_range = [run_info[x]["RunNum"] for x in range(len(status))
-                    if status[x] in [0, 1]]
-    on_range = [run_info[x]["RunNum"] for x in range(len(status))
-                if status[x] == 2]
-    # now group the off range since it could be interrupted by a brief burst of
-    # intermediate strength reactor on
-    temp = itt.groupby(enumerate(not_on_range), lambda (i, x): status[i])
-    off_range = []
-    for tup in temp:
-        if tup[0] == 0:
-            arr = [x for x in tup[1]]
-            off_range.append(arr)
+    seg_states, starts, stops = segment_rates(
+        get_rates(det_run_data, det_num),
+        get_thresholds(STARTUP_THRESHOLDS, det_num), hysteresis, min_length)
+    # each stretch of off runs is summed separately since they can be
+    # interrupted by a brief burst of intermediate strength reactor on
     sum_list = []
-    if len(off_range) != 0:
-        for subr in off_range:
-            sum_list.append((subr[0][1], subr[-1][1], RX_OFF_GAMMAS, 2))
-    if len(on_range) != 0:
-        sum_list.append((on_range[0], on_range[-1], RX_ON_GAMMAS, 0))
+    for ind in np.flatnonzero(seg_states == RATE_OFF).tolist():
+        sum_list.append((run_info[starts[ind]]["RunNum"],
+                         run_info[stops[ind] - 1]["RunNum"], RX_OFF_GAMMAS,
+                         2))
+    on_segs = np.flatnonzero(seg_states == RATE_ON)
+    if len(on_segs) != 0:
+        sum_list.append((run_info[starts[on_segs[0]]]["RunNum"],
+                         run_info[stops[on_segs[-1]] - 1]["RunNum"],
+                         RX_ON_GAMMAS, 0))
     return sum_list
@@ -1,6 +1,245 @@
 """File with routines to ensure that the input obtained from users will convert
-correctly, satisfy the correct bounds, etc"""
+correctly, satisfy the correct bounds, etc
+
+Prompts that are given a decision name can be answered without asking the user
+by a decision policy, see set_policy, load_policy_file, and set_assume_defaults
+"""
 import sys
+import json
+import time
+
+# answers to give without prompting, keyed by decision name
+POLICY = {}
+
+# settings of the policy layer
+# AssumeDefaults - answer every prompt that has a default value with it
+# LogFile - path of the file every decision is appended to, None for no file
+POLICY_SETTINGS = {"AssumeDefaults": False, "LogFile": None}
+
+# names policies can use to answer yes/no and true/false prompts, matched
+# without regard to case
+BOOL_NAMES = {"yes": True, "no": False, "y": True, "n": False, "true": True,
+              "false": False, "t": True, "f": False, "1": True, "0": False}
+
+# the kinds of answer a prompt takes, and what they are called in errors
+ANSWER_KINDS = {"int": "an int", "float": "a float", "bool": "a boolean",
+                "str": "a string"}
+
+# the kind, bounds and choices of the prompts of the known decisions, so their
+# policies are checked when they are set, see register_decision
+DECISION_SPECS = {}
+
+# every decision made, as tuples of time, decision name, prompt, value, and
+# source (policy, default, or user)
+DECISION_LOG = []
+
+
+def register_decision(decision, kind, **kwargs):
+    """Describes the prompts of a decision, so that the policies answering
+    them can be converted and checked as soon as they are set
+
+    Parameters
+    ----------
+    decision : str
+        The decision name
+    kind : str
+        The kind of answer, one of ANSWER_KINDS
+    kwargs : dictionary
+        The choices and bounds of the prompts, as given to get_int
+    """
+    DECISION_SPECS[decision] = dict(kwargs, kind=kind)
+
+
+def set_policy(decision, answer):
+    """Sets the answer given to prompts with a given decision name, exits with
+    an error if the decision is registered and the answer does not fit it
+
+    Parameters
+    ----------
+    decision : str
+        The decision name, for instance "run_data_table"
+    answer : str, int, float, or bool
+        The answer, either a value, the name of one of the choices offered by
+        the prompt, "default" to use the prompt's default value, or "prompt"
+        to ask the user
+    """
+    if decision in DECISION_SPECS:
+        spec = DECISION_SPECS[decision]
+        answer = convert_answer(decision, answer, spec["kind"], spec)
+    POLICY[decision] = answer
+
+
+def convert_answer(decision, answer, kind, kwargs):
+    """Converts a policy answer to the kind of answer a prompt takes, exits
+    with an error naming the decision if it cannot be converted or is out of
+    bounds
+
+    Parameters
+    ----------
+    decision : str
+        The decision name, used in the error
+    answer : str, int, float, or bool
+        The answer, as given in set_policy
+    kind : str
+        The kind of answer, one of ANSWER_KINDS
+    kwargs : dictionary
+        The keyword arguments of the prompt function, the choices and bounds
+        are used
+
+    Returns
+    -------
+    value : object
+        The converted answer, or "default" or "prompt"
+    """
+    if isinstance(answer, basestring):
+        name = answer.strip().lower()
+        if name in ["default", "prompt"]:
+            return name
+        choices = dict((str(key).lower(), val) for key, val in
+                       (kwargs.get("choices") or {}).items())
+        if name in choices:
+            answer = choices[name]
+    try:
+        if kind == "int":
+            value = int(answer)
+            if value != float(answer):
+                raise ValueError("not an integer")
+        elif kind == "float":
+            value = float(answer)
+        elif kind == "bool":
+            value = BOOL_NAMES[str(answer).strip().lower()]
+        else:
+            value = answer
+    except (KeyError, TypeError, ValueError):
+        sys.exit("Error: the policy answer '{0:s}' of decision {1:s} cannot "
+                 "be converted to {2:s}".format(str(answer), str(decision),
+                                                ANSWER_KINDS[kind]))
+    if kind in ["int", "float"] and not test_bounds(value, kwargs):
+        sys.exit("Error: the policy answer '{0:s}' of decision {1:s} is out "
+                 "of bounds".format(str(answer), str(decision)))
+    return value
+
+
+def set_assume_defaults(assume_defaults):
+    """Sets whether prompts with a default value are answered with it
+
+    Parameters
+    ----------
+    assume_defaults : bool
+        True to never prompt when there is a default value
+    """
+    POLICY_SETTINGS["AssumeDefaults"] = assume_defaults
+
+
+def set_decision_log(fname):
+    """Sets the file that every decision is appended to
+
+    Parameters
+    ----------
+    fname : str
+        The path of the log file, None to stop writing decisions to a file
+    """
+    POLICY_SETTINGS["LogFile"] = fname
+
+
+def load_policy_file(fname):
+    """Loads decision policies from a json file of the form
+    {"assume_defaults": false, "decision_log": "decisions.log",
+     "decisions": {"run_data_table": "skip", "sodium_peak": "prompt"}}
+    every key is optional
+
+    Parameters
+    ----------
+    fname : str
+        The path of the json policy file
+    """
+    infile = open(fname)
+    policy = json.load(infile)
+    infile.close()
+    for decision, answer in policy.get("decisions", {}).items():
+        set_policy(decision, answer)
+    if "assume_defaults" in policy:
+        set_assume_defaults(policy["assume_defaults"])
+    if "decision_log" in policy:
+        set_decision_log(policy["decision_log"])
+
+
+def policy_answer(prompt, kwargs, kind="str"):
+    """Looks for an answer to a prompt in the decision policies
+
+    Parameters
+    ----------
+    prompt : str
+        The prompt that would be given to the user
+    kwargs : dictionary
+        The keyword arguments of the prompt function, the relevant ones are
+        decision (a decision name or a list of them, most specific first),
+        choices (dictionary mapping answer names to values), the bounds, and
+        default_value
+    kind : str
+        The kind of answer the prompt takes, one of ANSWER_KINDS, the answer
+        is converted to it, see convert_answer
+
+    Returns
+    -------
+    found : bool
+        True if the policies answer the prompt
+    value : object
+        The answer, None if found is False
+    """
+    decisions = kwargs.get("decision")
+    if decisions is None:
+        decisions = []
+    elif not isinstance(decisions, list):
+        decisions = [decisions]
+    answer = None
+    for decision in decisions:
+        if decision in POLICY:
+            answer = convert_answer(decision, POLICY[decision], kind, kwargs)
+            break
+    if answer is None and POLICY_SETTINGS["AssumeDefaults"]:
+        answer = "default"
+    if answer is None or answer == "prompt":
+        return False, None
+    if answer == "default":
+        if kwargs.get("default_value") is None:
+            # nothing to fall back on, the user has to answer
+            return False, None
+        value = kwargs["default_value"]
+    else:
+        value = answer
+    print "{0:s}?> {1:s} (from policy)".format(prompt, str(value))
+    record_decision(decisions[0] if decisions else None, prompt, value,
+                    "policy")
+    return True, value
+
+
+def record_decision(decision, prompt, value, source):
+    """Records a decision in DECISION_LOG and the decision log file
+
+    Parameters
+    ----------
+    decision : str
+        The decision name, None if the prompt had none
+    prompt : str
+        The prompt
+    value : object
+        The answer
+    source : str
+        Where the answer came from, policy, default, or user
+
+    Returns
+    -------
+    value : object
+        The answer, so this can be wrapped around return values
+    """
+    entry = (time.time(), decision, prompt, value, source)
+    DECISION_LOG.append(entry)
+    if POLICY_SETTINGS["LogFile"] is not None:
+        outfile = open(POLICY_SETTINGS["LogFile"], "a")
+        outfile.write("\t".join(str(x) for x in entry) + "\n")
+        outfile.close()
+    return value
 
 
 def test_bounds(value, kwargs):
@@ -67,6 +306,10 @@ def get_float(prompt, **kwargs):
     default_value : float
         The value that will be returned if the user simply presses enter
         If this is not set then the user pressing enter will be ignored
+    decision : str or list of str
+        The decision name(s) used to look for an answer in the policies
+    choices : dict
+        Mapping of policy answer names to values
 
     Returns
     -------
@@ -79,6 +322,9 @@ def get_float(prompt, **kwargs):
     if "inclusive_upper_bound" in kwargs and "exclusive_upper_bound" in kwargs:
         raise ValueError("Cannot set inclusive *and* exclusive upper bounds"
                          " simultaneously")
+    found, value = policy_answer(prompt, kwargs, "float")
+    if found:
+        return value
     successful_input = False
     while not successful_input:
         # first get whatever the user types
@@ -97,7 +343,8 @@ def get_float(prompt, **kwargs):
         value = None
         if len(in_str) == 0:
             if "default_value" in kwargs:
-                return kwargs["default_value"]
+                return record_decision(kwargs.get("decision"), prompt,
+                                       kwargs["default_value"], "default")
             else:
                 print "There is no default value, you must enter a value"
                 continue
@@ -109,7 +356,8 @@ def get_float(prompt, **kwargs):
         # now test the bounds
         if test_bounds(value, kwargs):
             successful_input = True
-            return value
+            return record_decision(kwargs.get("decision"), prompt, value,
+                                   "user")
 
 
 def get_int(prompt, **kwargs):
@@ -134,6 +382,10 @@ def get_int(prompt, **kwargs):
     default_value : int
         The value that will be returned if the user simply presses enter
         If this is not set then the user pressing enter will be ignored
+    decision : str or list of str
+        The decision name(s) used to look for an answer in the policies
+    choices : dict
+        Mapping of policy answer names to values
 
     Returns
     -------
@@ -146,6 +398,9 @@ def get_int(prompt, **kwargs):
     if "inclusive_upper_bound" in kwargs and "exclusive_upper_bound" in kwargs:
         raise ValueError("Cannot set inclusive *and* exclusive upper bounds"
                          " simultaneously")
+    found, value = policy_answer(prompt, kwargs, "int")
+    if found:
+        return value
     successful_input = False
     while not successful_input:
         # first get whatever the user types
@@ -164,7 +419,8 @@ def get_int(prompt, **kwargs):
         value = None
         if len(in_str) == 0:
             if "default_value" in kwargs:
-                return kwargs["default_value"]
+                return record_decision(kwargs.get("decision"), prompt,
+                                       kwargs["default_value"], "default")
             else:
                 print "There is no default value, you must enter a value"
                 continue
@@ -176,9 +432,10 @@ def get_int(prompt, **kwargs):
         # now test the bounds
         if test_bounds(value, kwargs):
             successful_input = True
-            return value
+            return record_decision(kwargs.get("decision"), prompt, value,
+                                   "user")
 
-def get_bool(prompt, default_value=None):
+def get_bool(prompt, default_value=None, decision=None):
     """Function to get a boolean from the command line
 
     Parameters
@@ -188,12 +445,19 @@ def get_bool(prompt, default_value=None):
     default_value : bool
         The value that will be returned if the user simply presses enter
         If this is not set then the user pressing enter will be ignored
+    decision : str or list of str
+        The decision name(s) used to look for an answer in the policies
 
     Returns
     -------
     value : bool
         The value obtained and converted from the command line
     """
+    found, value = policy_answer(prompt, {"decision": decision,
+                                          "default_value": default_value},
+                                 "bool")
+    if found:
+        return value
     successful_input = False
     while not successful_input:
         # first get whatever the user types
@@ -212,7 +476,8 @@ def get_bool(prompt, default_value=None):
         value = None
         if len(in_str) == 0:
             if default_value is not None:
-                return default_value
+                return record_decision(decision, prompt, default_value,
+                                       "default")
             else:
                 print "There is no default value, you must enter a value"
                 continue
@@ -224,10 +489,10 @@ def get_bool(prompt, default_value=None):
             print in_str, "cannot be converted to a boolean, try 'f' or 't'"
             continue
         successful_input = True
-        return value
+        return record_decision(decision, prompt, value, "user")
 
 
-def get_yes_no(prompt, default_value=None):
+def get_yes_no(prompt, default_value=None, decision=None):
     """Function to get a boolean from the command line
 
     Parameters
@@ -237,12 +502,19 @@ def get_yes_no(prompt, default_value=None):
     default_value : bool
         The value that will be returned if the user simply presses enter
         If this is not set then the user pressing enter will be ignored
+    decision : str or list of str
+        The decision name(s) used to look for an answer in the policies
 
     Returns
     -------
     value : bool
         true if yes, false if no
     """
+    found, value = policy_answer(prompt, {"decision": decision,
+                                          "default_value": default_value},
+                                 "bool")
+    if found:
+        return value
     successful_input = False
     while not successful_input:
         # first get whatever the user types
@@ -261,7 +533,8 @@ def get_yes_no(prompt, default_value=None):
         value = None
         if len(in_str) == 0:
             if default_value is not None:
-                return default_value
+                return record_decision(decision, prompt, default_value,
+                                       "default")
             else:
                 print "There is no default value, you must enter a value"
                 continue
@@ -273,10 +546,10 @@ def get_yes_no(prompt, default_value=None):
             print in_str, "cannot be converted to a yes or no, try 'y' or 'n'"
             continue
         successful_input = True
-        return value
+        return record_decision(decision, prompt, value, "user")
 
 
-def get_str(prompt, default_value=None):
+def get_str(prompt, default_value=None, decision=None):
     """Function to get a boolean from the command line
 
     Parameters
@@ -286,12 +559,18 @@ def get_str(prompt, default_value=None):
     default_value : bool
         The value that will be returned if the user simply presses enter
         If this is not set then the user pressing enter will be ignored
+    decision : str or list of str
+        The decision name(s) used to look for an answer in the policies
 
     Returns
     -------
     value : bool
         true if yes, false if no
     """
+    found, value = policy_answer(prompt, {"decision": decision,
+                                          "default_value": default_value})
+    if found:
+        return value
     successful_input = False
     while not successful_input:
         # first get whatever the user types
@@ -309,10 +588,11 @@ def get_str(prompt, default_value=None):
         value = None
         if len(in_str) == 0:
             if default_value is not None:
-                return default_value
+                return record_decision(decision, prompt, default_value,
+                                       "default")
             else:
                 print "There is no default value, you must enter a value"
                 continue
         value = in_str
         successful_input = True
-        return value
+        return record_decision(decision, prompt, value, "user")
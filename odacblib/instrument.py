@@ -0,0 +1,221 @@
+"""Lightweight instrumentation of the build stages, wall and cpu time, row and
+byte counters, and the peak resident set size of every stage, collected into
+a report that is written as json next to the batch
+
+Stages nest, a stage opened inside another is named after both (RunDb/
+make_batch_database), and counters are added to every stage that is open so
+the outer stages hold the totals of their inner ones
+
+The peak resident set size is the high water mark of the process (and of its
+finished child processes) when the stage ended, so it only grows over the
+course of a batch, a stage that raised it is the one that needed the memory"""
+import os
+import time
+import json
+import resource
+import cProfile
+import functools
+import contextlib
+
+REPORT_NAME = "build_report.json"
+
+PROFILE_FMT = "profile_{0:s}.prof"
+
+# the report being collected and the stages currently open, per process
+REPORT = {"Batch": None, "Stages": []}
+OPEN_STAGES = []
+
+
+def start_report(batch_name):
+    """Starts a fresh report, dropping whatever was collected before
+
+    Parameters
+    ----------
+    batch_name : str
+        The name of the batch the report is for
+    """
+    REPORT["Batch"] = batch_name
+    REPORT["Started"] = time.time()
+    REPORT["Stages"] = []
+    del OPEN_STAGES[:]
+
+
+def get_peak_rss_kb():
+    """Gets the peak resident set size of this process and its children
+
+    Returns
+    -------
+    self_kb : int
+        The peak resident set size of this process in kB
+    child_kb : int
+        The largest peak resident set size of the finished child processes
+        in kB
+    """
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+
+@contextlib.contextmanager
+def stage(name, profile_path=None):
+    """Context manager that times a stage and records it in the report
+
+    Parameters
+    ----------
+    name : str
+        The name of the stage
+    profile_path : str
+        If given the stage is run under cProfile and the statistics are
+        written to this path
+
+    Yields
+    ------
+    record : dict
+        The record of the stage, filled in when the stage ends
+    """
+    if OPEN_STAGES:
+        name = OPEN_STAGES[-1]["Name"] + "/" + name
+    record = {"Name": name, "Counters": {}}
+    OPEN_STAGES.append(record)
+    profiler = None
+    if profile_path is not None:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    times = os.times()
+    start = time.time()
+    try:
+        yield record
+    finally:
+        end_times = os.times()
+        record["WallSeconds"] = time.time() - start
+        record["CpuSeconds"] = (end_times[0] + end_times[1] - times[0] -
+                                times[1])
+        record["ChildCpuSeconds"] = (end_times[2] + end_times[3] -
+                                     times[2] - times[3])
+        record["PeakRssKb"], record["ChildPeakRssKb"] = get_peak_rss_kb()
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile_path)
+            record["Profile"] = profile_path
+        OPEN_STAGES.pop()
+        REPORT["Stages"].append(record)
+
+
+def timed(func):
+    """Decorator that runs a function as a stage named after it
+
+    Parameters
+    ----------
+    func : function
+        The function to time
+
+    Returns
+    -------
+    wrapper : function
+        The timed function
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with stage(func.__name__):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def timed_iter(iterable, name, profile_path=None):
+    """Iterates, running each step as a stage, for work that is pulled from a
+    generator inside another stage (a stage named Parse opened inside RunDb
+    is recorded as RunDb/Parse)
+
+    Parameters
+    ----------
+    iterable : iterable
+        The items to iterate over
+    name : str
+        The name of the stage of each step
+    profile_path : str
+        If given every step is run under one cProfile, whose statistics are
+        written to this path once the items are exhausted
+
+    Yields
+    ------
+    item : object
+        The items of iterable
+    """
+    profiler = None
+    if profile_path is not None:
+        profiler = cProfile.Profile()
+    items = iter(iterable)
+    end = object()
+    while True:
+        with stage(name):
+            if profiler is not None:
+                profiler.enable()
+            try:
+                item = next(items, end)
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+        if item is end:
+            break
+        yield item
+    if profiler is not None:
+        profiler.dump_stats(profile_path)
+
+
+def count(name, value):
+    """Adds to a counter of every open stage, does nothing outside a stage
+
+    Parameters
+    ----------
+    name : str
+        The name of the counter, e.g. RunRows or CsvBytes
+    value : int or float
+        The amount to add
+    """
+    for record in OPEN_STAGES:
+        record["Counters"][name] = record["Counters"].get(name, 0) + value
+
+
+def stage_times(stage_names):
+    """Gets the wall times of the stages of the report
+
+    Parameters
+    ----------
+    stage_names : list of str
+        The names of the stages wanted
+
+    Returns
+    -------
+    timings : dict
+        The time in seconds spent in each stage that was run, stages run more
+        than once are summed, the time of a stage run inside another is moved
+        from the enclosing stage to its own (RunDb/Parse counts as Parse, not
+        RunDb), so the times of different stages never overlap
+    """
+    timings = {}
+    for record in REPORT["Stages"]:
+        names = record["Name"].split("/")
+        if names[-1] not in stage_names:
+            continue
+        seconds = record["WallSeconds"]
+        timings[names[-1]] = timings.get(names[-1], 0.0) + seconds
+        enclosing = [x for x in names[:-1] if x in stage_names]
+        if enclosing:
+            timings[enclosing[-1]] = (timings.get(enclosing[-1], 0.0) -
+                                      seconds)
+    return timings
+
+
+def write_report(fname):
+    """Writes the report as json
+
+    Parameters
+    ----------
+    fname : str
+        The path of the report file
+    """
+    report = dict(REPORT)
+    report["WallSeconds"] = time.time() - report.pop("Started", time.time())
+    report["PeakRssKb"], report["ChildPeakRssKb"] = get_peak_rss_kb()
+    outfile = open(fname, "w")
+    json.dump(report, outfile, indent=1, sort_keys=True)
+    outfile.close()
@@ -0,0 +1,52 @@
+"""Deferred imports of the heavy modules, rootops initializes PyROOT (and
+calfit loads scipy) which takes seconds, so the jobs that only touch the
+databases or the schedule should never import them
+
+lazy_module returns a stand in for a module that imports the module the first
+time one of its attributes is used, and forwards every attribute to it"""
+import sys
+import types
+import importlib
+
+
+class LazyModule(types.ModuleType):
+    """Stand in for a module that is imported on first use, see lazy_module"""
+
+    def __getattr__(self, attr):
+        # only called for the attributes the stand in does not have itself
+        return getattr(load_module(self), attr)
+
+
+def lazy_module(name):
+    """Gets a module without importing it until it is used
+
+    Parameters
+    ----------
+    name : str
+        The full name of the module, e.g. odacblib.rootops
+
+    Returns
+    -------
+    module : module or LazyModule
+        The module if it was already imported, otherwise a stand in for it
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    return LazyModule(name)
+
+
+def load_module(module):
+    """Imports the module behind a stand in, if it is not imported yet
+
+    Parameters
+    ----------
+    module : module or LazyModule
+        The module or its stand in
+
+    Returns
+    -------
+    module : module
+        The imported module
+    """
+    return importlib.import_module(module.__name__)
+
@@ -0,0 +1,242 @@
+"""Functions for the build manifest of a batch, a json sidecar file next to the
+run database recording what each build stage was built from so that stages
+whose inputs have not changed can be skipped on the next build
+
+Files are fingerprinted by size, modification time, and a hash of their
+contents, the hash is only recomputed when the size or modification time
+differ from those recorded"""
+import os
+import json
+import hashlib
+
+MANIFEST_NAME = "build_manifest.json"
+
+# size of the blocks files are hashed in
+HASH_CHUNK = 1 << 20
+
+MANIFEST_VERSION = 1
+
+
+def load_manifest(fname):
+    """Reads a build manifest, an unreadable or missing manifest is empty
+
+    Parameters
+    ----------
+    fname : str
+        The path of the manifest file
+
+    Returns
+    -------
+    manifest : dict
+        Version, Files (the fingerprint of each file seen, keyed by path), and
+        Stages (the record of each stage built, keyed by stage name)
+    """
+    empty = {"Version": MANIFEST_VERSION, "Files": {}, "Stages": {}}
+    if not os.path.exists(fname):
+        return empty
+    try:
+        infile = open(fname)
+        manifest = json.load(infile)
+        infile.close()
+    except (IOError, ValueError):
+        print "Warning: could not read build manifest {0:s}".format(fname)
+        return empty
+    if manifest.get("Version") != MANIFEST_VERSION:
+        return empty
+    return manifest
+
+
+def save_manifest(manifest, fname):
+    """Writes a build manifest, replacing the old one in a single step
+
+    Parameters
+    ----------
+    manifest : dict
+        The manifest, see load_manifest
+    fname : str
+        The path of the manifest file
+    """
+    temp_name = fname + ".tmp"
+    outfile = open(temp_name, "w")
+    json.dump(manifest, outfile, indent=1, sort_keys=True)
+    outfile.close()
+    os.rename(temp_name, fname)
+
+
+def file_hash(fname):
+    """Hashes the contents of a file
+
+    Parameters
+    ----------
+    fname : str
+        The path of the file
+
+    Returns
+    -------
+    digest : str
+        The hex sha1 digest of the file contents
+    """
+    digest = hashlib.sha1()
+    infile = open(fname, "rb")
+    block = infile.read(HASH_CHUNK)
+    while block:
+        digest.update(block)
+        block = infile.read(HASH_CHUNK)
+    infile.close()
+    return digest.hexdigest()
+
+
+def fingerprint(manifest, fname):
+    """Gets the content hash of a file, reusing the hash in the manifest if
+    the size and modification time are unchanged
+
+    Parameters
+    ----------
+    manifest : dict
+        The manifest, the fingerprint of the file is updated in it
+    fname : str
+        The path of the file
+
+    Returns
+    -------
+    digest : str
+        The hash of the file, None if it does not exist
+    """
+    fname = os.path.abspath(fname)
+    if not os.path.exists(fname):
+        manifest["Files"].pop(fname, None)
+        return None
+    stat = os.stat(fname)
+    known = manifest["Files"].get(fname)
+    if (known is not None and known["Size"] == stat.st_size and
+            known["MTime"] == stat.st_mtime):
+        return known["Hash"]
+    digest = file_hash(fname)
+    manifest["Files"][fname] = {"Size": stat.st_size, "MTime": stat.st_mtime,
+                                "Hash": digest}
+    return digest
+
+
+def stage_key(manifest, input_files, settings):
+    """Makes the key of a stage from everything it is built from
+
+    Parameters
+    ----------
+    manifest : dict
+        The manifest, used to fingerprint the input files
+    input_files : list of str
+        The paths of the files the stage reads
+    settings : list
+        Anything else the stage depends on (options, upstream keys), it must
+        be json serializable
+
+    Returns
+    -------
+    key : str
+        The hash of the input file hashes and the settings
+    """
+    parts = [fingerprint(manifest, x) for x in input_files] + list(settings)
+    return hashlib.sha1(json.dumps(parts, sort_keys=True)).hexdigest()
+
+
+def stage_is_current(manifest, stage, key):
+    """Checks if a stage was last built with the same key and its outputs
+    are untouched since
+
+    Parameters
+    ----------
+    manifest : dict
+        The manifest
+    stage : str
+        The name of the stage
+    key : str
+        The key of the stage, see stage_key
+
+    Returns
+    -------
+    current : bool
+        True if the stage can be skipped
+    """
+    record = manifest["Stages"].get(stage)
+    if record is None or record["Key"] != key:
+        return False
+    for fname, digest in record["Outputs"].items():
+        if fingerprint(manifest, fname) != digest:
+            return False
+    return True
+
+
+def record_stage(manifest, stage, key, output_files, result=None):
+    """Records that a stage was built
+
+    Parameters
+    ----------
+    manifest : dict
+        The manifest
+    stage : str
+        The name of the stage
+    key : str
+        The key of the stage, see stage_key
+    output_files : list of str
+        The paths of the files the stage wrote
+    result : object
+        A json serializable value the stage produced, returned by
+        get_stage_result when the stage is skipped
+    """
+    outputs = {}
+    for fname in output_files:
+        outputs[os.path.abspath(fname)] = fingerprint(manifest, fname)
+    manifest["Stages"][stage] = {"Key": key, "Outputs": outputs,
+                                 "Result": result}
+
+
+def refresh_outputs(manifest, stage):
+    """Records the current fingerprints of the outputs of a stage, for when
+    a later stage legitimately modifies them
+
+    Parameters
+    ----------
+    manifest : dict
+        The manifest
+    stage : str
+        The name of the stage
+    """
+    record = manifest["Stages"].get(stage)
+    if record is None:
+        return
+    for fname in record["Outputs"]:
+        record["Outputs"][fname] = fingerprint(manifest, fname)
+
+
+def get_stage_result(manifest, stage):
+    """Gets the result recorded for a stage
+
+    Parameters
+    ----------
+    manifest : dict
+        The manifest
+    stage : str
+        The name of the stage
+
+    Returns
+    -------
+    result : object
+        The result passed to record_stage, None if the stage is not recorded
+    """
+    record = manifest["Stages"].get(stage)
+    if record is None:
+        return None
+    return record["Result"]
+
+
+def invalidate_stage(manifest, stage):
+    """Forgets a stage, so it is rebuilt next time
+
+    Parameters
+    ----------
+    manifest : dict
+        The manifest
+    stage : str
+        The name of the stage
+    """
+    manifest["Stages"].pop(stage, None)
@@ -0,0 +1,205 @@
+"""Functions to decide, without ROOT or user input, which runs in a stretch of
+early reactor off spectra still contain the 24Na peak
+
+The spectra are not energy calibrated at this point, so the 24Na peak is
+located as the highest lying peak that decays away over the stretch, it is
+then integrated against its sidebands in every run at once, and the run where
+the peak disappears is found with a change point search"""
+import numpy as np
+
+# significance above which a run is considered to contain the 24Na peak
+PEAK_SIG_THRESH = 5.0
+
+# minimum significance of the decaying component used to locate the peak
+LOCATE_SIG_THRESH = 5.0
+
+# number of runs averaged at each end of the stretch to locate the peak
+LOCATE_RUNS = 3
+
+# width, in bins, of the smoothing applied when locating the peak
+SMOOTH_BINS = 5
+
+# minimum Welch t statistic between the two sides of the change point needed
+# for the automatic classification to be trusted
+MIN_CONFIDENCE = 4.0
+
+# maximum fraction of runs whose significance disagrees with the side of the
+# change point they are put on for the classification to be trusted
+MAX_MISMATCH_FRAC = 0.1
+
+
+def smooth(values, width=SMOOTH_BINS):
+    """Box car smoothing of the last axis of an array
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        The array to smooth
+    width : int
+        The width of the box car in bins
+
+    Returns
+    -------
+    smoothed : numpy.ndarray
+        The smoothed array, the same shape as values
+    """
+    kernel = np.ones(width) / float(width)
+    return np.apply_along_axis(np.convolve, -1, values, kernel, mode="same")
+
+
+def locate_decaying_peak(spectra):
+    """Finds the bin window of the highest lying peak that decays away over
+    the stretch of spectra, which for the early reactor off spectra is 24Na
+
+    Parameters
+    ----------
+    spectra : numpy.ndarray
+        Array of shape (number of runs, number of bins) of bin contents
+
+    Returns
+    -------
+    window : tuple of int
+        The first and one past the last bin of the peak, None if no decaying
+        peak was found
+    """
+    num_ends = min(LOCATE_RUNS, len(spectra) // 2)
+    if num_ends == 0:
+        return None
+    early = smooth(spectra[:num_ends].mean(axis=0))
+    late = smooth(spectra[-num_ends:].mean(axis=0))
+    diff = early - late
+    sigma = np.sqrt((early + late) / (num_ends * SMOOTH_BINS) + 1.0)
+    signif = diff / sigma
+    # local maxima of the decaying component that are significant
+    cands = np.nonzero((signif[1:-1] > LOCATE_SIG_THRESH) &
+                       (diff[1:-1] >= diff[:-2]) &
+                       (diff[1:-1] > diff[2:]))[0] + 1
+    if len(cands) == 0:
+        return None
+    center = cands[-1]
+    # walk out to the half maximum on either side
+    half = diff[center] / 2.0
+    below = np.nonzero(diff[:center] < half)[0]
+    lo_half = below[-1] + 1 if len(below) != 0 else 0
+    above = np.nonzero(diff[center:] < half)[0]
+    hi_half = center + above[0] if len(above) != 0 else len(diff)
+    half_width = max(hi_half - lo_half, 2)
+    return (max(center - half_width, 0),
+            min(center + half_width + 1, spectra.shape[1]))
+
+
+def peak_significance(spectra, window, reference=None):
+    """Integrates the peak window of every spectrum against the sidebands on
+    either side of it
+
+    Parameters
+    ----------
+    spectra : numpy.ndarray
+        Array of shape (number of runs, number of bins) of bin contents
+    window : tuple of int
+        The first and one past the last bin of the peak
+    reference : numpy.ndarray
+        A spectrum without the peak, its shape, scaled to the sidebands of
+        each run, is used as the background under the peak, this copes with
+        the neighbouring 2614 keV line, defaults to the mean of the last
+        LOCATE_RUNS spectra
+
+    Returns
+    -------
+    signif : numpy.ndarray
+        The significance of the net peak area in each run
+    """
+    if reference is None:
+        reference = spectra[-min(LOCATE_RUNS, len(spectra)):].mean(axis=0)
+    lo_bin, hi_bin = window
+    side = max(hi_bin - lo_bin, 1)
+    side_bins = np.zeros(spectra.shape[1], dtype=bool)
+    side_bins[max(lo_bin - side, 0):lo_bin] = True
+    side_bins[hi_bin:hi_bin + side] = True
+    peak = spectra[:, lo_bin:hi_bin].sum(axis=1)
+    sides = spectra[:, side_bins].sum(axis=1)
+    ref_peak = reference[lo_bin:hi_bin].sum()
+    ref_sides = reference[side_bins].sum()
+    if ref_sides <= 0.0:
+        return peak / np.sqrt(np.maximum(peak, 1.0))
+    bkg = sides * (ref_peak / ref_sides)
+    var = peak + bkg * bkg / np.maximum(sides, 1.0)
+    return (peak - bkg) / np.sqrt(np.maximum(var, 1.0))
+
+
+def find_changepoint(present):
+    """Finds the index that best splits a run of flags into a leading segment
+    where the peak is present and a trailing segment where it is not
+
+    Parameters
+    ----------
+    present : numpy.ndarray
+        Boolean array, True for each run that appears to contain the peak
+
+    Returns
+    -------
+    split : int
+        The index of the first run of the trailing segment
+    mismatched : int
+        The number of runs that disagree with the segment they are put in
+    """
+    present = np.asarray(present, dtype=np.int64)
+    # number of runs that disagree with each possible split, evaluated for
+    # every split at once from the cumulative sums
+    absent_before = np.arange(len(present) + 1) - np.concatenate(
+        ([0], np.cumsum(present)))
+    present_after = present.sum() - (np.arange(len(present) + 1) -
+                                     absent_before)
+    mismatches = absent_before + present_after
+    split = int(np.argmin(mismatches))
+    return split, int(mismatches[split])
+
+
+def classify_sodium_runs(run_nums, spectra, window=None):
+    """Decides which runs in a stretch contain the 24Na peak
+
+    Parameters
+    ----------
+    run_nums : list of int
+        The run number of each spectrum
+    spectra : numpy.ndarray
+        Array of shape (number of runs, number of bins) of bin contents
+    window : tuple of int
+        The first and one past the last bin of the 24Na peak, located
+        automatically if None
+
+    Returns
+    -------
+    runs_list : list of tuples
+        Each tuple contains a start run and stop run and either a 1 or a 0
+        0 indicates there is no 24Na peak in these runs, 1 indicates there is
+    confidence : float
+        The Welch t statistic between the significances of the runs with and
+        without the peak (or between a single block and the threshold)
+    confident : bool
+        True if the classification can be used without asking the user
+    """
+    spectra = np.asarray(spectra, dtype=np.float64)
+    run_nums = list(run_nums)
+    if window is None:
+        window = locate_decaying_peak(spectra)
+    if window is None:
+        return [(run_nums[0], run_nums[-1], 0)], 0.0, False
+    signif = peak_significance(spectra, window)
+    split, mismatched = find_changepoint(signif > PEAK_SIG_THRESH)
+    mismatch_ok = mismatched <= MAX_MISMATCH_FRAC * len(signif)
+    if split == 0 or split == len(signif):
+        # no transition, how far is the stretch from the threshold
+        err = signif.std() / np.sqrt(len(signif))
+        confidence = abs(signif.mean() - PEAK_SIG_THRESH) / max(err, 1.0)
+        flag = 1 if split != 0 else 0
+        return ([(run_nums[0], run_nums[-1], flag)], confidence,
+                mismatch_ok and confidence >= MIN_CONFIDENCE)
+    with_peak = signif[:split]
+    without_peak = signif[split:]
+    err = np.sqrt(with_peak.var() / len(with_peak) +
+                  without_peak.var() / len(without_peak))
+    confidence = (with_peak.mean() - without_peak.mean()) / max(err, 1.0)
+    runs_list = [(run_nums[0], run_nums[split - 1], 1),
+                 (run_nums[split], run_nums[-1], 0)]
+    return runs_list, confidence, mismatch_ok and confidence >= MIN_CONFIDENCE
@@ -1,8 +1,9 @@
 """Contains the functions that read the raw csv files in the batch data"""
 
 import os
-import datetime as dt
+import numpy as np
 import odacblib.schedule as sch
+import odacblib.timestamps as ts
 
 PATH_STR1 = "/data1/prospect/ProcessedData/OrchidAnalysis/TimeSeries_2017"
 PATH_STR2 = "/home/itm/test_reader/short_runs"
@@ -55,25 +56,21 @@ def read_batch_data(fname):
     if batch_data["TreeGenerated"]:
         batch_data["TreeFileLocation"] = data[9]
     batch_data["StartEpochMicroSec"] = int(data[10])
-    batch_data["StartDateTime"] = dt.datetime.strptime(data[11],
-                                                       "%Y-%b-%d %H:%M:%S.%f")
+    batch_data["StartDateTime"] = ts.parse_orchid_time(data[11])
     batch_data["StopEpochMicroSec"] = int(data[12])
-    batch_data["StopDateTime"] = dt.datetime.strptime(data[13],
-                                                      "%Y-%b-%d %H:%M:%S.%f")
+    batch_data["StopDateTime"] = ts.parse_orchid_time(data[13])
     batch_data["RunCount"] = int(data[14])
     # ensure that the batch name contains the year in it
     test_year = "{0:d}".format(batch_data["StartDateTime"].year)
     if not test_year in batch_data["BatchName"][-4:]:
         batch_data["BatchName"] += "_{0:s}".format(test_year)
     # add the derived keys to the dictionary
-    cycle_nums = sch.get_reactor_cycles(batch_data["StartDateTime"],
-                                        batch_data["StopDateTime"])
-    batch_data["StartCycleNum"] = cycle_nums[0]
-    batch_data["StopCycleNum"] = cycle_nums[1]
-    batch_data["StatusNum"] = sch.get_reactor_status(
-        batch_data["StartDateTime"], batch_data["StopDateTime"])
-    batch_data["StatusName"] = sch.get_reactor_status_name(
-        batch_data["StartDateTime"], batch_data["StopDateTime"])
+    state = sch.get_reactor_state(batch_data["StartDateTime"],
+                                  batch_data["StopDateTime"])
+    batch_data["StatusNum"] = state[0]
+    batch_data["StartCycleNum"] = state[1]
+    batch_data["StopCycleNum"] = state[2]
+    batch_data["StatusName"] = sch.CYCLE_STATUS_NAMES[state[0]]
     # add the keys to the dictionary containing the info that is added later
     batch_data["IsCalibrated"] = False
     batch_data["IsDecomposed"] = False
@@ -83,6 +80,43 @@ def read_batch_data(fname):
     return batch_data
 
 
+# column layout of the run csv, the first RUN_FIXED_COLUMNS columns hold the
+# general run information, then there are DET_RUN_COLUMNS columns for each
+# detector, in the same order as the detector data file
+RUN_FIXED_COLUMNS = 8
+DET_RUN_COLUMNS = 5
+
+RUN_INT_FIELDS = [("RunNum", 0), ("StartEpochMicroSec", 1),
+                  ("StopEpochMicroSec", 3), ("CenterEpochMicroSec", 5),
+                  ("RunTimeMicroSec", 7)]
+
+RUN_TIME_FIELDS = [("StartDateTime", 2, "StartEpochMicroSec"),
+                   ("StopDateTime", 4, "StopEpochMicroSec"),
+                   ("CenterDateTime", 6, "CenterEpochMicroSec")]
+
+# the per detector run values that are only filled in by later calibration and
+# decomposition steps
+DET_RUN_DEFAULTS = {"EnCalOffset": 0.0, "EnCalSlope": 0.0, "EnCalCurve": 0.0,
+                    "WidthSqOffset": 0.0, "WidthSqSlope": 0.0,
+                    "WidthSqCurve": 0.0, "IsCalibrated": False,
+                    "IsDecomposed": False}
+
+# the per run reactor state, the key in run_cols and the matching key of the
+# sch.classify_runs result
+RUN_STATUS_FIELDS = [("StatusNum", "StatusNum"),
+                     ("CycleNum", "StartCycleNum"),
+                     ("HoursSinceShutdown", "HoursSinceShutdown")]
+
+DET_RUN_FIELDS = [("AvgVoltage", 0, np.float64),
+                  ("AvgCurrentMicroAmps", 1, np.float64),
+                  ("AvgHvTempCel", 2, np.float64),
+                  ("TotalCounts", 3, np.int64),
+                  ("AvgRate", 4, np.float64)]
+
+# number of run csv lines parsed at a time when streaming the run data
+RUN_CHUNK_LINES = 4096
+
+
 def read_run_data(fname, det_data):
     """Reads the run information csv
 
@@ -99,15 +133,376 @@ def read_run_data(fname, det_data):
     run_data : list of dict
         Dictionary containing, for each value in the raw run data, a list of
         that value for every run
+
+    Notes
+    -----
+    This is a compatibility wrapper around read_run_columns, new code should
+    use the columnar data directly
+    """
+    return run_columns_to_dicts(read_run_columns(fname, det_data))
+
+
+def read_run_columns(fname, det_data, from_epoch=False):
+    """Reads the run information csv into one numpy array per field
+
+    Parameters
+    ----------
+    fname : str
+        The path to the csv file with run information
+    det_data : list of dicts
+        The list of dictionaries containing individual pieces of det info
+    from_epoch : bool
+        If True the date times are derived from the epoch microsecond columns
+        instead of decoding every time stamp, see ts.decode_time_column
+
+    Returns
+    -------
+    run_cols : dict
+        Dictionary of numpy arrays, see parse_run_columns
+    """
+    return read_run_tail(fname, det_data, 0, from_epoch, True)[0]
+
+
+def read_run_tail(fname, det_data, offset=0, from_epoch=False,
+                  complete=False):
+    """Reads the runs of the run information csv that follow offset, for
+    topping up the run database of a batch that is still being written
+
+    Parameters
+    ----------
+    fname : str
+        The path to the csv file with run information
+    det_data : list of dicts
+        The list of dictionaries containing individual pieces of det info
+    offset : int
+        The byte offset to start reading at, 0 to read the whole file (and
+        skip its header), otherwise the offset returned by an earlier call
+    from_epoch : bool
+        If True the date times are derived from the epoch microsecond columns
+        instead of decoding every time stamp, see ts.decode_time_column
+    complete : bool
+        If True the file is finished, so a last line without a newline is
+        read, otherwise it is assumed to be partially written and left for
+        the next call
+
+    Returns
+    -------
+    run_cols : dict
+        Dictionary of numpy arrays, see parse_run_columns
+    new_offset : int
+        The offset just past the last line read
+    file_size : int
+        The size of the file when it was read
     """
     infile = open(fname)
-    # skip the header line
-    _ = infile.readline()
-    run_list = []
-    for line in infile:
-        data = [x.strip() for x in line.strip().split(',')]
-        run_list.append(parse_run_line(data, det_data))
-    return run_list
+    infile.seek(offset)
+    text = infile.read()
+    infile.close()
+    file_size = offset + len(text)
+    if not complete:
+        text = text[:text.rfind("\n") + 1]
+    new_offset = offset + len(text)
+    lines = text.splitlines()
+    if offset == 0:
+        # skip the header line
+        lines = lines[1:]
+    lines = [x for x in lines if x.strip()]
+    return parse_run_columns(lines, det_data, from_epoch), new_offset, \
+        file_size
+
+
+def select_runs(run_cols, keep):
+    """Selects a subset of the runs in the columnar run data
+
+    Parameters
+    ----------
+    run_cols : dict
+        Dictionary of numpy arrays, see parse_run_columns
+    keep : numpy.ndarray
+        Boolean array with an entry per run, True for the runs to keep
+
+    Returns
+    -------
+    selected : dict
+        Dictionary of numpy arrays of only the kept runs
+    """
+    selected = {}
+    for key, values in run_cols.items():
+        selected[key] = values if key == "DetNum" else values[keep]
+    return selected
+
+
+def iter_run_chunks(fname, det_data, chunk_lines=RUN_CHUNK_LINES, offset=0,
+                    from_epoch=False, complete=True):
+    """Reads the run information csv a fixed number of lines at a time, so
+    only one chunk of the batch is ever parsed and held in memory
+
+    Parameters
+    ----------
+    fname : str
+        The path to the csv file with run information
+    det_data : list of dicts
+        The list of dictionaries containing individual pieces of det info
+    chunk_lines : int
+        The number of lines parsed into each chunk
+    offset : int
+        The byte offset to start reading at, 0 to read the whole file (and
+        skip its header), otherwise an offset returned by read_run_tail or an
+        earlier chunk
+    from_epoch : bool
+        If True the date times are derived from the epoch microsecond columns
+        instead of decoding every time stamp, see ts.decode_time_column
+    complete : bool
+        If True the file is finished, so a last line without a newline is
+        read, otherwise it is assumed to be partially written and left for
+        the next call
+
+    Yields
+    ------
+    run_cols : dict
+        Dictionary of numpy arrays of the runs in the chunk, see
+        parse_run_columns
+    new_offset : int
+        The offset just past the last line of the chunk
+    """
+    infile = open(fname)
+    infile.seek(offset)
+    if offset == 0:
+        # skip the header line
+        offset += len(infile.readline())
+    lines = []
+    line = infile.readline()
+    while line:
+        if not line.endswith("\n") and not complete:
+            break
+        offset += len(line)
+        if line.strip():
+            lines.append(line)
+        if len(lines) == chunk_lines:
+            yield parse_run_columns(lines, det_data, from_epoch), offset
+            lines = []
+        line = infile.readline()
+    infile.close()
+    if lines:
+        yield parse_run_columns(lines, det_data, from_epoch), offset
+
+
+def summarize_runs(run_cols, det_nums):
+    """Reduces the columnar run data to the general run information and the
+    per detector fields of a few detectors, which is all the rate threshold
+    logic needs
+
+    Parameters
+    ----------
+    run_cols : dict
+        Dictionary of numpy arrays, see parse_run_columns
+    det_nums : list of int
+        The detectors whose per detector fields are kept
+
+    Returns
+    -------
+    summary : dict
+        Dictionary of numpy arrays with the same keys as run_cols, the per
+        detector arrays only have columns for det_nums
+    """
+    keep = np.in1d(run_cols["DetNum"], det_nums)
+    summary = {}
+    for key, values in run_cols.items():
+        if key == "DetNum":
+            summary[key] = values[keep]
+        elif values.ndim == 2:
+            summary[key] = values[:, keep]
+        else:
+            summary[key] = values
+    return summary
+
+
+def concat_run_columns(chunks, det_data):
+    """Joins chunks of columnar run data back into one set of arrays
+
+    Parameters
+    ----------
+    chunks : list of dict
+        Dictionaries of numpy arrays for consecutive runs, see
+        parse_run_columns, they must all have the same detectors
+    det_data : list of dicts
+        The list of dictionaries containing individual pieces of det info,
+        used for the detector columns if there are no chunks
+
+    Returns
+    -------
+    run_cols : dict
+        Dictionary of numpy arrays of all the runs
+    """
+    if not chunks:
+        return parse_run_columns([], det_data)
+    run_cols = {"DetNum": chunks[0]["DetNum"]}
+    for key in chunks[0]:
+        if key != "DetNum":
+            run_cols[key] = np.concatenate([x[key] for x in chunks])
+    return run_cols
+
+
+def read_run_summary(fname, det_data, det_nums, chunk_lines=RUN_CHUNK_LINES):
+    """Streams the run information csv, keeping only what summarize_runs
+    keeps of each chunk
+
+    Parameters
+    ----------
+    fname : str
+        The path to the csv file with run information
+    det_data : list of dicts
+        The list of dictionaries containing individual pieces of det info
+    det_nums : list of int
+        The detectors whose per detector fields are kept
+    chunk_lines : int
+        The number of lines parsed at a time
+
+    Returns
+    -------
+    run_cols : dict
+        Dictionary of numpy arrays, see summarize_runs
+    """
+    chunks = [summarize_runs(x[0], det_nums) for x in
+              iter_run_chunks(fname, det_data, chunk_lines)]
+    return summarize_runs(concat_run_columns(chunks, det_data), det_nums)
+
+
+def parse_run_columns(lines, det_data, from_epoch=False):
+    """Takes the lines of the run csv (without the header) and converts them
+    in bulk into one array per field
+
+    Parameters
+    ----------
+    lines : list of str
+        the lines of run data
+    det_data : list of dict
+        the list of detector data dictionaries
+    from_epoch : bool
+        If True the date times are derived from the epoch microsecond columns
+        instead of decoding every time stamp, see ts.decode_time_column
+
+    Returns
+    -------
+    run_cols : dict
+        Dictionary with the same keys as the run and detector run dictionaries
+        The general run fields (RunNum, StartDateTime, ...) are arrays with
+        one entry per run, the date times are datetime64[us] arrays
+        The per detector fields (AvgVoltage, ..., AvgRate) are arrays with
+        shape (number of runs, number of detectors)
+        DetNum holds the detector number for each detector column
+        StatusNum, CycleNum, and HoursSinceShutdown hold the reactor state of
+        each run, see add_reactor_status
+    """
+    num_dets = len(det_data)
+    num_cols = RUN_FIXED_COLUMNS + DET_RUN_COLUMNS * num_dets
+    fields = np.array([x.split(',')[:num_cols] for x in lines])
+    fields = fields.reshape((len(lines), num_cols))
+    run_cols = {}
+    run_cols["DetNum"] = np.array([x["DetNum"] for x in det_data],
+                                  dtype=np.int64)
+    for key, col in RUN_INT_FIELDS:
+        run_cols[key] = fields[:, col].astype(np.int64)
+    for key, col, epoch_key in RUN_TIME_FIELDS:
+        run_cols[key] = ts.decode_time_column(fields[:, col],
+                                              run_cols[epoch_key], from_epoch)
+    for key, offset, dtype in DET_RUN_FIELDS:
+        start = RUN_FIXED_COLUMNS + offset
+        run_cols[key] = fields[:, start::DET_RUN_COLUMNS].astype(dtype)
+    add_reactor_status(run_cols)
+    return run_cols
+
+
+def add_reactor_status(run_cols):
+    """Classifies every run against the HFIR schedule in one pass, adding the
+    RUN_STATUS_FIELDS arrays to the columnar run data
+
+    Parameters
+    ----------
+    run_cols : dict
+        Dictionary of numpy arrays, the StartDateTime and StopDateTime arrays
+        must be present
+
+    Notes
+    -----
+    Runs the schedule cannot place get sch.UNKNOWN_VALUE for the status and
+    cycle number, and nan hours since shutdown
+    """
+    status = sch.classify_runs(run_cols["StartDateTime"],
+                               run_cols["StopDateTime"])
+    for key, status_key in RUN_STATUS_FIELDS:
+        run_cols[key] = status[status_key]
+
+
+def run_info_view(run_cols):
+    """Builds the list of general run information dictionaries from the
+    columnar run data
+
+    Parameters
+    ----------
+    run_cols : dict
+        Dictionary of numpy arrays from read_run_columns
+
+    Returns
+    -------
+    run_info : list of dict
+        One dictionary per run, as produced by parse_run_line
+    """
+    keys = [x[0] for x in RUN_INT_FIELDS] + [x[0] for x in RUN_TIME_FIELDS]
+    values = [run_cols[key].tolist() for key in keys]
+    return [dict(zip(keys, vals)) for vals in zip(*values)]
+
+
+def det_run_view(run_cols):
+    """Builds the per detector lists of run dictionaries from the columnar
+    run data
+
+    Parameters
+    ----------
+    run_cols : dict
+        Dictionary of numpy arrays from read_run_columns
+
+    Returns
+    -------
+    det_run_data : list of lists of dict
+        One list per detector, holding one dictionary per run, as produced by
+        parse_det_run_info
+    """
+    run_nums = run_cols["RunNum"].tolist()
+    keys = [x[0] for x in DET_RUN_FIELDS]
+    det_run_data = []
+    for ind, det_num in enumerate(run_cols["DetNum"].tolist()):
+        values = [run_cols[key][:, ind].tolist() for key in keys]
+        det_list = []
+        for run_num, vals in zip(run_nums, zip(*values)):
+            det_run_info = dict(zip(keys, vals))
+            det_run_info["DetNum"] = det_num
+            det_run_info["RunNum"] = run_num
+            det_run_info.update(DET_RUN_DEFAULTS)
+            det_list.append(det_run_info)
+        det_run_data.append(det_list)
+    return det_run_data
+
+
+def run_columns_to_dicts(run_cols):
+    """Converts the columnar run data into the list of dictionaries layout
+    returned by read_run_data
+
+    Parameters
+    ----------
+    run_cols : dict
+        Dictionary of numpy arrays from read_run_columns
+
+    Returns
+    -------
+    run_data : list of lists of dicts
+        For each run, the list of the general run dictionary followed by one
+        dictionary for each detector
+    """
+    run_info = run_info_view(run_cols)
+    det_run_data = det_run_view(run_cols)
+    return [[run] + [x[ind] for x in det_run_data]
+            for ind, run in enumerate(run_info)]
 
 
 def parse_run_line(data, det_data):
@@ -132,14 +527,11 @@ def parse_run_line(data, det_data):
     run_dict = {}
     run_dict["RunNum"] = int(data[0])
     run_dict["StartEpochMicroSec"] = int(data[1])
-    run_dict["StartDateTime"] = dt.datetime.strptime(data[2],
-                                                     "%Y-%b-%d %H:%M:%S.%f")
+    run_dict["StartDateTime"] = ts.parse_orchid_time(data[2])
     run_dict["StopEpochMicroSec"] = int(data[3])
-    run_dict["StopDateTime"] = dt.datetime.strptime(data[4],
-                                                    "%Y-%b-%d %H:%M:%S.%f")
+    run_dict["StopDateTime"] = ts.parse_orchid_time(data[4])
     run_dict["CenterEpochMicroSec"] = int(data[5])
-    run_dict["CenterDateTime"] = dt.datetime.strptime(data[6],
-                                                      "%Y-%b-%d %H:%M:%S.%f")
+    run_dict["CenterDateTime"] = ts.parse_orchid_time(data[6])
     run_dict["RunTimeMicroSec"] = int(data[7])
     out_list.append(run_dict)
     start_ind = 8
@@ -182,14 +574,7 @@ def parse_det_run_info(data, det_dict, run_num):
     det_run_info["AvgHvTempCel"] = float(data[2])
     det_run_info["TotalCounts"] = int(data[3])
     det_run_info["AvgRate"] = float(data[4])
-    det_run_info["EnCalOffset"] = 0.0
-    det_run_info["EnCalSlope"] = 0.0
-    det_run_info["EnCalCurve"] = 0.0
-    det_run_info["WidthSqOffset"] = 0.0
-    det_run_info["WidthSqSlope"] = 0.0
-    det_run_info["WidthSqCurve"] = 0.0
-    det_run_info["IsCalibrated"] = False
-    det_run_info["IsDecomposed"] = False
+    det_run_info.update(DET_RUN_DEFAULTS)
     return det_run_info
 
 
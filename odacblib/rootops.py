@@ -1,15 +1,82 @@
 """This file contains the functions that are used to directly access and
 manipulate root files and data"""
 
-import ctypes as ct
+import time
+import numpy as np
 import ROOT as rt
 import odacblib.input_sanitizer as ins
+import odacblib.peakfind as pkf
+import odacblib.calsum as cs
+import odacblib.calfit as cf
+import odacblib.instrument as inst
 
-def find_sodium_peak_runs(lo_bnd, hi_bnd, root_input):
+def find_sodium_peak_runs(lo_bnd, hi_bnd, root_input, auto=True):
     """This function prepares a calibration root file for a single calibration
     block, when that block happens to fall into the "early reactor off" class
-    It will query the user to deterimine where the 24Na peak dissappears
-    and produce two run data tuples, one with and one without the 24Na peak
+    It determines where the 24Na peak dissappears automatically, falling back
+    to asking the user if the automatic classification is not confident, and
+    produces run data tuples with and without the 24Na peak
+
+    Parameters
+    ----------
+    lo_bnd : int
+        The lowest run in the stretch to be checked
+    hi_bnd : int
+        The highest run in the stretch to be checked
+    root_input : str
+        The path of the root input file
+    auto : bool
+        If False always ask the user
+
+    Returns
+    -------
+    runs_list : list of tuples
+        Each tuple contains a start run and stop run and either a 1 or a 0
+        0 indicates there is no 24Na peak in these runs, 1 indicates there is
+    """
+    if not auto:
+        return ask_sodium_peak_runs(lo_bnd, hi_bnd, root_input)
+    print "Finding Runs containing a reasonable 24Na peak"
+    infile = rt.TFile(root_input)
+    fmt = "Det_8_Run_{0:d}_px"
+    run_nums = range(lo_bnd, hi_bnd + 1)
+    spectra = np.array([hist_to_array(infile.Get(fmt.format(i)))
+                        for i in run_nums])
+    infile.Close()
+    runs_list, confidence, confident = pkf.classify_sodium_runs(run_nums,
+                                                                spectra)
+    if confident:
+        for tup in runs_list:
+            print "    Runs {0:d} - {1:d}: 24Na peak {2:s}".format(
+                tup[0], tup[1], "present" if tup[2] else "absent")
+        return runs_list
+    print "Automatic 24Na detection is not confident ({0:.2f}), asking the"\
+        " user".format(confidence)
+    return ask_sodium_peak_runs(lo_bnd, hi_bnd, root_input)
+
+
+def hist_to_array(hist):
+    """Copies the bin contents of a 1D histogram, without the underflow and
+    overflow bins, to a numpy array
+
+    Parameters
+    ----------
+    hist : ROOT.TH1
+        The histogram
+
+    Returns
+    -------
+    contents : numpy.ndarray
+        The bin contents
+    """
+    return np.array([hist.GetBinContent(i)
+                     for i in range(1, hist.GetNbinsX() + 1)])
+
+
+def ask_sodium_peak_runs(lo_bnd, hi_bnd, root_input):
+    """This function queries the user, spectrum by spectrum, to deterimine
+    where the 24Na peak dissappears and produce two run data tuples, one with
+    and one without the 24Na peak
 
     Parameters
     ----------
@@ -39,7 +106,8 @@ def find_sodium_peak_runs(lo_bnd, hi_bnd, root_input):
     hist = infile.Get(fmt.format(lo_bnd))
     hist.Draw()
     canv.Update()
-    last_ans = ins.get_yes_no(query, default_value=True)
+    last_ans = ins.get_yes_no(query, default_value=True,
+                              decision="sodium_peak")
     start_run = lo_bnd
     stop_run = lo_bnd
     x_range = (canv.GetFrame().GetX1(), canv.GetFrame().GetX2())
@@ -51,7 +119,8 @@ def find_sodium_peak_runs(lo_bnd, hi_bnd, root_input):
         hist.GetXaxis().SetRangeUser(x_range[0], x_range[1])
         hist.Draw()
         canv.Update()
-        ans = ins.get_yes_no(query, default_value=True)
+        ans = ins.get_yes_no(query, default_value=True,
+                             decision="sodium_peak")
         x_range = (canv.GetFrame().GetX1(), canv.GetFrame().GetX2())
         if last_ans == ans:
             stop_run = i
@@ -64,7 +133,9 @@ def find_sodium_peak_runs(lo_bnd, hi_bnd, root_input):
     return out_list
 
 
-def prep_calibration_file(runs, root_input, root_output, det_data, num_runs):
+@inst.timed
+def prep_calibration_file(runs, root_input, root_output, det_data, num_runs,
+                          processes=None):
     """This function  generates / copies sums for the calibration file for the
     full calibration program to use
 
@@ -84,6 +155,9 @@ def prep_calibration_file(runs, root_input, root_output, det_data, num_runs):
         list of dictionary of the detector data
     num_runs : int
         The number of runs in this batch
+    processes : int
+        The number of processes used to sum the detectors when re-summing,
+        None for one per cpu
     """
     # first check if we can merely use pregenerated sums or if we need to
     # generate new sums
@@ -91,10 +165,11 @@ def prep_calibration_file(runs, root_input, root_output, det_data, num_runs):
     if len(runs) == 1 and run_count == num_runs:
         do_normal_prep(runs, root_input, root_output, det_data)
     else:
-        do_split_prep(runs, root_input, root_output, det_data)
+        do_split_prep(runs, root_input, root_output, det_data, processes)
 
 
-def do_split_prep(runs, root_input, root_output, det_data):
+@inst.timed
+def do_split_prep(runs, root_input, root_output, det_data, processes=None):
     """This function prepares a calibration root file for a single calibration
     block, i.e. all the data is coming from reactor on, or reactor off, no
     exceptions
@@ -113,22 +188,27 @@ def do_split_prep(runs, root_input, root_output, det_data):
         The path of the root output file
     det_data : list of dict
         list of dictionary of the detector data
+    processes : int
+        The number of processes used to sum the detectors, None for one per
+        cpu
     """
     print "Preparing Root Calibration File"
     for i, run in enumerate(runs):
-        do_single_prep(run, root_input, root_output, det_data, i)
+        do_single_prep(run, root_input, root_output, det_data, i, processes)
+    # write the parameters of every calibration with a single open
     outfile = rt.TFile(root_output, "UPDATE")
     outfile.cd()
-    num_cals = rt.TParameter('int')("NumCals", 1)
-    num_cals.Write()
-    outfile.Flush()
+    params = make_cal_parameters(runs)
+    params.Write()
+    outfile.Close()
     print "Done preparing calibration sums"
 
 
-def do_single_prep(run, root_input, root_output, det_data, ind):
-    """This function prepares a calibration root file for a single calibration
-    block, i.e. all the data is coming from reactor on, or reactor off, no
-    exceptions
+def do_single_prep(run, root_input, root_output, det_data, ind,
+                   processes=None):
+    """This function sums the spectra of every detector for a single
+    calibration block into the calibration root file, the parameters of the
+    block are written by make_cal_parameters
 
     Parameters
     ----------
@@ -146,38 +226,53 @@ def do_single_prep(run, root_input, root_output, det_data, ind):
         list of dictionary of the detector data
     ind : int
         which calibration we are preparing
+    processes : int
+        The number of processes used to sum the detectors, None for one per
+        cpu
     """
     print "Preparing Calibration #{0:d}".format(ind)
-    lib = ct.cdll.LoadLibrary("./odacblib/libCalibrate.so")
-    lib.performCalSum.argtypes = [ct.c_int, ct.c_int, ct.c_int, ct.c_int,
-                                    ct.c_char_p, ct.c_char_p, ct.c_int]
-    # now copy the sum spectra over to the root file
-    count = 0
-    for dat in det_data:
-        nf = 1
-        if count==0 and ind == 0:
-            nf = 0
-        print "    Preparing Sums For Det #{0:d}".format(dat["DetNum"])
-        lib.performCalSum(run[0], run[1], dat["DetNum"], ind,
-                          ct.c_char_p(root_input), ct.c_char_p(root_output),
-                          nf)
-        count += 1
-    outfile = rt.TFile(root_output, "UPDATE")
-    # write a few extra tidbits to the file
-    cal_start = rt.TParameter('int')("Cal_{0:d}_Start".format(ind), run[0])
-    cal_start.Write()
-    cal_stop = rt.TParameter('int')("Cal_{0:d}_Stop".format(ind), run[1])
-    cal_stop.Write()
-    num_gammas = rt.TParameter('int')("Cal_{0:d}_NumGammas".format(ind),
-                                      len(run[2]))
-    num_gammas.Write()
-    for i, gamma in enumerate(run[2]):
-        temp = rt.TParameter('double')("Cal_{0:d}_Gamma_{1:d}".format(ind, i),
-                                       gamma)
-        temp.Write()
-    outfile.Flush()
+    # sum the spectra of all the detectors in parallel into the root file
+    cs.sum_calibration_block(run, root_input, root_output,
+                             [dat["DetNum"] for dat in det_data], ind,
+                             processes)
+
+
+def make_cal_parameters(runs):
+    """Gathers the parameters describing the calibration blocks into one list
+    so they can be written together, each parameter still gets its own key
+
+    Parameters
+    ----------
+    runs : list of tuples
+        list of tuples where each tuple has the start run, the stop run,
+        the gamma-ray list for calibration, and the "kind" of calibration
+
+    Returns
+    -------
+    params : ROOT.TList
+        The list of TParameters, it owns its contents
+    """
+    params = rt.TList()
+    params.SetOwner(True)
+    temp = [rt.TParameter('int')("NumCals", len(runs))]
+    for ind, run in enumerate(runs):
+        temp.append(rt.TParameter('int')("Cal_{0:d}_Start".format(ind),
+                                         run[0]))
+        temp.append(rt.TParameter('int')("Cal_{0:d}_Stop".format(ind),
+                                         run[1]))
+        temp.append(rt.TParameter('int')("Cal_{0:d}_NumGammas".format(ind),
+                                         len(run[2])))
+        for i, gamma in enumerate(run[2]):
+            temp.append(rt.TParameter('double')(
+                "Cal_{0:d}_Gamma_{1:d}".format(ind, i), gamma))
+    for param in temp:
+        # the list deletes them, not python
+        rt.SetOwnership(param, False)
+        params.Add(param)
+    return params
 
 
+@inst.timed
 def do_normal_prep(runs, root_input, root_output, det_data):
     """This function prepares a calibration root file for a single calibration
     block, i.e. all the data is coming from reactor on, or reactor off, no
@@ -202,44 +297,74 @@ def do_normal_prep(runs, root_input, root_output, det_data):
     # open the root files
     print "Preparing Root Calibration File"
     infile = rt.TFile(root_input)
-    outfile = rt.TFile(root_output, "RECREATE")
+    outfile = rt.TFile(root_output, "RECREATE", "", cs.CAL_FILE_COMPRESSION)
     # write a few extra tidbits to the file
-    num_cals = rt.TParameter('int')("NumCals", 1)
-    num_cals.Write()
-    cal_start = rt.TParameter('int')("Cal_0_Start", runs[0][0])
-    cal_start.Write()
-    cal_stop = rt.TParameter('int')("Cal_0_Stop", runs[0][1])
-    cal_stop.Write()
-    num_gammas = rt.TParameter('int')("Cal_0_NumGammas", len(runs[0][2]))
-    num_gammas.Write()
-    for i, gamma in enumerate(runs[0][2]):
-        temp = rt.TParameter('double')("Cal_0_Gamma_{0:d}".format(i), gamma)
-        temp.Write()
-    outfile.Flush()
-    # Now prepare to write the spectra to the file
-    in_fmts = ["Det_{0:d}_Sum_px", "Det_{0:d}_Sum_px_thresh",
-               "Det_{0:d}_Sum_py", "Det_{0:d}_Sum_px_thresh",
-               "Det_{0:d}_Sum_2D"]
-    out_fmts = ["Det_{0:d}_Sum_px_Cal_0", "Det_{0:d}_Sum_px_thresh_Cal_0",
-                "Det_{0:d}_Sum_py_Cal_0", "Det_{0:d}_Sum_px_thresh_Cal_0",
-                "Det_{0:d}_Sum_2D_Cal_0"]
-    # now copy the sum spectra over to the root file
+    outfile.cd()
+    params = make_cal_parameters(runs[:1])
+    params.Write()
+    # now copy the sum spectra over to the root file, they are already summed
+    # over the whole batch by orchid reader
+    name_map = {}
     for dat in det_data:
-        # first copy the histograms over
-        in_names = [x.format(dat["DetNum"]) for x in in_fmts]
-        out_names = [x.format(dat["DetNum"]) for x in out_fmts]
-        for iname, oname in zip(in_names, out_names):
-            hist = infile.Get(iname)
-            hist.SetName(oname)
-            outfile.cd()
-            hist.Write()
-    outfile.Flush()
-
-
-def get_sum_cal_fits(runs, root_output, det_data):
-    """This function prepares a calibration root file for a single calibration
-    block, i.e. all the data is coming from reactor on, or reactor off, no
-    exceptions
+        for suffix in cs.HIST_SUFFIXES:
+            in_name = "Det_{0:d}_Sum_{1:s}".format(dat["DetNum"], suffix)
+            name_map[in_name] = (cs.SUM_HIST_FMT.format(dat["DetNum"], suffix,
+                                                        0), dat["DetNum"])
+    report = transfer_histograms(infile, outfile, name_map)
+    outfile.Close()
+    infile.Close()
+    for det_num in sorted(report):
+        print "    Det #{0:d}: {1:d} bytes in {2:.3f} s".format(
+            det_num, report[det_num]["Bytes"], report[det_num]["Seconds"])
+
+
+def transfer_histograms(infile, outfile, name_map):
+    """Copies histograms from one file to another, renaming them, in a single
+    pass through the keys of the input file in the order they are stored
+
+    Parameters
+    ----------
+    infile : ROOT.TFile
+        The file to read from
+    outfile : ROOT.TFile
+        The file to write to
+    name_map : dict
+        Maps the name of each histogram to copy to a tuple of its new name and
+        the detector number it is accounted to
+
+    Returns
+    -------
+    report : dict
+        For each detector number, a dictionary of the Bytes written and the
+        Seconds spent
+    """
+    report = {}
+    done = set()
+    for key in infile.GetListOfKeys():
+        name = key.GetName()
+        # only the highest cycle of a key, which is listed first, is copied
+        if name not in name_map or name in done:
+            continue
+        start = time.time()
+        new_name, det_num = name_map[name]
+        hist = key.ReadObj()
+        hist.SetName(new_name)
+        outfile.cd()
+        nbytes = hist.Write()
+        entry = report.setdefault(det_num, {"Bytes": 0, "Seconds": 0.0})
+        entry["Bytes"] += nbytes
+        entry["Seconds"] += time.time() - start
+        inst.count("HistBytes", nbytes)
+        done.add(name)
+    for name in sorted(set(name_map) - done):
+        print "Warning: {0:s} is not in the input file".format(name)
+    return report
+
+
+@inst.timed
+def get_sum_cal_fits(runs, root_output, det_data, processes=None):
+    """This function fits the energy and width calibration of every detector
+    for every calibration block from the sums in the calibration root file
 
     Parameters
     ----------
@@ -249,7 +374,50 @@ def get_sum_cal_fits(runs, root_output, det_data):
         0 - reactor on
         1 - reactor off, early (so 24Na peak is visible)
         2 - reactor off, late (no 24Na peak)
-    root_input : str
-        The path of the root input file
+    root_output : str
+        The path of the calibration root file
+    det_data : list of dict
+        list of dictionary of the detector data
+    processes : int
+        The number of processes used for the fits, None for one per cpu
+
+    Returns
+    -------
+    results : dict
+        The calibration of each detector and block keyed by (detector number,
+        calibration number), see cf.calibrate_spectrum
+    """
+    print "Fitting calibrations"
+    infile = rt.TFile(root_output)
+    tasks = []
+    for ind, run in enumerate(runs):
+        for dat in det_data:
+            name = cs.SUM_HIST_FMT.format(dat["DetNum"], "px", ind)
+            hist = infile.Get(name)
+            if not hist:
+                print "Warning: {0:s} is not in the calibration file".format(
+                    name)
+                continue
+            tasks.append((dat["DetNum"], ind, hist_bin_centers(hist),
+                          hist_to_array(hist), run[2]))
+    infile.Close()
+    return cf.fit_calibrations(tasks, processes)
+
+
+def hist_bin_centers(hist):
+    """Gets the bin centers of a 1D histogram with fixed width bins
+
+    Parameters
+    ----------
+    hist : ROOT.TH1
+        The histogram
+
+    Returns
+    -------
+    centers : numpy.ndarray
+        The center of each bin, without the underflow and overflow bins
     """
-    pass
+    axis = hist.GetXaxis()
+    num_bins = hist.GetNbinsX()
+    width = (axis.GetXmax() - axis.GetXmin()) / num_bins
+    return axis.GetXmin() + width * (np.arange(num_bins) + 0.5)
@@ -0,0 +1,226 @@
+"""Index of the runs of every batch in the global batch database, to find the
+batch and run database that hold a time without opening each run database
+
+The index is a table of run intervals sorted by their start. As the runs are
+short and rarely overlap, the runs that cover a time are those that start at
+most the longest run length before it, which is one range search of the start
+index whose bound (the longest run length) is itself read from an index
+
+The lookups only read the database, the builder creates and fills the index
+through write_run_intervals, from the process that writes the batch table
+
+An sqlite R*Tree was not used as it stores its coordinates as 32 bit floats,
+which cannot hold microsecond epoch times"""
+import collections
+import sqlite3 as sql
+import numpy as np
+import odacblib.batchdb as bdb
+import odacblib.databaseops as dbops
+import odacblib.batchquery as bq
+
+RUN_INDEX_CMDS = [
+    """CREATE TABLE IF NOT EXISTS run_interval_table (
+    batch_name text NOT NULL,
+    run_number int NOT NULL,
+    start_us_epoch int NOT NULL,
+    stop_us_epoch int NOT NULL,
+    PRIMARY KEY (batch_name, run_number)
+) WITHOUT ROWID""",
+    "CREATE INDEX IF NOT EXISTS run_interval_by_start_index ON "
+    "run_interval_table (start_us_epoch, stop_us_epoch)",
+    "CREATE INDEX IF NOT EXISTS run_interval_by_length_index ON "
+    "run_interval_table ((stop_us_epoch - start_us_epoch))"]
+
+RUN_INTERVAL_INSERT = "INSERT OR REPLACE INTO run_interval_table VALUES "\
+    "(?, ?, ?, ?)"
+
+RUN_INTERVAL_DELETE = "DELETE FROM run_interval_table WHERE batch_name = ?"
+
+RUN_INTERVAL_COUNT = "SELECT COUNT(*) FROM run_interval_table WHERE "\
+    "batch_name = ?"
+
+RUN_INDEX_EXISTS = "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' "\
+    "AND name = 'run_interval_table'"
+
+MAX_RUN_LENGTH_SELECT = "SELECT MAX(stop_us_epoch - start_us_epoch) FROM "\
+    "run_interval_table"
+
+# the runs of a run database, from the run after the given one
+RUN_DB_INTERVAL_SELECT = "SELECT run_number, start_us_epoch, stop_us_epoch "\
+    "FROM run_data_table WHERE run_number > ? ORDER BY run_number"
+
+# runs that overlap [?, ?], given the start less the longest run length, the
+# run database of each run is joined from the batch table by its primary key
+RUN_OVERLAP_SELECT = """SELECT r.batch_name, r.run_number, r.start_us_epoch,
+    r.stop_us_epoch, b.run_db_location
+FROM run_interval_table AS r LEFT JOIN batch_table AS b
+    ON b.batch_name = r.batch_name
+WHERE r.start_us_epoch BETWEEN ? AND ? AND r.stop_us_epoch >= ?
+ORDER BY r.start_us_epoch, r.batch_name"""
+
+# one run of the index
+RunInterval = collections.namedtuple("RunInterval", [
+    "BatchName", "RunNum", "StartEpochMicroSec", "StopEpochMicroSec",
+    "RunDbLoc"])
+
+RUN_INTERVAL_DTYPE = [("BatchName", object), ("RunNum", np.int64),
+                      ("StartEpochMicroSec", np.int64),
+                      ("StopEpochMicroSec", np.int64), ("RunDbLoc", object)]
+
+
+def open_run_index(db_loc):
+    """Opens the global batch database, creating the run index if needed
+
+    Parameters
+    ----------
+    db_loc : str
+        path to the batch database file
+
+    Returns
+    -------
+    dbcon : sqlite database connection
+        This process's connection to the batch database
+    """
+    dbcon = dbops.open_batch_database(db_loc)
+    for cmd in RUN_INDEX_CMDS:
+        bdb.with_retry(dbcon.execute, cmd)
+    return dbcon
+
+
+def read_run_intervals(run_db_path, after_run=None):
+    """Reads the start and stop times of the runs in a run database
+
+    Parameters
+    ----------
+    run_db_path : str
+        Path to the run database file
+    after_run : int
+        Only the runs after this run number are read, None for all of them
+
+    Returns
+    -------
+    rows : list of tuple
+        The run number, start and stop in epoch microseconds of each run
+    """
+    dbcon = sql.connect(run_db_path)
+    rows = dbcon.execute(RUN_DB_INTERVAL_SELECT,
+                         (-1 if after_run is None else after_run,)).fetchall()
+    dbcon.close()
+    return rows
+
+
+def write_run_intervals(db_loc, batch_name, intervals, after_run=None,
+                        dbcon=None):
+    """Adds the runs of a batch to the run index
+
+    Parameters
+    ----------
+    db_loc : str
+        path to the batch database file
+    batch_name : str
+        The name of the batch
+    intervals : list of tuple
+        The runs, see read_run_intervals
+    after_run : int
+        If None the runs of the batch are replaced by intervals, otherwise
+        intervals are only the runs after this run number, as when runs were
+        appended to a live batch
+    dbcon : sqlite database connection
+        An already open connection to the batch database, from
+        open_run_index, if None this process's connection to the database at
+        db_loc is used
+    """
+    if dbcon is None:
+        dbcon = open_run_index(db_loc)
+    rows = [(batch_name,) + tuple(x) for x in intervals]
+
+    def write_rows(cursor):
+        if after_run is None:
+            cursor.execute(RUN_INTERVAL_DELETE, (batch_name,))
+        cursor.executemany(RUN_INTERVAL_INSERT, rows)
+    bdb.run_transaction(dbcon, write_rows)
+
+
+def batch_is_indexed(db_loc, batch_name):
+    """Checks if a batch has runs in the run index
+
+    Parameters
+    ----------
+    db_loc : str
+        path to the batch database file
+    batch_name : str
+        The name of the batch
+
+    Returns
+    -------
+    indexed : bool
+        True if any run of the batch is in the index
+    """
+    dbcon = bq.open_read_only(db_loc)
+    try:
+        if dbcon.execute(RUN_INDEX_EXISTS).fetchone()[0] == 0:
+            return False
+        return dbcon.execute(RUN_INTERVAL_COUNT,
+                             (batch_name,)).fetchone()[0] > 0
+    finally:
+        dbcon.close()
+
+
+def runs_overlapping(db_loc, start, stop, as_array=False):
+    """Finds the runs, of any batch, with data in a time window
+
+    Parameters
+    ----------
+    db_loc : str
+        path to the batch database file
+    start : datetime.datetime or int
+        The start of the window, see bq.to_epoch_us
+    stop : datetime.datetime or int
+        The end of the window, see bq.to_epoch_us
+    as_array : bool
+        True to return a numpy record array instead of a list
+
+    Returns
+    -------
+    runs : list of RunInterval or numpy.recarray
+        The runs that overlap the window, in order of their start, none if
+        no batch was indexed yet
+    """
+    start = bq.to_epoch_us(start)
+    stop = bq.to_epoch_us(stop)
+    dbcon = bq.open_read_only(db_loc)
+    try:
+        max_length = None
+        if dbcon.execute(RUN_INDEX_EXISTS).fetchone()[0] > 0:
+            max_length = dbcon.execute(MAX_RUN_LENGTH_SELECT).fetchone()[0]
+        rows = []
+        if max_length is not None:
+            rows = dbcon.execute(RUN_OVERLAP_SELECT,
+                                 (start - max_length, stop,
+                                  start)).fetchall()
+    finally:
+        dbcon.close()
+    if as_array:
+        return np.rec.array(np.array([tuple(x) for x in rows],
+                                     dtype=RUN_INTERVAL_DTYPE))
+    return [RunInterval(*x) for x in rows]
+
+
+def runs_at(db_loc, time, as_array=False):
+    """Finds the runs, of any batch, that cover a time
+
+    Parameters
+    ----------
+    db_loc : str
+        path to the batch database file
+    time : datetime.datetime or int
+        The time, see bq.to_epoch_us
+    as_array : bool
+        True to return a numpy record array instead of a list
+
+    Returns
+    -------
+    runs : list of RunInterval or numpy.recarray
+        The runs that cover the time, usually one or none
+    """
+    return runs_overlapping(db_loc, time, time, as_array)
@@ -1,40 +1,142 @@
 """Contains the HFIR past operating schedule and functions for determining
-where within that schedule we are"""
+where within that schedule we are
+
+The schedule is read from a csv (or json) file, by default hfir_schedule.csv
+next to this file, into a schedule index whose sorted startup and shutdown
+times are searched by bisection"""
+import os
+import csv
+import json
+import bisect
 import datetime as dt
+import numpy as np
+
+SCHEDULE_PATH = os.environ.get(
+    "ODACB_SCHEDULE_FILE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                 "hfir_schedule.csv"))
 
-HFIR_STARTUP_DAYS = [dt.datetime(2016, 9, 6, 9, 57),
-                     dt.datetime(2016, 11, 15, 9, 42),
-                     dt.datetime(2017, 1, 3, 14, 21),
-                     dt.datetime(2017, 2, 14, 8, 30),
-                     dt.datetime(2017, 5, 3, 12, 50),
-                     dt.datetime(2017, 6, 13, 7, 58),
-                     dt.datetime(2017, 7, 25, 0, 0),  # in the future
-                     dt.datetime(2017, 9, 5, 0, 0)]  # in the future
-
-HFIR_SHUTDOWN_DAYS = [dt.datetime(2016, 9, 30, 10, 4),
-                      dt.datetime(2016, 12, 8, 20, 15),
-                      dt.datetime(2017, 1, 29, 0, 0),
-                      dt.datetime(2017, 3, 11, 23, 59),
-                      dt.datetime(2017, 5, 27, 22, 35),
-                      dt.datetime(2017, 7, 8, 14, 29),
-                      dt.datetime(2017, 8, 18, 0, 0),  # in the future
-                      dt.datetime(2017, 9, 29, 0, 0)]  # in the future
-
-HFIR_CYCLE_NUM = [468, 469, 470, 471, 472, 473, 474]
+# fields of each cycle in the schedule file
+SCHEDULE_FIELDS = ["CycleNum", "StartupDateTime", "ShutdownDateTime"]
+
+SCHEDULE_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
 
 CYCLE_STATUS_NAMES = ["Reactor Off", "Reactor Startup", "Reactor On",
                       "Reactor Shutdown"]
 
-# variables automatically generated from the variables above
+# value of the status and cycle number in the vectorized results when the
+# schedule cannot answer for a run
+UNKNOWN_VALUE = -1
+
+MICRO_SEC_PER_HOUR = 3600000000.0
+
+
+def load_schedule(fname=SCHEDULE_PATH):
+    """Reads a schedule file into a schedule index, the file is either a csv
+    with a header row of SCHEDULE_FIELDS or (if it ends in .json) a json list
+    of objects with SCHEDULE_FIELDS as keys, times are SCHEDULE_TIME_FORMAT
+
+    Parameters
+    ----------
+    fname : str
+        The path of the schedule file
+
+    Returns
+    -------
+    schedule : dict
+        The schedule index, see make_schedule
+    """
+    infile = open(fname)
+    if fname.lower().endswith(".json"):
+        cycles = json.load(infile)
+    else:
+        cycles = [row for row in csv.DictReader(infile)]
+    infile.close()
+    missing = [x for x in SCHEDULE_FIELDS if cycles and x not in cycles[0]]
+    if missing:
+        raise ValueError("Schedule file {0:s} is missing {1:s}".format(
+            fname, ", ".join(missing)))
+    return make_schedule(
+        [int(x["CycleNum"]) for x in cycles],
+        [dt.datetime.strptime(x["StartupDateTime"].strip(),
+                              SCHEDULE_TIME_FORMAT) for x in cycles],
+        [dt.datetime.strptime(x["ShutdownDateTime"].strip(),
+                              SCHEDULE_TIME_FORMAT) for x in cycles])
+
+
+def make_schedule(cycle_nums, startup_days, shutdown_days):
+    """Builds the schedule index from the cycles of the reactor
+
+    Parameters
+    ----------
+    cycle_nums : list of int
+        The number of each cycle
+    startup_days : list of datetime.datetime
+        The startup of each cycle
+    shutdown_days : list of datetime.datetime
+        The shutdown of each cycle
+
+    Returns
+    -------
+    schedule : dict
+        CycleNums, StartupDays, ShutdownDays, MixedDays (the interleaved
+        startups and shutdowns) and UpperError (the index returned for times
+        past the schedule) as lists, plus MixedTimes and ShutdownTimes as
+        datetime64[us] arrays for the vectorized functions
+    """
+    mixed_days = list(sum(zip(startup_days, shutdown_days), ()))
+    if any(x >= y for x, y in zip(mixed_days[:-1], mixed_days[1:])):
+        raise ValueError("Schedule startups and shutdowns must alternate and"
+                         " be in increasing order")
+    return {"CycleNums": list(cycle_nums), "StartupDays": list(startup_days),
+            "ShutdownDays": list(shutdown_days), "MixedDays": mixed_days,
+            "UpperError": len(mixed_days),
+            "MixedTimes": np.array(mixed_days, dtype="datetime64[us]"),
+            "ShutdownTimes": np.array(shutdown_days,
+                                      dtype="datetime64[us]")}
+
+
+# the schedule used when none is passed to the functions below
+SCHEDULE = load_schedule()
+
+
+def set_schedule(schedule):
+    """Replaces the schedule used when none is passed to the functions
 
-#the mixed reactor starts and stops
-HFIR_MIXED_DAYS = list(sum(zip(HFIR_STARTUP_DAYS, HFIR_SHUTDOWN_DAYS), ()))
+    Parameters
+    ----------
+    schedule : dict
+        The schedule index, from load_schedule or make_schedule
+    """
+    global SCHEDULE
+    SCHEDULE = schedule
 
-#this should be equal to the length of whatever the longest array above is
-UPPER_ERROR = len(HFIR_MIXED_DAYS)
 
+def find_index(time, schedule=None):
+    """This finds the index of the last date in the interleaved date data that
+    time is *after*
 
-def find_range(batch_start, batch_stop):
+    Parameters
+    ----------
+    time : datetime.datetime
+        The time to look up
+    schedule : dict
+        The schedule index, SCHEDULE if None
+
+    Returns
+    -------
+    ind : int
+        The index of the last date that time is after, -1 if it is before
+        them all, and UpperError if it is after them all
+    """
+    schedule = SCHEDULE if schedule is None else schedule
+    ind = bisect.bisect_right(schedule["MixedDays"], time)
+    if ind == schedule["UpperError"]:
+        return ind
+    return ind - 1
+
+
+def find_range(batch_start, batch_stop, schedule=None):
     """This finds the last date in the interleaved date data where batch_start
     and batch stop are *after* that date
 
@@ -44,6 +146,8 @@ def find_range(batch_start, batch_stop):
         datetime of the start of the batch
     batch_stop : datetime.datetime
         datetime of the end of the batch
+    schedule : dict
+        The schedule index, SCHEDULE if None
 
     Returns
     -------
@@ -52,26 +156,63 @@ def find_range(batch_start, batch_stop):
     stop_ind : int
         The index of the last date that batch_stop is after
     """
-    start_test_list = [(batch_start < x) for x in HFIR_MIXED_DAYS]
-    stop_test_list = [(batch_stop < x) for x in HFIR_MIXED_DAYS]
-    start_ind = -2
-    for i, val in enumerate(start_test_list):
-        if val:
-            start_ind = i - 1
-            break
-    if start_ind == -2:
-        start_ind = UPPER_ERROR
-    stop_ind = -2
-    for i, val in enumerate(stop_test_list):
-        if val:
-            stop_ind = i - 1
-            break
-    if stop_ind == -2:
-        stop_ind = UPPER_ERROR
-    return (start_ind, stop_ind)
-
-
-def get_reactor_status(batch_start, batch_stop):
+    return (find_index(batch_start, schedule),
+            find_index(batch_stop, schedule))
+
+
+def get_reactor_state(batch_start, batch_stop, schedule=None):
+    """This function takes the batch start and stop and determines the reactor
+    status across that period and the cycle numbers at either end, looking the
+    batch up in the schedule only once
+
+    Parameters
+    ----------
+    batch_start : datetime.datetime
+        datetime of the start of the batch
+    batch_stop : datetime.datetime
+        datetime of the end of the batch
+    schedule : dict
+        The schedule index, SCHEDULE if None
+
+    Returns
+    -------
+    RxStatus : int
+        an integer representing the reactor status, see get_reactor_status
+    start_cycle : int
+        the cycle number at the start of the batch, None if unknown
+    stop_cycle : int
+        the cycle number at the end of the batch, None if unknown
+    """
+    schedule = SCHEDULE if schedule is None else schedule
+    (start_ind, stop_ind) = find_range(batch_start, batch_stop, schedule)
+    return (status_from_range(batch_start, batch_stop, start_ind, stop_ind,
+                              schedule),
+            cycle_from_index(start_ind, schedule),
+            cycle_from_index(stop_ind, schedule))
+
+
+def cycle_from_index(ind, schedule):
+    """Gets the cycle number for an index into the interleaved date data
+
+    Parameters
+    ----------
+    ind : int
+        The index from find_index
+    schedule : dict
+        The schedule index
+
+    Returns
+    -------
+    cycle : int
+        the number of the cycle that started at or before the index, None if
+        the index is outside the schedule
+    """
+    if ind < 0 or ind / 2 >= len(schedule["CycleNums"]):
+        return None
+    return schedule["CycleNums"][ind / 2]
+
+
+def get_reactor_status(batch_start, batch_stop, schedule=None):
     """This function takes the batch start and stop and determines the reactor
     status across that period.
 
@@ -81,6 +222,8 @@ def get_reactor_status(batch_start, batch_stop):
         datetime of the start of the batch
     batch_stop : datetime.datetime
         datetime of the end of the batch
+    schedule : dict
+        The schedule index, SCHEDULE if None
 
     Returns
     -------
@@ -91,39 +234,66 @@ def get_reactor_status(batch_start, batch_stop):
         2 - Reactor On
         3 - Reactor Transition On to Off
     """
+    schedule = SCHEDULE if schedule is None else schedule
+    (start_ind, stop_ind) = find_range(batch_start, batch_stop, schedule)
+    return status_from_range(batch_start, batch_stop, start_ind, stop_ind,
+                             schedule)
+
+
+def status_from_range(batch_start, batch_stop, start_ind, stop_ind, schedule):
+    """This function determines the reactor status across a batch from the
+    indices returned by find_range
+
+    Parameters
+    ----------
+    batch_start : datetime.datetime
+        datetime of the start of the batch
+    batch_stop : datetime.datetime
+        datetime of the end of the batch
+    start_ind : int
+        The index of the last date that batch_start is after
+    stop_ind : int
+        The index of the last date that batch_stop is after
+    schedule : dict
+        The schedule index
+
+    Returns
+    -------
+    RxStatus : int
+        an integer representing the reactor status, see get_reactor_status
+    """
+    mixed_days = schedule["MixedDays"]
     # handle stupid error
     if batch_start >= batch_stop:
         print "Error: batch start is either the same as or later than batch_stop"
         return None
-    (start_ind, stop_ind) = find_range(batch_start, batch_stop)
     # handle error cases
     if (stop_ind - start_ind) > 1:
         print "Error: batch start and stop span a reactor turn on and off"
         return None
-    if start_ind >= UPPER_ERROR:
+    if start_ind >= schedule["UpperError"]:
         print "Error: both start and stop time are past the known cycle times"
-        print "    Expand the time listings in odbblib/schedule.py"
-        print "      HFIR_STARTUP_DAYS and HFIR_SHUTDOWN_DAYS"
+        print "    Expand the cycle listings in the schedule file"
         return None
     if stop_ind == -1:
         print "Error: both start and stop time are before the known cycle times"
-        print "    Expand the time listings in odbblib/schedule.py"
-        print "      HFIR_STARTUP_DAYS and HFIR_SHUTDOWN_DAYS"
+        print "    Expand the cycle listings in the schedule file"
         return None
     bstart = batch_start.date()
     bstop = batch_stop.date()
-    if (bstart == HFIR_MIXED_DAYS[start_ind].date() and
-            bstop == HFIR_MIXED_DAYS[stop_ind].date()):
+    if (bstart == mixed_days[start_ind].date() and
+            bstop == mixed_days[stop_ind].date()):
         print "Error: batch start and stop span a reactor turn on and off"
         return None
     # handle the cases that are not errors
     ret_val = 3
-    if bstart == HFIR_MIXED_DAYS[start_ind].date() and start_ind%2 == 1:
+    if bstart == mixed_days[start_ind].date() and start_ind%2 == 1:
         ret_val = 3
     elif stop_ind == start_ind:
-        if bstart == HFIR_MIXED_DAYS[start_ind].date() and (start_ind%2) == 0:
+        if bstart == mixed_days[start_ind].date() and (start_ind%2) == 0:
             ret_val = 1
-        elif bstop == HFIR_MIXED_DAYS[stop_ind+1].date() and (start_ind%2) == 1:
+        elif (stop_ind + 1 < len(mixed_days) and
+              bstop == mixed_days[stop_ind+1].date() and (start_ind%2) == 1):
             ret_val = 1
         elif (stop_ind%2) == 1:
             ret_val = 0
@@ -134,7 +304,7 @@ def get_reactor_status(batch_start, batch_stop):
     return ret_val
 
 
-def get_previous_shutdown(reference):
+def get_previous_shutdown(reference, schedule=None):
     """This function takes a reference date time and finds the most recent
     reactor shutdown date that occurred before it
 
@@ -142,19 +312,22 @@ def get_previous_shutdown(reference):
     ----------
     reference : datetime.datetime
         The time to be compared against
+    schedule : dict
+        The schedule index, SCHEDULE if None
 
     Returns
     -------
     last_shutdown : datetime.datetime
         The most recent reactor shutdown date to occur before reference
     """
-    for check in reversed(HFIR_SHUTDOWN_DAYS):
-        if check < reference:
-            return check
-    return None
+    schedule = SCHEDULE if schedule is None else schedule
+    ind = bisect.bisect_left(schedule["ShutdownDays"], reference)
+    if ind == 0:
+        return None
+    return schedule["ShutdownDays"][ind - 1]
 
 
-def get_reactor_status_name(batch_start, batch_stop):
+def get_reactor_status_name(batch_start, batch_stop, schedule=None):
     """This function takes the batch start and stop and determines the reactor
     status across that period, returning a name for that status
 
@@ -164,16 +337,19 @@ def get_reactor_status_name(batch_start, batch_stop):
         datetime of the start of the batch
     batch_stop : datetime.datetime
         datetime of the end of the batch
+    schedule : dict
+        The schedule index, SCHEDULE if None
 
     Returns
     -------
     RxStatus : str
         a string representing the reactor status
     """
-    return CYCLE_STATUS_NAMES[get_reactor_status(batch_start, batch_stop)]
+    return CYCLE_STATUS_NAMES[get_reactor_status(batch_start, batch_stop,
+                                                 schedule)]
 
 
-def get_reactor_cycles(batch_start, batch_stop):
+def get_reactor_cycles(batch_start, batch_stop, schedule=None):
     """This function takes the batch start and stop and determines the reactor
     cycle number at the start and end of the batch
 
@@ -183,13 +359,99 @@ def get_reactor_cycles(batch_start, batch_stop):
         datetime of the start of the batch
     batch_stop : datetime.datetime
         datetime of the end of the batch
+    schedule : dict
+        The schedule index, SCHEDULE if None
 
     Returns
     -------
     start_cycle : int
-        the cycle number at the start of the batch
+        the cycle number at the start of the batch, None if unknown
     stop_cycle : int
-        the cycle number at the end of the batch
+        the cycle number at the end of the batch, None if unknown
+    """
+    schedule = SCHEDULE if schedule is None else schedule
+    (start_ind, stop_ind) = find_range(batch_start, batch_stop, schedule)
+    return (cycle_from_index(start_ind, schedule),
+            cycle_from_index(stop_ind, schedule))
+
+
+def find_indices(times, schedule=None):
+    """Vectorized find_index
+
+    Parameters
+    ----------
+    times : array like of datetime64
+        The times to look up
+    schedule : dict
+        The schedule index, SCHEDULE if None
+
+    Returns
+    -------
+    inds : numpy.ndarray
+        For each time, the index of the last date it is after, -1 if it is
+        before them all, and UpperError if it is after them all
+    """
+    schedule = SCHEDULE if schedule is None else schedule
+    times = np.asarray(times, dtype="datetime64[us]")
+    inds = np.searchsorted(schedule["MixedTimes"], times, side="right")
+    return np.where(inds == schedule["UpperError"], inds, inds - 1)
+
+
+def classify_runs(start_times, stop_times, schedule=None):
+    """Determines the reactor status, cycle numbers, and the time since the
+    last shutdown of every run in one pass
+
+    Unlike get_reactor_status, which works in whole days for batches, the
+    runs are placed against the exact startup and shutdown times, a run is
+    off or on if it is entirely between them, and is a startup or shutdown
+    only if it straddles one
+
+    Parameters
+    ----------
+    start_times : array like of datetime64
+        The start of each run
+    stop_times : array like of datetime64
+        The stop of each run
+    schedule : dict
+        The schedule index, SCHEDULE if None
+
+    Returns
+    -------
+    run_status : dict
+        StatusNum, StartCycleNum, and StopCycleNum integer arrays, with
+        UNKNOWN_VALUE where the schedule cannot answer, and HoursSinceShutdown,
+        the hours from the previous shutdown to the run start (nan if there is
+        none)
     """
-    (start_ind, stop_ind) = find_range(batch_start, batch_stop)
-    return (HFIR_CYCLE_NUM[start_ind/2], HFIR_CYCLE_NUM[stop_ind/2])
+    schedule = SCHEDULE if schedule is None else schedule
+    starts = np.asarray(start_times, dtype="datetime64[us]")
+    stops = np.asarray(stop_times, dtype="datetime64[us]")
+    start_inds = find_indices(starts, schedule)
+    stop_inds = find_indices(stops, schedule)
+    # runs that straddle more than one startup or shutdown, or that are
+    # outside the schedule, cannot be placed
+    valid = ((starts < stops) & ((stop_inds - start_inds) <= 1) &
+             (start_inds < schedule["UpperError"]) & (stop_inds != -1))
+    # even indices follow a startup and odd ones a shutdown, so a run within
+    # one interval is on or off, and one that crosses into an even index
+    # straddles a startup, into an odd index a shutdown
+    odd_stop = (stop_inds % 2) == 1
+    status = np.where(stop_inds == start_inds, np.where(odd_stop, 0, 2),
+                      np.where(odd_stop, 3, 1))
+    cycles = np.append(np.array(schedule["CycleNums"], dtype=np.int64),
+                       UNKNOWN_VALUE)
+    num_cycles = len(schedule["CycleNums"])
+    start_cycles = np.where((start_inds >= 0) & (start_inds / 2 < num_cycles),
+                            start_inds / 2, num_cycles)
+    stop_cycles = np.where((stop_inds >= 0) & (stop_inds / 2 < num_cycles),
+                           stop_inds / 2, num_cycles)
+    # most recent shutdown strictly before each run start
+    shut_inds = np.searchsorted(schedule["ShutdownTimes"], starts, side="left")
+    since_us = (starts.astype(np.int64) - schedule["ShutdownTimes"][
+        np.maximum(shut_inds - 1, 0)].astype(np.int64))
+    return {"StatusNum": np.where(valid, status, UNKNOWN_VALUE),
+            "StartCycleNum": cycles[start_cycles],
+            "StopCycleNum": cycles[stop_cycles],
+            "HoursSinceShutdown": np.where(shut_inds > 0,
+                                           since_us / MICRO_SEC_PER_HOUR,
+                                           np.nan)}
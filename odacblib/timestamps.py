@@ -0,0 +1,232 @@
+"""Functions to decode the fixed format time stamps written by ORCHID reader
+and to cross check them against the epoch microsecond columns that sit next to
+them in the csv files"""
+import datetime as dt
+import numpy as np
+
+ORCHID_TIME_FORMAT = "%Y-%b-%d %H:%M:%S.%f"
+
+MONTH_NUMS = {"Jan": 1, "Feb": 2, "Mar": 3, "Apr": 4, "May": 5, "Jun": 6,
+              "Jul": 7, "Aug": 8, "Sep": 9, "Oct": 10, "Nov": 11, "Dec": 12}
+
+EPOCH = dt.datetime(1970, 1, 1)
+
+# lengths of the time stamps with and without the fractional seconds
+# i.e. "2017-Jun-13 07:58:00" and "2017-Jun-13 07:58:00.123456"
+SHORT_TIME_LEN = 20
+FULL_TIME_LEN = 27
+
+# maximum allowed disagreement between the decoded string and the epoch column
+# once the (constant) offset between the two clocks has been removed
+TIME_TOLERANCE_US = 1
+
+# cache of the decoded "YYYY-Mon-DD" prefixes, a batch only spans a few days so
+# this stays small
+DATE_CACHE = {}
+
+
+def parse_orchid_time(text):
+    """Decodes a single ORCHID time stamp, this is equivalent to calling
+    datetime.strptime(text, ORCHID_TIME_FORMAT) but considerably faster
+
+    Parameters
+    ----------
+    text : str
+        The time stamp, "2017-Jun-13 07:58:00.123456"
+
+    Returns
+    -------
+    time : datetime.datetime
+        The decoded time stamp
+    """
+    text = text.strip()
+    if (len(text) not in [SHORT_TIME_LEN, FULL_TIME_LEN] or
+            text[4] != "-" or text[8] != "-" or text[11] != " "):
+        # not the layout we expect, let strptime sort it out (or complain)
+        return dt.datetime.strptime(text, ORCHID_TIME_FORMAT)
+    date = DATE_CACHE.get(text[:11])
+    if date is None:
+        date = dt.date(int(text[0:4]), MONTH_NUMS[text[5:8]],
+                       int(text[9:11]))
+        DATE_CACHE[text[:11]] = date
+    micro = 0
+    if len(text) == FULL_TIME_LEN:
+        micro = int(text[21:27])
+    return dt.datetime(date.year, date.month, date.day, int(text[12:14]),
+                       int(text[15:17]), int(text[18:20]), micro)
+
+
+def parse_orchid_times(texts):
+    """Decodes an array of ORCHID time stamps in one vectorized pass
+
+    Parameters
+    ----------
+    texts : array like of str
+        The time stamps, "2017-Jun-13 07:58:00.123456"
+
+    Returns
+    -------
+    times : numpy.ndarray
+        datetime64[us] array of the decoded time stamps
+    """
+    texts = np.char.strip(np.asarray(texts, dtype=np.string_))
+    if texts.size == 0:
+        return np.zeros(texts.shape, dtype="datetime64[us]")
+    lens = np.char.str_len(texts)
+    texts = np.where(lens == SHORT_TIME_LEN, np.char.add(texts, ".000000"),
+                     texts)
+    if not np.all((lens == SHORT_TIME_LEN) | (lens == FULL_TIME_LEN)):
+        # odd layouts, fall back to decoding them one by one
+        return np.array([parse_orchid_time(x) for x in texts.ravel()],
+                        dtype="datetime64[us]").reshape(texts.shape)
+    chars = texts.astype("S27").ravel().view("S1").reshape((-1, 27))
+    months, inv = np.unique(chars[:, 5:8].copy().view("S3").ravel(),
+                            return_inverse=True)
+    month_strs = np.array(["{0:02d}".format(MONTH_NUMS[x]) for x in months],
+                          dtype="S2")
+    month_chars = month_strs[inv].view("S1").reshape((-1, 2))
+    # rebuild the stamps as ISO 8601 which numpy can convert directly
+    iso = np.empty((chars.shape[0], 26), dtype="S1")
+    iso[:, 0:5] = chars[:, 0:5]
+    iso[:, 5:7] = month_chars
+    iso[:, 7:] = chars[:, 8:]
+    iso[:, 10] = "T"
+    times = iso.view("S26").ravel().astype("datetime64[us]")
+    return times.reshape(texts.shape)
+
+
+def epoch_us_to_datetime(epoch_us):
+    """Converts a microsecond epoch time to a datetime
+
+    Parameters
+    ----------
+    epoch_us : int
+        microseconds since the unix epoch
+
+    Returns
+    -------
+    time : datetime.datetime
+        the equivalent (naive) datetime
+    """
+    return EPOCH + dt.timedelta(microseconds=epoch_us)
+
+
+def datetime_to_epoch_us(time):
+    """Converts a datetime to a microsecond epoch time
+
+    Parameters
+    ----------
+    time : datetime.datetime
+        a (naive) datetime
+
+    Returns
+    -------
+    epoch_us : int
+        microseconds since the unix epoch
+    """
+    delta = time - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def epoch_us_to_datetime64(epoch_us, offset_us=0):
+    """Converts an array of microsecond epoch times to datetime64[us]
+
+    Parameters
+    ----------
+    epoch_us : array like of int
+        microseconds since the unix epoch
+    offset_us : int
+        offset in microseconds to add, for instance the offset between the
+        local time stamps and the epoch column returned by check_times
+
+    Returns
+    -------
+    times : numpy.ndarray
+        datetime64[us] array of the times
+    """
+    epoch_us = np.asarray(epoch_us, dtype=np.int64)
+    return (epoch_us + offset_us).astype("datetime64[us]")
+
+
+def datetime64_to_str(times):
+    """Formats datetime64[us] values the same way str(datetime) does, which is
+    how date times have always been stored in the databases
+
+    Parameters
+    ----------
+    times : numpy.ndarray
+        datetime64[us] array of times
+
+    Returns
+    -------
+    time_strs : list of str
+        "2017-06-13 07:58:00.123456", or "2017-06-13 07:58:00" if the
+        microseconds are zero
+    """
+    full = np.char.replace(np.datetime_as_string(times, unit="us"), "T", " ")
+    whole = (times.astype(np.int64) % 1000000) == 0
+    return np.where(whole, full.astype("S19"), full).tolist()
+
+
+def check_times(times, epoch_us, tolerance_us=TIME_TOLERANCE_US):
+    """Compares decoded time stamps against the epoch microsecond column
+
+    Parameters
+    ----------
+    times : numpy.ndarray
+        datetime64[us] array of decoded time stamps
+    epoch_us : array like of int
+        the epoch microsecond values written alongside the time stamps
+    tolerance_us : int
+        the allowed disagreement after removing the offset of the first entry
+
+    Returns
+    -------
+    offset_us : int
+        offset of the time stamp clock relative to the epoch clock, taken from
+        the first entry (nonzero if the time stamps are in local time)
+    bad_inds : numpy.ndarray
+        indices of the entries that disagree with the epoch column
+    """
+    if len(times) == 0:
+        return 0, np.zeros(0, dtype=np.int64)
+    diff = times.astype(np.int64) - np.asarray(epoch_us, dtype=np.int64)
+    offset_us = int(diff[0])
+    bad_inds = np.nonzero(np.abs(diff - offset_us) > tolerance_us)[0]
+    return offset_us, bad_inds
+
+
+def decode_time_column(texts, epoch_us, from_epoch=False):
+    """Produces the datetime64[us] array for a time stamp column, checking it
+    against the matching epoch microsecond column
+
+    Parameters
+    ----------
+    texts : array like of str
+        The time stamp column
+    epoch_us : array like of int
+        The matching epoch microsecond column
+    from_epoch : bool
+        If True only the first and last time stamps are decoded, the rest are
+        derived from the epoch column, otherwise every time stamp is decoded
+        and checked against the epoch column
+
+    Returns
+    -------
+    times : numpy.ndarray
+        datetime64[us] array of the times
+    """
+    epoch_us = np.asarray(epoch_us, dtype=np.int64)
+    if from_epoch and len(epoch_us) > 1:
+        ends = parse_orchid_times([texts[0], texts[-1]])
+        offset_us, bad_inds = check_times(ends, epoch_us[[0, -1]])
+        if len(bad_inds) == 0:
+            return epoch_us_to_datetime64(epoch_us, offset_us)
+        print "Warning: time stamp offset drifts across the file, decoding"\
+            " every time stamp instead"
+    times = parse_orchid_times(texts)
+    _, bad_inds = check_times(times, epoch_us)
+    if len(bad_inds) != 0:
+        print "Warning: {0:d} time stamps disagree with the epoch column,"\
+            " first at entry {1:d}".format(len(bad_inds), bad_inds[0])
+    return times
@@ -4,56 +4,782 @@ csv files into the appropriate databases and determines reactor cycle (so that
 the appropriate calibration lines can be chosen and used)"""
 import sys
 import os
+import argparse
+import sqlite3 as sql
 from odacblib import readrawdata as rrd
 from odacblib import databaseops as dbops
+from odacblib import dbmaint as dbm
+from odacblib import batchdb as bdb
 from odacblib import input_sanitizer as ins
 from odacblib import fuzzy_logic as fl
-from odacblib import rootops as ro
+from odacblib import batchscan as bscan
+from odacblib import schedule as sch
+from odacblib import manifest as mfst
+from odacblib import instrument as inst
+from odacblib import runindex as ri
+from odacblib import lazyimport as lazy
+
+# only the calibration stages need root and scipy, so incremental builds and
+# the batch table updates never import them
+ro = lazy.lazy_module("odacblib.rootops")
+cf = lazy.lazy_module("odacblib.calfit")
 
 # BATCH_DB_LOCATION = "/data1/prospect/ProcessedData/OrchidAnalysis/batchDatabase.db"
 BATCH_DB_LOCATION = "/home/jmatta1/test_data/batchDatabase.db"
 
 
+# the stages timed for each batch in the multi batch summary
+STAGE_NAMES = ["Parse", "RunDb", "RunIndex", "SumRanges", "CalPrep",
+               "CalFit"]
+
+# how the block calibrations are carried over to the individual runs
+CAL_DRIFT_MODES = ["interpolate", "block"]
+
+
 def main():
     """This function is the main entry point for the program"""
-    if not len(sys.argv) in [2, 3]:
-        print USAGE_INFO.format(sys.argv[0])
-        sys.exit()
-    batch_db_path = BATCH_DB_LOCATION
-    if len(sys.argv) == 3:
-        batch_db_path = sys.argv[2]
-    batch_data_location = sys.argv[1]
-    print "Setting batch database path to:", batch_db_path
-    print "Setting batch location to:", batch_data_location
+    args = parse_args(sys.argv[1:])
+    apply_policies(args)
+    apply_rate_settings(args)
+    if args.schedule_file is not None:
+        sch.set_schedule(sch.load_schedule(args.schedule_file))
+    print "Setting batch database path to:", args.batch_database_path
+    try:
+        if bscan.is_multi_batch(args.batch_info_file):
+            process_many_batches(args)
+        else:
+            process_single_batch(args)
+    finally:
+        bdb.close_all()
+
+
+def process_single_batch(args):
+    """Processes the single batch given on the command line
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        the parsed command line arguments
+    """
+    print "Setting batch location to:", args.batch_info_file
+    batch_data = read_batch_info(args.batch_info_file)
+    handle_batch_data(batch_data, args.batch_database_path, args)
+    writes = None
+    try:
+        writes = build_batch(batch_data, args)[1]
+    finally:
+        write_batch_updates(batch_data, writes, args.batch_database_path)
+
+
+def process_many_batches(args):
+    """Processes every batch found below a directory or matching a glob, the
+    global batch database is written from this process over one connection
+    while the run databases and calibration files are built in a pool of
+    worker processes
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        the parsed command line arguments
+    """
+    batch_files = bscan.find_batch_files(args.batch_info_file,
+                                         args.batch_pattern)
+    print "Found {0:d} batches in: {1:s}".format(len(batch_files),
+                                                 args.batch_info_file)
+    summary = []
+    batch_list = []
+    dbcon = dbops.open_batch_database(args.batch_database_path)
+    # when every existing entry is to be overwritten the batches are upserted
+    # together instead of being checked one at a time, set_policy has already
+    # converted the answer to the option number
+    upsert = (ins.POLICY.get("batch_table") ==
+              dbops.EXISTS_CHOICES["overwrite"])
+    for batch_file in batch_files:
+        print "\nReading batch:", batch_file
+        try:
+            batch_data = read_batch_info(batch_file)
+        except (IOError, ValueError, IndexError) as err:
+            print "Could not read {0:s}: {1:s}".format(batch_file, str(err))
+            summary.append((batch_file, {}, str(err)))
+            continue
+        if not upsert:
+            handle_batch_data(batch_data, args.batch_database_path, args,
+                              dbcon)
+        batch_list.append(batch_data)
+    if upsert and batch_list:
+        dbops.upsert_batch_data(batch_list, args.batch_database_path, dbcon)
+        print "Wrote {0:d} batches to global batch database".format(
+            len(batch_list))
+        for batch_data in batch_list:
+            manifest = mfst.load_manifest(batch_data["ManifestLoc"])
+            mfst.record_stage(manifest, "BatchTable", batch_table_key(
+                manifest, batch_data, args.batch_database_path), [])
+            mfst.save_manifest(manifest, batch_data["ManifestLoc"])
+    bdb.with_retry(dbm.maintain_database, dbcon.cursor(), args.vacuum,
+                   args.vacuum_threshold)
+    bdb.close_connection(args.batch_database_path)
+    # the batch workers cannot start pools of their own
+    args.cal_processes = 1
+    tasks = [(batch_data, args) for batch_data in batch_list]
+    dbcon = None
+    for task, result, error in bscan.run_tasks(build_batch_task, tasks,
+                                               args.processes):
+        name = task[0]["BatchName"]
+        timings, writes = {}, None
+        if error is not None:
+            print "Batch {0:s} failed:\n{1:s}".format(name, error)
+        else:
+            timings, writes = result
+        # the pool has started by the first result, so the connection is
+        # never inherited by the workers
+        if dbcon is None:
+            dbcon = ri.open_run_index(args.batch_database_path)
+        write_batch_updates(task[0], writes, args.batch_database_path,
+                            dbcon)
+        summary.append((name, timings, error))
+    bscan.print_summary(summary, STAGE_NAMES)
+
+
+def read_batch_info(batch_info_file):
+    """Reads the batch information file and generates the paths of the
+    outputs for the batch
+
+    Parameters
+    ----------
+    batch_info_file : str
+        path to the batch information csv
+
+    Returns
+    -------
+    batch_data : dict
+        dictionary of batch information
+    """
     # read the raw batch data
-    batch_data = rrd.read_batch_data(batch_data_location)
+    batch_data = rrd.read_batch_data(batch_info_file)
     # generate the paths for various things
-    base, _ = os.path.split(batch_data_location)
+    base, _ = os.path.split(batch_info_file)
     batch_data["RunDbLoc"] = os.path.join(base, "runDatabase.db")
     batch_data["CalRootLoc"] = os.path.join(base, "cal_hists.root")
     batch_data["DecompRootLoc"] = os.path.join(base, "decomp_hists.root")
-    handle_batch_data(batch_data, batch_db_path)
-    # read the detector metadata
-    det_data = rrd.read_det_data(batch_data["DetDataLocation"])
-    # read the run data
-    run_data = rrd.read_run_data(batch_data["RunDataLocation"], det_data)
-    # break the run data into more useful format
-    run_info = [x[0] for x in run_data]
-    det_run_data = [[x[ind] for x in run_data] for ind in
-                    range(1, len(run_data[0]))]
-    # attempt to put the data into the run database
-    dbops.make_batch_database(batch_data["RunDbLoc"], det_data, run_info, det_run_data)
-    # figure out if we need to produce multiple sums
-    summing_lists = fl.find_sum_ranges(run_info, det_run_data,
-                                       batch_data["RootFileLocation"])
-    # call the function to setup the calibration root file. it will determine
-    # if re-summing is required or if we can simply use the existing sum
-    # spectra that were generated
-    ro.prep_calibration_file(summing_lists, batch_data["RootFileLocation"],
-                             batch_data["CalRootLoc"], det_data, len(run_info))
-
-
-def handle_batch_data(batch_data, batch_db_path):
+    batch_data["BatchInfoLoc"] = batch_info_file
+    batch_data["ManifestLoc"] = os.path.join(base, mfst.MANIFEST_NAME)
+    batch_data["ReportLoc"] = os.path.join(base, inst.REPORT_NAME)
+    return batch_data
+
+
+def build_batch_task(task):
+    """Wrapper of build_batch for bscan.run_tasks
+
+    Parameters
+    ----------
+    task : tuple
+        the batch data dictionary and the parsed command line arguments
+
+    Returns
+    -------
+    timings : dict
+        the time in seconds spent in each of STAGE_NAMES
+    writes : dict
+        the writes the batch needs in the global batch database, see
+        make_batch_writes
+    """
+    return build_batch(task[0], task[1])
+
+
+def build_batch(batch_data, args):
+    """Builds the run database and the calibration file of a batch, and
+    writes the instrumentation report of the build next to the batch, the
+    global batch database is only read, what it needs is returned for the
+    caller to write, see write_batch_updates
+
+    Parameters
+    ----------
+    batch_data : dict
+        dictionary of batch information
+    args : argparse.Namespace
+        the parsed command line arguments
+
+    Returns
+    -------
+    timings : dict
+        the time in seconds spent in each of STAGE_NAMES
+    writes : dict
+        the writes the batch needs in the global batch database, see
+        make_batch_writes
+    """
+    writes = make_batch_writes()
+    inst.start_report(batch_data["BatchName"])
+    try:
+        # read the detector metadata
+        det_data = rrd.read_det_data(batch_data["DetDataLocation"])
+        state = None
+        if args.incremental:
+            state = get_ingest_state(batch_data["RunDbLoc"],
+                                     batch_data["RunDataLocation"])
+        if state is not None:
+            append_batch(batch_data, det_data, state, args, writes)
+        else:
+            build_stages(batch_data, det_data, args, writes)
+    finally:
+        inst.write_report(batch_data["ReportLoc"])
+    return inst.stage_times(STAGE_NAMES), writes
+
+
+def make_batch_writes():
+    """Makes the record of what the build of a batch needs written to the
+    global batch database, the builds fill it in and the process that
+    writes the batch table writes it
+
+    Returns
+    -------
+    writes : dict
+        RunIntervals (the runs to add to the run index, see
+        ri.read_run_intervals, None to leave the index alone), IndexAfterRun
+        (the run number the intervals follow, None if they replace the runs
+        of the batch) and Calibrated (True to mark the batch calibrated)
+    """
+    return {"RunIntervals": None, "IndexAfterRun": None, "Calibrated": False}
+
+
+def write_batch_updates(batch_data, writes, db_loc, dbcon=None):
+    """Writes what the build of a batch needs to the global batch database
+
+    Parameters
+    ----------
+    batch_data : dict
+        dictionary of batch information
+    writes : dict
+        see make_batch_writes, None if the build failed, then the runs of the
+        batch are indexed again from its run database, as it may have been
+        rebuilt before the failure
+    db_loc : str
+        path to the batch database file
+    dbcon : sqlite database connection
+        An already open connection to the batch database, see
+        ri.open_run_index, if None this process's connection to the database
+        at db_loc is used
+    """
+    if dbcon is None:
+        dbcon = ri.open_run_index(db_loc)
+    if writes is None:
+        writes = make_batch_writes()
+        if os.path.exists(batch_data["RunDbLoc"]):
+            try:
+                writes["RunIntervals"] = ri.read_run_intervals(
+                    batch_data["RunDbLoc"])
+            except sql.Error as err:
+                print "Could not index the runs of {0:s}: {1:s}".format(
+                    batch_data["BatchName"], str(err))
+    if writes["RunIntervals"] is not None:
+        ri.write_run_intervals(db_loc, batch_data["BatchName"],
+                               writes["RunIntervals"], writes["IndexAfterRun"],
+                               dbcon)
+    if writes["Calibrated"]:
+        dbops.mark_batch_calibrated(batch_data["BatchName"], db_loc, dbcon)
+
+
+def build_stages(batch_data, det_data, args, writes):
+    """Runs the build stages of a batch, skipping the stages whose inputs are
+    unchanged since the build manifest recorded them
+
+    Parameters
+    ----------
+    batch_data : dict
+        dictionary of batch information
+    det_data : list of dict
+        list of dictionary of the detector data
+    args : argparse.Namespace
+        the parsed command line arguments
+    writes : dict
+        the writes the batch needs in the global batch database, see
+        make_batch_writes
+    """
+    run_csv = batch_data["RunDataLocation"]
+    manifest = mfst.load_manifest(batch_data["ManifestLoc"])
+    # incremental builds of a live batch are never reused
+    use_cache = not (args.rebuild or args.incremental)
+    csv_files = [batch_data["BatchInfoLoc"], run_csv,
+                 batch_data["DetDataLocation"]]
+    run_cols = None
+    # the run database holds the per run reactor state from the schedule
+    db_key = mfst.stage_key(manifest,
+                            csv_files + [args.schedule_file or
+                                         sch.SCHEDULE_PATH],
+                            ["RunDb", args.det_run_layout])
+    if use_cache and mfst.stage_is_current(manifest, "RunDb", db_key):
+        print "Run database is up to date, skipping it"
+        # batches built before the run index existed are added to it now
+        if not ri.batch_is_indexed(args.batch_database_path,
+                                   batch_data["BatchName"]):
+            index_runs(batch_data, writes)
+    else:
+        # read the run data, in incremental mode the batch may still be
+        # written
+        if args.chunk_lines > 0:
+            # stream the run data into the database, keeping only what the
+            # sum ranges need, parsing is timed inside the database stage
+            summary = []
+            state = {"RunDataLocation": run_csv, "LastRunNum": None,
+                     "FileOffset": 0, "FileSize": os.path.getsize(run_csv)}
+            chunks = stream_run_chunks(run_csv, det_data, args.rate_det,
+                                       args.chunk_lines,
+                                       not args.incremental, summary, state,
+                                       profile_path(batch_data, args,
+                                                    "Parse"))
+        else:
+            with inst.stage("Parse", profile_path(batch_data, args,
+                                                  "Parse")):
+                run_cols, offset, size = rrd.read_run_tail(
+                    run_csv, det_data, 0, complete=not args.incremental)
+                inst.count("CsvBytes", offset)
+            chunks = run_cols
+            state = make_ingest_state(run_csv, run_cols, offset, size)
+        # attempt to put the data into the run database
+        with inst.stage("RunDb", profile_path(batch_data, args, "RunDb")):
+            dbops.make_batch_database(batch_data["RunDbLoc"], det_data,
+                                      chunks, args.det_run_layout,
+                                      args.vacuum, args.vacuum_threshold,
+                                      state)
+            inst.count("DbBytes", os.path.getsize(batch_data["RunDbLoc"]))
+        index_runs(batch_data, writes)
+        if run_cols is None:
+            run_cols = rrd.concat_run_columns(summary, det_data)
+        if args.incremental:
+            mfst.invalidate_stage(manifest, "RunDb")
+        else:
+            mfst.record_stage(manifest, "RunDb", db_key,
+                              [batch_data["RunDbLoc"]])
+        mfst.save_manifest(manifest, batch_data["ManifestLoc"])
+    if args.incremental:
+        print "Incremental mode, the calibration file is prepared once the "\
+            "batch is complete and rebuilt without --incremental"
+        return
+    range_key = mfst.stage_key(
+        manifest, csv_files + [batch_data["RootFileLocation"],
+                               args.schedule_file or sch.SCHEDULE_PATH],
+        ["SumRanges", args.rate_det,
+         fl.get_thresholds(fl.STARTUP_THRESHOLDS, args.rate_det),
+         fl.get_thresholds(fl.SHUTDOWN_THRESHOLDS, args.rate_det)])
+    if use_cache and mfst.stage_is_current(manifest, "SumRanges", range_key):
+        print "Calibration sum ranges are up to date, reusing them"
+        result = mfst.get_stage_result(manifest, "SumRanges")
+    else:
+        if run_cols is None:
+            with inst.stage("Parse", profile_path(batch_data, args,
+                                                  "Parse")):
+                run_cols = rrd.read_run_summary(run_csv, det_data,
+                                                [args.rate_det],
+                                                args.chunk_lines or
+                                                rrd.RUN_CHUNK_LINES)
+        with inst.stage("SumRanges", profile_path(batch_data, args,
+                                                  "SumRanges")):
+            # break the run data into more useful format
+            run_info = rrd.run_info_view(run_cols)
+            det_run_data = rrd.det_run_view(run_cols)
+            # figure out if we need to produce multiple sums
+            result = {"SumRanges": fl.find_sum_ranges(
+                run_info, det_run_data, batch_data["RootFileLocation"],
+                args.rate_det),
+                      "NumRuns": len(run_info)}
+            inst.count("RunRows", len(run_info))
+        mfst.record_stage(manifest, "SumRanges", range_key, [], result)
+        mfst.save_manifest(manifest, batch_data["ManifestLoc"])
+    # the manifest holds the ranges as lists
+    summing_lists = [tuple(x) for x in result["SumRanges"]]
+    cal_key = mfst.stage_key(manifest, [batch_data["RootFileLocation"],
+                                        batch_data["DetDataLocation"]],
+                             ["CalPrep", result])
+    if use_cache and mfst.stage_is_current(manifest, "CalPrep", cal_key):
+        print "Calibration file is up to date, skipping it"
+    else:
+        # call the function to setup the calibration root file. it will
+        # determine if re-summing is required or if we can simply use the
+        # existing sum spectra that were generated
+        with inst.stage("CalPrep", profile_path(batch_data, args,
+                                                "CalPrep")):
+            ro.prep_calibration_file(summing_lists,
+                                     batch_data["RootFileLocation"],
+                                     batch_data["CalRootLoc"], det_data,
+                                     result["NumRuns"], args.cal_processes)
+        mfst.record_stage(manifest, "CalPrep", cal_key,
+                          [batch_data["CalRootLoc"]])
+        mfst.save_manifest(manifest, batch_data["ManifestLoc"])
+    # the fits are redone whenever the run database is rebuilt
+    fit_key = mfst.stage_key(manifest, [batch_data["CalRootLoc"]],
+                             ["CalFit", db_key, result, args.cal_drift])
+    if use_cache and mfst.stage_is_current(manifest, "CalFit", fit_key):
+        print "Calibration fits are up to date, skipping them"
+        # batches fit before the flag was kept are marked now
+        writes["Calibrated"] = True
+        return
+    with inst.stage("CalFit", profile_path(batch_data, args, "CalFit")):
+        fits = ro.get_sum_cal_fits(summing_lists, batch_data["CalRootLoc"],
+                                   det_data, args.cal_processes)
+        if args.cal_drift == "block":
+            dbops.write_block_calibrations(batch_data["RunDbLoc"],
+                                           summing_lists, fits)
+        else:
+            write_run_calibrations(batch_data["RunDbLoc"], summing_lists,
+                                   fits, [x["DetNum"] for x in det_data])
+    writes["Calibrated"] = True
+    mfst.record_stage(manifest, "CalFit", fit_key, [batch_data["RunDbLoc"]])
+    # the fits changed the run database, which is not a reason to rebuild it
+    mfst.refresh_outputs(manifest, "RunDb")
+    mfst.save_manifest(manifest, batch_data["ManifestLoc"])
+
+
+def profile_path(batch_data, args, stage):
+    """Gets where the profile of a stage goes, if it is to be profiled
+
+    Parameters
+    ----------
+    batch_data : dict
+        dictionary of batch information
+    args : argparse.Namespace
+        the parsed command line arguments
+    stage : str
+        one of STAGE_NAMES
+
+    Returns
+    -------
+    path : str
+        the path of the cProfile output, None if the stage is not profiled
+    """
+    if args.profile != stage:
+        return None
+    return os.path.join(os.path.dirname(batch_data["ReportLoc"]),
+                        inst.PROFILE_FMT.format(stage))
+
+
+def write_run_calibrations(run_db_path, runs, fits, det_nums):
+    """Interpolates the block calibrations to every run and writes them to
+    the run database
+
+    Parameters
+    ----------
+    run_db_path : str
+        path to the run database of the batch
+    runs : list of tuples
+        list of tuples where each tuple has the start run, the stop run,
+        the gamma-ray list for calibration, and the "kind" of calibration
+    fits : dict
+        The calibration of each detector and block, see
+        cf.fit_calibrations
+    det_nums : list of int
+        The detector numbers
+    """
+    run_nums, center_times = dbops.read_run_times(run_db_path)
+    run_params = cf.interpolate_run_calibrations(
+        cf.block_center_times(run_nums, center_times, runs),
+        cf.results_to_array(fits, det_nums, len(runs)), center_times)
+    dbops.write_run_calibrations(run_db_path, det_nums, run_nums, run_params)
+
+
+def stream_run_chunks(run_csv, det_data, rate_det, chunk_lines, complete,
+                      summary, state, parse_profile=None):
+    """Reads the run csv in chunks for the run database, keeping the rate
+    threshold summary of each chunk and the ingest state up to date as the
+    chunks are consumed, the reading of each chunk is timed as the Parse
+    stage, nested in the stage that consumes the chunks
+
+    Parameters
+    ----------
+    run_csv : str
+        path to the run csv of the batch
+    det_data : list of dict
+        list of dictionary of the detector data
+    rate_det : int
+        the detector whose rates are kept in the summary
+    chunk_lines : int
+        the number of lines parsed at a time
+    complete : bool
+        False if the run csv may still be being written
+    summary : list
+        the rrd.summarize_runs result of each chunk is appended to it
+    state : dict
+        the ingest state, see make_ingest_state, updated after each chunk
+    parse_profile : str
+        the path the profile of the reading of all the chunks is written to,
+        None to not profile it
+
+    Yields
+    ------
+    run_cols : dict
+        dictionary of numpy arrays of the runs of the chunk
+    """
+    chunks = rrd.iter_run_chunks(run_csv, det_data, chunk_lines,
+                                 complete=complete)
+    for run_cols, offset in inst.timed_iter(chunks, "Parse", parse_profile):
+        summary.append(rrd.summarize_runs(run_cols, [rate_det]))
+        inst.count("CsvBytes", offset - state["FileOffset"])
+        # a batch still being written may have grown since it was sized
+        state.update(make_ingest_state(run_csv, run_cols, offset,
+                                       max(offset, state["FileSize"]),
+                                       state["LastRunNum"]))
+        yield run_cols
+
+
+def get_ingest_state(run_db_path, run_csv):
+    """Gets how much of the run csv is already in the run database, if it
+    can be appended to
+
+    Parameters
+    ----------
+    run_db_path : str
+        path to the run database of the batch
+    run_csv : str
+        path to the run csv of the batch
+
+    Returns
+    -------
+    ingest_state : dict
+        see dbops.set_ingest_state, None if the database has to be built
+        from scratch
+    """
+    if not os.path.exists(run_db_path):
+        return None
+    state = dbops.get_ingest_state(run_db_path, run_csv)
+    if state is not None and os.path.getsize(run_csv) < state["FileOffset"]:
+        print "The run csv has shrunk since it was read, rebuilding"
+        return None
+    return state
+
+
+def make_ingest_state(run_csv, run_cols, offset, size, last_run=None):
+    """Makes the record of how much of the run csv has been read
+
+    Parameters
+    ----------
+    run_csv : str
+        path to the run csv of the batch
+    run_cols : dict
+        dictionary of numpy arrays of the runs read
+    offset : int
+        the offset just past the last line read
+    size : int
+        the size of the run csv when it was read
+    last_run : int
+        the last run read previously, used if run_cols has no runs
+
+    Returns
+    -------
+    ingest_state : dict
+        see dbops.set_ingest_state
+    """
+    if len(run_cols["RunNum"]) != 0:
+        last_run = int(run_cols["RunNum"].max())
+    return {"RunDataLocation": run_csv, "LastRunNum": last_run,
+            "FileOffset": offset, "FileSize": size}
+
+
+def append_batch(batch_data, det_data, state, args, writes):
+    """Appends the runs written since the last build to the run database
+
+    Parameters
+    ----------
+    batch_data : dict
+        dictionary of batch information
+    det_data : list of dict
+        list of dictionary of the detector data
+    state : dict
+        how much of the run csv was ingested, see dbops.set_ingest_state
+    args : argparse.Namespace
+        the parsed command line arguments
+    writes : dict
+        the writes the batch needs in the global batch database, see
+        make_batch_writes
+    """
+    run_csv = batch_data["RunDataLocation"]
+    with inst.stage("Parse", profile_path(batch_data, args, "Parse")):
+        run_cols, offset, size = rrd.read_run_tail(run_csv, det_data,
+                                                   state["FileOffset"])
+        inst.count("CsvBytes", offset - state["FileOffset"])
+        if state["LastRunNum"] is not None:
+            # never add a run twice, even if the csv was rewritten in place
+            run_cols = rrd.select_runs(
+                run_cols, run_cols["RunNum"] > state["LastRunNum"])
+    with inst.stage("RunDb", profile_path(batch_data, args, "RunDb")):
+        dbops.append_batch_database(batch_data["RunDbLoc"], run_cols,
+                                    make_ingest_state(run_csv, run_cols,
+                                                      offset, size,
+                                                      state["LastRunNum"]))
+    index_runs(batch_data, writes, state["LastRunNum"])
+
+
+def index_runs(batch_data, writes, after_run=None):
+    """Reads the runs of a batch for the run index of the global batch
+    database, they are written by write_batch_updates
+
+    Parameters
+    ----------
+    batch_data : dict
+        dictionary of batch information
+    writes : dict
+        the writes the batch needs in the global batch database, see
+        make_batch_writes
+    after_run : int
+        Only the runs after this run number are added, None to replace all
+        the runs of the batch, see ri.write_run_intervals
+    """
+    with inst.stage("RunIndex"):
+        writes["RunIntervals"] = ri.read_run_intervals(batch_data["RunDbLoc"],
+                                                       after_run)
+        writes["IndexAfterRun"] = after_run
+        inst.count("RunRows", len(writes["RunIntervals"]))
+
+
+def parse_args(argv):
+    """Parses the command line arguments
+
+    Parameters
+    ----------
+    argv : list of str
+        the command line arguments, without the program name
+
+    Returns
+    -------
+    args : argparse.Namespace
+        the parsed arguments
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("batch_info_file",
+                        help="the batch information csv of the batch, or a "
+                        "directory or glob to process many batches")
+    parser.add_argument("batch_database_path", nargs="?",
+                        default=BATCH_DB_LOCATION,
+                        help="path to the global batch database")
+    parser.add_argument("--det-run-layout", choices=dbops.DET_RUN_LAYOUTS,
+                        default=dbops.DET_RUN_LAYOUTS[0],
+                        help="store the per detector run data in one table "
+                        "per detector or in a single long table with per "
+                        "detector views (default: %(default)s)")
+    parser.add_argument("--vacuum", choices=dbm.VACUUM_MODES,
+                        default=dbm.VACUUM_MODES[0],
+                        help="how free pages are reclaimed after the "
+                        "databases are written (default: %(default)s)")
+    parser.add_argument("--vacuum-threshold", type=float,
+                        default=dbm.FREELIST_THRESHOLD,
+                        help="free page fraction above which the auto "
+                        "vacuum mode runs a full vacuum "
+                        "(default: %(default)s)")
+    parser.add_argument("--schedule-file", default=None,
+                        help="csv or json file of the HFIR cycles, see "
+                        "schedule.load_schedule (default: {0:s})".format(
+                            sch.SCHEDULE_PATH))
+    parser.add_argument("--batch-pattern", default=bscan.BATCH_INFO_PATTERN,
+                        help="file name pattern of the batch information "
+                        "files when searching a directory "
+                        "(default: %(default)s)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only append the runs added to the run csv "
+                        "since the run database was last built, for batches "
+                        "ORCHID reader is still writing, the calibration "
+                        "stages are skipped (combine with --policy "
+                        "batch_table=skip to leave the batch entry alone)")
+    parser.add_argument("--chunk-lines", type=int,
+                        default=rrd.RUN_CHUNK_LINES,
+                        help="number of run csv lines parsed at a time when "
+                        "streaming the run data into the run database, 0 "
+                        "reads the whole csv at once (default: %(default)s)")
+    parser.add_argument("--profile", nargs="?", choices=STAGE_NAMES,
+                        const="RunDb", default=None,
+                        help="write cProfile statistics of a stage to "
+                        "{0:s} next to the batch, the run database stage if "
+                        "none is given".format(
+                            inst.PROFILE_FMT.format("<stage>")))
+    parser.add_argument("--rate-det", type=int, default=fl.RATE_DET_NUM,
+                        help="detector whose rate is used to find the "
+                        "reactor startup and shutdown, it needs thresholds "
+                        "(default: %(default)s)")
+    parser.add_argument("--startup-thresholds", type=float, nargs=2,
+                        default=None, metavar=("OFF", "ON"),
+                        help="rates of the rate detector below which the "
+                        "reactor is off and above which it is on around a "
+                        "startup (default: the built in ones of the "
+                        "detector)")
+    parser.add_argument("--shutdown-thresholds", type=float, nargs=2,
+                        default=None, metavar=("OFF", "ON"),
+                        help="the same around a shutdown")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="run every stage even if the build manifest "
+                        "shows its inputs are unchanged")
+    parser.add_argument("--cal-drift", choices=CAL_DRIFT_MODES,
+                        default=CAL_DRIFT_MODES[0],
+                        help="give each run a calibration interpolated in "
+                        "time between the calibration blocks, or the "
+                        "calibration of its block (default: %(default)s)")
+    parser.add_argument("--processes", type=int, default=None,
+                        help="number of worker processes used when "
+                        "processing many batches (default: one per cpu)")
+    parser.add_argument("--cal-processes", type=int, default=None,
+                        help="number of worker processes used to sum the "
+                        "detectors of a calibration block, forced to 1 when "
+                        "processing many batches (default: one per cpu)")
+    parser.add_argument("--policy-file", default=None,
+                        help="json file of decision policies, see "
+                        "input_sanitizer.load_policy_file")
+    parser.add_argument("--policy", action="append", default=[],
+                        metavar="DECISION=ANSWER",
+                        help="answer the prompts of a decision without "
+                        "asking, for instance run_data_table=skip or "
+                        "sodium_peak=prompt, may be repeated")
+    parser.add_argument("--on-exists", default=None,
+                        choices=sorted(dbops.EXISTS_CHOICES) + ["prompt"],
+                        help="what to do with every table that already "
+                        "exists, individual --policy options take precedence")
+    parser.add_argument("--assume-defaults", action="store_true",
+                        help="answer every prompt that has a default value "
+                        "with it")
+    parser.add_argument("--decision-log", default=None,
+                        help="file every decision made is appended to")
+    return parser.parse_args(argv)
+
+
+def apply_policies(args):
+    """Sets up the decision policies of input_sanitizer from the command line
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        the parsed command line arguments
+    """
+    if args.policy_file is not None:
+        ins.load_policy_file(args.policy_file)
+    if args.on_exists is not None:
+        for decision in dbops.TABLE_DECISIONS:
+            ins.set_policy(decision, args.on_exists)
+    for policy in args.policy:
+        decision, sep, answer = policy.partition("=")
+        if not sep:
+            print "Error: policies must be given as DECISION=ANSWER"
+            sys.exit()
+        ins.set_policy(decision, answer)
+    if args.assume_defaults:
+        ins.set_assume_defaults(True)
+    if args.decision_log is not None:
+        ins.set_decision_log(args.decision_log)
+
+
+def apply_rate_settings(args):
+    """Sets the rate thresholds of the rate detector from the command line,
+    exits with an error if the detector is left without thresholds
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        the parsed command line arguments
+    """
+    fl.set_rate_thresholds(args.rate_det, args.startup_thresholds,
+                           args.shutdown_thresholds)
+    for name, thresholds in [("startup", fl.STARTUP_THRESHOLDS),
+                             ("shutdown", fl.SHUTDOWN_THRESHOLDS)]:
+        if args.rate_det not in thresholds:
+            sys.exit("Error: detector {0:d} has no {1:s} rate thresholds, "
+                     "give them with --{1:s}-thresholds".format(
+                         args.rate_det, name))
+
+
+def handle_batch_data(batch_data, batch_db_path, args, dbcon=None):
     """Attempts to insert the data for the batch into the global batch database
 
     Parameters
@@ -62,29 +788,66 @@ def handle_batch_data(batch_data, batch_db_path):
         dictionary of batch information
     batch_db_path : str
         path to the global batch database
+    args : argparse.Namespace
+        the parsed command line arguments
+    dbcon : sqlite database connection
+        An already open connection to the batch database, if None this
+        process's connection to batch_db_path is used
     """
+    manifest = mfst.load_manifest(batch_data["ManifestLoc"])
+    key = batch_table_key(manifest, batch_data, batch_db_path)
     # attempt to insert the batch data into the global batch database
-    if not dbops.add_batch_data(batch_data, batch_db_path):
+    if not dbops.add_batch_data(batch_data, batch_db_path, dbcon):
+        if (not args.rebuild and
+                mfst.stage_is_current(manifest, "BatchTable", key)):
+            print "Batch information is unchanged, keeping the entry"
+            return
         print "\nBatch information already in database, choose an action"
         print "    1 - Abort execution"
         print "    2 - Overwrite Batch Database Entry"
         print "    3 - Skip Writing Batch Database"
         ans = ins.get_int("Enter Option Number:", inclusive_lower_bound=1,
-                          inclusive_upper_bound=3, default_value=1)
+                          inclusive_upper_bound=3, default_value=1,
+                          decision="batch_table",
+                          choices=dbops.EXISTS_CHOICES)
         if ans == 1:
             print "Aborting execution"
             sys.exit()
         elif ans == 2:
-            dbops.overwrite_batch_data(batch_data, batch_db_path)
+            # with a shared connection the vacuum is done once at the end
+            vacuum_mode = args.vacuum if dbcon is None else "none"
+            dbops.overwrite_batch_data(batch_data, batch_db_path,
+                                       vacuum_mode, args.vacuum_threshold,
+                                       dbcon)
             print "Overwrote batch database entry"
         elif ans == 3:
             print "Skipping insertion of batch data into global batch database"
+            return
     else:
         print "Added batch information to global batch database"
+    mfst.record_stage(manifest, "BatchTable", key, [])
+    mfst.save_manifest(manifest, batch_data["ManifestLoc"])
 
 
-USAGE_INFO = """Usage:
-    {0:s} <batch_info_file> [batch_database_path]"""
+def batch_table_key(manifest, batch_data, batch_db_path):
+    """Makes the build manifest key of the batch table entry of a batch
+
+    Parameters
+    ----------
+    manifest : dict
+        the build manifest of the batch
+    batch_data : dict
+        dictionary of batch information
+    batch_db_path : str
+        path to the global batch database
+
+    Returns
+    -------
+    key : str
+        see mfst.stage_key
+    """
+    return mfst.stage_key(manifest, [batch_data["BatchInfoLoc"]],
+                          ["BatchTable", os.path.abspath(batch_db_path)])
 
 
 if __name__ == "__main__":
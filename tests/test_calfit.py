@@ -0,0 +1,172 @@
+"""Tests of the calibration fits on synthetic sum spectra, no ROOT
+installation is needed to run them
+
+Run from the top of the repository with
+    python -m unittest discover -s tests"""
+import unittest
+import numpy as np
+import odacblib.calfit as cf
+import odacblib.fuzzy_logic as fl
+
+NUM_BINS = 4096
+CHANNELS = np.arange(NUM_BINS) + 0.5
+
+# the energy scale of the synthetic detector, in MeV
+OFFSET = 0.02
+SLOPE = 0.00095
+ENERGIES = OFFSET + SLOPE * CHANNELS
+
+# the peak widths, sigma_E^2 = offset + slope * E, in MeV^2
+WIDTH_SQ_OFFSET = 4e-6
+WIDTH_SQ_SLOPE = 4e-6
+
+# the height of the peaks in counts
+PEAK_HEIGHT = 3000.0
+
+
+def make_spectrum(gammas, seed=0, height=PEAK_HEIGHT):
+    """Makes a sum spectrum with a falling continuum and gamma-ray peaks
+
+    Parameters
+    ----------
+    gammas : list of float
+        The energies of the peaks in MeV
+    seed : int
+        The seed for the random number generator
+    height : float
+        The height of every peak
+
+    Returns
+    -------
+    counts : numpy.ndarray
+        The bin contents with Poisson noise
+    """
+    mean = 5000.0 * np.exp(-ENERGIES / 0.8) + 50.0
+    for gamma in gammas:
+        sigma = np.sqrt(WIDTH_SQ_OFFSET + WIDTH_SQ_SLOPE * gamma)
+        mean += height * np.exp(-0.5 * ((ENERGIES - gamma) / sigma)**2)
+    return np.random.RandomState(seed).poisson(mean).astype(np.float64)
+
+
+def channel_of(energy):
+    """Gets the channel of an energy in the synthetic detector"""
+    return (energy - OFFSET) / SLOPE
+
+
+class TestCalibrateSpectrum(unittest.TestCase):
+    """Tests of cf.calibrate_spectrum and its steps"""
+
+    def test_known_gain(self):
+        """The energy scale of the detector is recovered"""
+        for seed in range(3):
+            result = cf.calibrate_spectrum(
+                CHANNELS, make_spectrum(fl.RX_OFF_GAMMAS, seed),
+                fl.RX_OFF_GAMMAS)
+            self.assertTrue(result["Success"])
+            self.assertEqual(result["NumPeaks"], len(fl.RX_OFF_GAMMAS))
+            self.assertAlmostEqual(result["EnCalSlope"], SLOPE, delta=2e-6)
+            self.assertAlmostEqual(result["EnCalOffset"], OFFSET, delta=2e-3)
+            self.assertAlmostEqual(result["EnCalCurve"], 0.0, delta=1e-9)
+
+    def test_early_off_gammas(self):
+        """Every line of the early reactor off list is used, 24Na included"""
+        result = cf.calibrate_spectrum(
+            CHANNELS, make_spectrum(fl.RX_EARLY_OFF_GAMMAS),
+            fl.RX_EARLY_OFF_GAMMAS)
+        self.assertTrue(result["Success"])
+        self.assertEqual(result["NumPeaks"], len(fl.RX_EARLY_OFF_GAMMAS))
+
+    def test_too_few_peaks(self):
+        """Fewer than two fittable peaks is not a calibration"""
+        for gammas in [[], [1.460820]]:
+            for seed in range(3):
+                result = cf.calibrate_spectrum(
+                    CHANNELS, make_spectrum(gammas, seed), fl.RX_OFF_GAMMAS)
+                self.assertFalse(result["Success"])
+                self.assertLess(result["NumPeaks"], 2)
+                self.assertEqual([result[x] for x in cf.CAL_PARAM_NAMES],
+                                 [0.0] * len(cf.CAL_PARAM_NAMES))
+
+    def test_match_gammas(self):
+        """Each gamma-ray is matched to the candidate at its channel"""
+        positions = np.array([channel_of(x) for x in
+                              [2.614511, 1.173228, 1.460820, 1.332492]])
+        matches = cf.match_gammas(positions, np.ones(len(positions)),
+                                  fl.RX_OFF_GAMMAS)
+        self.assertEqual(matches, [(1.173228, 1), (1.332492, 3),
+                                   (1.460820, 2), (2.614511, 0)])
+
+    def test_fit_peak(self):
+        """The centroid and width of a peak are fit"""
+        counts = make_spectrum([1.460820])
+        sigma = np.sqrt(WIDTH_SQ_OFFSET + WIDTH_SQ_SLOPE * 1.460820) / SLOPE
+        mean, width = cf.fit_peak(CHANNELS, counts, channel_of(1.460820) + 2,
+                                  sigma * cf.FWHM_PER_SIGMA)
+        self.assertAlmostEqual(mean, channel_of(1.460820), delta=0.5)
+        self.assertAlmostEqual(width, sigma, delta=0.1 * sigma)
+
+    def test_fit_noise_rejected(self):
+        """A fit to the bare continuum is rejected"""
+        mean, width = cf.fit_peak(CHANNELS, make_spectrum([]),
+                                  channel_of(1.460820), 8.0)
+        self.assertIsNone(mean)
+        self.assertIsNone(width)
+
+
+class TestRunCalibrations(unittest.TestCase):
+    """Tests of collecting and interpolating the block calibrations"""
+
+    def test_results_to_array(self):
+        """Failed and missing blocks are nan"""
+        good = dict((x, float(i)) for i, x in enumerate(cf.CAL_PARAM_NAMES))
+        good["Success"] = True
+        bad = dict((x, 0.0) for x in cf.CAL_PARAM_NAMES)
+        bad["Success"] = False
+        block_params = cf.results_to_array({(3, 0): good, (3, 1): bad,
+                                            (5, 1): good}, [3, 5], 2)
+        self.assertEqual(block_params.shape, (2, 2, len(cf.CAL_PARAM_NAMES)))
+        self.assertEqual(list(block_params[0, 0]),
+                         range(len(cf.CAL_PARAM_NAMES)))
+        self.assertTrue(np.isnan(block_params[1, 0]).all())
+        self.assertTrue(np.isnan(block_params[0, 1]).all())
+        self.assertEqual(list(block_params[1, 1]),
+                         range(len(cf.CAL_PARAM_NAMES)))
+
+    def test_one_block(self):
+        """With one block every run takes its calibration"""
+        block_params = np.arange(6.0).reshape(1, 1, 6)
+        run_params = cf.interpolate_run_calibrations(
+            np.array([100.0]), block_params, np.array([0.0, 100.0, 500.0]))
+        self.assertEqual(run_params.shape, (3, 1, 6))
+        for run in range(3):
+            self.assertEqual(list(run_params[run, 0]), range(6))
+
+    def test_interpolation(self):
+        """Runs are interpolated between blocks, and held past the ends"""
+        block_params = np.array([[[1.0] * 6], [[3.0] * 6]])
+        run_params = cf.interpolate_run_calibrations(
+            np.array([100.0, 200.0]), block_params,
+            np.array([0.0, 150.0, 175.0, 300.0]))
+        self.assertEqual(list(run_params[:, 0, 0]), [1.0, 2.0, 2.5, 3.0])
+
+    def test_nan_blocks(self):
+        """Uncalibrated blocks are skipped, and detectors without any
+        calibrated block are nan"""
+        block_params = np.full((3, 2, 6), np.nan)
+        block_params[0, 0] = 1.0
+        block_params[2, 0] = 3.0
+        block_times = np.array([100.0, 150.0, 200.0])
+        run_params = cf.interpolate_run_calibrations(
+            block_times, block_params, np.array([100.0, 150.0, 200.0]))
+        self.assertEqual(list(run_params[:, 0, 1]), [1.0, 2.0, 3.0])
+        self.assertTrue(np.isnan(run_params[:, 1]).all())
+        # a block without a time is skipped as well
+        block_params[1, 0] = 10.0
+        block_times[1] = np.nan
+        run_params = cf.interpolate_run_calibrations(
+            block_times, block_params, np.array([150.0]))
+        self.assertEqual(list(run_params[:, 0, 1]), [2.0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,181 @@
+"""Tests of the automatic 24Na peak classification on synthetic early reactor
+off spectra, no ROOT installation is needed to run them
+
+Run from the top of the repository with
+    python -m unittest discover -s tests"""
+import sys
+import types
+import unittest
+import numpy as np
+import odacblib.peakfind as pkf
+
+NUM_RUNS = 80
+NUM_BINS = 256
+RUN_NUMS = range(100, 100 + NUM_RUNS)
+
+# falling continuum with the 2614 keV line below the 24Na peak
+BINS = np.arange(NUM_BINS, dtype=np.float64)
+BACKGROUND = (2000.0 * np.exp(-BINS / 80.0) + 20.0 +
+              400.0 * np.exp(-0.5 * ((BINS - 150.0) / 3.0) ** 2))
+SODIUM_SHAPE = np.exp(-0.5 * ((BINS - 200.0) / 3.5) ** 2)
+
+# the 24Na peak height in the first run and its decay constant in runs
+SODIUM_HEIGHT = 3000.0
+DECAY_RUNS = 5.0
+
+
+def make_spectra(heights, seed=0):
+    """Makes the spectra of a stretch of runs
+
+    Parameters
+    ----------
+    heights : numpy.ndarray
+        The height of the 24Na peak in each run
+    seed : int
+        The seed for the random number generator
+
+    Returns
+    -------
+    mean : numpy.ndarray
+        The expected (runs x bins) bin contents
+    spectra : numpy.ndarray
+        The (runs x bins) bin contents with Poisson noise
+    """
+    rng = np.random.RandomState(seed)
+    mean = BACKGROUND + np.asarray(heights)[:, np.newaxis] * SODIUM_SHAPE
+    return mean, rng.poisson(mean).astype(np.float64)
+
+
+def decaying_heights():
+    """Gets the peak heights of a stretch where the 24Na decays away"""
+    return SODIUM_HEIGHT * np.exp(-np.arange(NUM_RUNS) / DECAY_RUNS)
+
+
+class TestClassifySodiumRuns(unittest.TestCase):
+    """Tests of pkf.classify_sodium_runs"""
+
+    def test_transition_found(self):
+        """The run where the decaying peak fades out is found"""
+        for seed in range(5):
+            mean, spectra = make_spectra(decaying_heights(), seed)
+            runs_list, confidence, confident = pkf.classify_sodium_runs(
+                RUN_NUMS, spectra)
+            self.assertTrue(confident)
+            self.assertGreaterEqual(confidence, pkf.MIN_CONFIDENCE)
+            self.assertEqual(len(runs_list), 2)
+            self.assertEqual(runs_list[0][0], RUN_NUMS[0])
+            self.assertEqual(runs_list[0][2], 1)
+            self.assertEqual(runs_list[1][1], RUN_NUMS[-1])
+            self.assertEqual(runs_list[1][2], 0)
+            self.assertEqual(runs_list[1][0], runs_list[0][1] + 1)
+            # the run where the noiseless significance drops below threshold
+            window = pkf.locate_decaying_peak(spectra)
+            expected = np.nonzero(pkf.peak_significance(
+                mean, window, BACKGROUND) < pkf.PEAK_SIG_THRESH)[0][0]
+            self.assertLessEqual(abs(runs_list[1][0] - RUN_NUMS[expected]),
+                                 2)
+
+    def test_window_located(self):
+        """The located window covers the 24Na peak, not the 2614 keV line"""
+        spectra = make_spectra(decaying_heights())[1]
+        lo_bin, hi_bin = pkf.locate_decaying_peak(spectra)
+        self.assertTrue(lo_bin < 200 < hi_bin)
+        self.assertGreater(lo_bin, 150)
+
+    def test_no_peak_not_confident(self):
+        """Without any 24Na peak the user has to be asked"""
+        spectra = make_spectra(np.zeros(NUM_RUNS))[1]
+        runs_list, confidence, confident = pkf.classify_sodium_runs(
+            RUN_NUMS, spectra)
+        self.assertFalse(confident)
+        self.assertEqual(runs_list, [(RUN_NUMS[0], RUN_NUMS[-1], 0)])
+
+    def test_constant_peak_not_confident(self):
+        """A peak that does not decay cannot be located, so the user has to
+        be asked"""
+        spectra = make_spectra(np.ones(NUM_RUNS) * SODIUM_HEIGHT)[1]
+        confident = pkf.classify_sodium_runs(RUN_NUMS, spectra)[2]
+        self.assertFalse(confident)
+
+
+class FakeHist(object):
+    """Stands in for a ROOT.TH1 holding a spectrum"""
+
+    def __init__(self, contents):
+        self.contents = contents
+
+    def GetNbinsX(self):
+        return len(self.contents)
+
+    def GetBinContent(self, ind):
+        return self.contents[ind - 1]
+
+
+class FakeFile(object):
+    """Stands in for a ROOT.TFile holding the Det_8 spectra of the runs"""
+
+    spectra = None
+
+    def __init__(self, fname):
+        self.fname = fname
+
+    def Get(self, name):
+        run_num = int(name.split("_")[3])
+        return FakeHist(FakeFile.spectra[RUN_NUMS.index(run_num)])
+
+    def Close(self):
+        pass
+
+
+class TestFindSodiumPeakRuns(unittest.TestCase):
+    """Tests that ro.find_sodium_peak_runs only asks the user when the
+    automatic classification is not confident"""
+
+    def setUp(self):
+        if "ROOT" not in sys.modules:
+            try:
+                __import__("ROOT")
+            except ImportError:
+                sys.modules["ROOT"] = types.ModuleType("ROOT")
+        import odacblib.rootops as ro
+        self.ro = ro
+        self.saved = (ro.rt, ro.ask_sodium_peak_runs)
+        self.asked = []
+        ro.rt = types.ModuleType("ROOT")
+        ro.rt.TFile = FakeFile
+        ro.ask_sodium_peak_runs = self.ask
+
+    def tearDown(self):
+        self.ro.rt, self.ro.ask_sodium_peak_runs = self.saved
+
+    def ask(self, lo_bnd, hi_bnd, root_input):
+        """Records that the user would have been asked"""
+        self.asked.append((lo_bnd, hi_bnd, root_input))
+        return [(lo_bnd, hi_bnd, 1)]
+
+    def find(self, heights):
+        """Runs find_sodium_peak_runs on the spectra of the peak heights"""
+        FakeFile.spectra = make_spectra(heights)[1]
+        return self.ro.find_sodium_peak_runs(RUN_NUMS[0], RUN_NUMS[-1],
+                                             "calibration.root")
+
+    def test_transition_not_asked(self):
+        """A clear transition is used without asking"""
+        runs_list = self.find(decaying_heights())
+        self.assertEqual(self.asked, [])
+        self.assertEqual(len(runs_list), 2)
+
+    def test_no_peak_asked(self):
+        """Without a peak the user is asked"""
+        self.assertEqual(self.find(np.zeros(NUM_RUNS)),
+                         [(RUN_NUMS[0], RUN_NUMS[-1], 1)])
+        self.assertEqual(len(self.asked), 1)
+
+    def test_constant_peak_asked(self):
+        """With a peak that never decays the user is asked"""
+        self.find(np.ones(NUM_RUNS) * SODIUM_HEIGHT)
+        self.assertEqual(len(self.asked), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
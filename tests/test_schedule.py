@@ -0,0 +1,96 @@
+"""Tests of the per run classification against the reactor schedule
+
+Run from the top of the repository with
+    python -m unittest discover -s tests"""
+import unittest
+import datetime as dt
+import numpy as np
+import odacblib.schedule as sch
+
+# two cycles whose startups and shutdowns are not at midnight
+SCHEDULE = sch.make_schedule(
+    [473, 474],
+    [dt.datetime(2017, 6, 13, 7, 58), dt.datetime(2017, 7, 25, 4, 30)],
+    [dt.datetime(2017, 7, 8, 14, 29), dt.datetime(2017, 8, 18, 9, 15)])
+
+
+def classify(runs):
+    """Classifies runs against SCHEDULE
+
+    Parameters
+    ----------
+    runs : list of tuple
+        The start and stop datetime of each run
+
+    Returns
+    -------
+    run_status : dict
+        The sch.classify_runs result
+    """
+    return sch.classify_runs(np.array([x[0] for x in runs],
+                                      dtype="datetime64[us]"),
+                             np.array([x[1] for x in runs],
+                                      dtype="datetime64[us]"),
+                             SCHEDULE)
+
+
+def hourly_runs(day):
+    """Gets hour long runs covering a day
+
+    Parameters
+    ----------
+    day : datetime.datetime
+        Midnight of the day
+
+    Returns
+    -------
+    runs : list of tuple
+        The start and stop of each run
+    """
+    hour = dt.timedelta(hours=1)
+    return [(day + i * hour, day + (i + 1) * hour) for i in range(24)]
+
+
+class TestClassifyRuns(unittest.TestCase):
+    """Tests of sch.classify_runs"""
+
+    def test_startup_day(self):
+        """Runs on a startup day are off, then startup, then on"""
+        status = classify(hourly_runs(dt.datetime(2017, 7, 25)))
+        expected = [0] * 4 + [1] + [2] * 19
+        self.assertEqual(list(status["StatusNum"]), expected)
+        self.assertEqual(list(status["StartCycleNum"]),
+                         [473] * 5 + [474] * 19)
+        self.assertEqual(list(status["StopCycleNum"]),
+                         [473] * 4 + [474] * 20)
+
+    def test_shutdown_day(self):
+        """Runs on a shutdown day are on, then shutdown, then off"""
+        status = classify(hourly_runs(dt.datetime(2017, 7, 8)))
+        expected = [2] * 14 + [3] + [0] * 9
+        self.assertEqual(list(status["StatusNum"]), expected)
+        self.assertTrue(np.isnan(status["HoursSinceShutdown"][14]))
+        self.assertAlmostEqual(status["HoursSinceShutdown"][15],
+                               31.0 / 60.0)
+
+    def test_unknown(self):
+        """Runs that cannot be placed get UNKNOWN_VALUE"""
+        status = classify([
+            (dt.datetime(2017, 1, 1), dt.datetime(2017, 1, 2)),
+            (dt.datetime(2017, 7, 1), dt.datetime(2017, 7, 30)),
+            (dt.datetime(2017, 9, 1), dt.datetime(2017, 9, 2)),
+            (dt.datetime(2017, 7, 2, 1), dt.datetime(2017, 7, 2))])
+        self.assertEqual(list(status["StatusNum"]),
+                         [sch.UNKNOWN_VALUE] * 4)
+
+    def test_first_startup(self):
+        """A run that straddles the first startup is a startup"""
+        status = classify([(dt.datetime(2017, 6, 13, 7),
+                            dt.datetime(2017, 6, 13, 8))])
+        self.assertEqual(list(status["StatusNum"]), [1])
+        self.assertEqual(list(status["StartCycleNum"]), [sch.UNKNOWN_VALUE])
+        self.assertEqual(list(status["StopCycleNum"]), [473])
+
+
+if __name__ == "__main__":
+    unittest.main()